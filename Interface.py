@@ -1,22 +1,217 @@
+import io
+import asyncio
 import os
-import csv
+import atexit
+import json
+import logging
+import struct
+import threading
 import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from itertools import count, islice
+from queue import Empty, Full
 import psycopg2
 from psycopg2 import sql, extras
 import multiprocessing as mp
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# psycopg 3 chỉ cần cho engine asyncio (method = 'async')
+try:
+    from psycopg import AsyncConnection
+except ImportError:
+    AsyncConnection = None
 
 # Cấu hình chung
 BATCH_SIZE               = 10000
 RANGE_TABLE_PREFIX       = 'range_part'
 RROBIN_TABLE_PREFIX      = 'rrobin_part'
+HASH_TABLE_PREFIX        = 'hash_part'
 RROBIN_INSERT_SEQ        = 'rrobin_insert_seq'
 INPUT_FILE_PATH          = 'test_data.dat'
+RATING_COLUMNS           = ('userid', 'movieid', 'rating')
+PARTITION_META_TABLE     = 'partition_metadata'
+PARTITION_JOB_TABLE      = 'partition_jobs'
+PARTITION_CHUNK_TABLE    = 'partition_job_chunks'
+
+# Các cột có thể dùng làm khóa phân vùng băm (hashpartition)
+HASH_KEYS = ('userid', 'movieid')
+
+# Các index phụ có thể tạo trên mảnh: tên -> định nghĩa (phương thức, cột)
+# BRIN trên rating chỉ hữu ích với mảnh range, nơi rating của mỗi mảnh nằm trong một khoảng hẹp
+FRAGMENT_INDEXES = {
+    'userid':      'btree (userid)',
+    'movieid':     'btree (movieid)',
+    'user_movie':  'btree (userid, movieid)',
+    'rating_brin': 'brin (rating)',
+}
+
+# Index mặc định của createfragmentindexes theo scheme
+DEFAULT_FRAGMENT_INDEXES = {
+    'range':  ('userid', 'movieid', 'rating_brin'),
+    'rrobin': ('userid', 'movieid'),
+    'hash':   ('userid', 'movieid'),
+}
+
+# Tự điều chỉnh (autotune): batch size nằm trong [AUTOTUNE_MIN_BATCH, AUTOTUNE_MAX_BATCH],
+# mỗi lần đo gồm AUTOTUNE_WINDOW batch, thông lượng không tăng quá AUTOTUNE_TOLERANCE thì đổi
+# hướng, sau AUTOTUNE_REVERSALS lần đổi hướng thì tham số đó dừng lại
+AUTOTUNE_MIN_BATCH = 1000
+AUTOTUNE_MAX_BATCH = 160000
+AUTOTUNE_WINDOW    = 4
+AUTOTUNE_TOLERANCE = 0.05
+AUTOTUNE_REVERSALS = 3
+
+# Job phân vùng có checkpoint (method = 'checkpoint'): số dòng ước lượng của mỗi chunk
+CHECKPOINT_CHUNK_ROWS = 100000
+
+# Số kết nối tối đa giữ trong pool tới mỗi node khác khi mảnh được đặt trên nhiều node
+NODE_POOL_SIZE = 8
+
+# Ước lượng số dòng trên một block 8KB của bảng (3 cột INTEGER, INTEGER, REAL)
+_ROWS_PER_BLOCK = 200
+
+# Tiền tố bảng mảnh của từng scheme phân vùng
+_SCHEME_PREFIXES = {
+    'range':  RANGE_TABLE_PREFIX,
+    'rrobin': RROBIN_TABLE_PREFIX,
+    'hash':   HASH_TABLE_PREFIX,
+}
 
 # Password Postgre DB
 DB_PASSWORD              = '123456'
 
 
+# Đo đạc các thao tác: mỗi hàm công khai mở một span ghi thời gian từng giai đoạn
+# (perf_counter), bộ đếm số dòng và thống kê của worker, khi kết thúc gửi một event dạng dict
+# tới các sink đã đăng ký. Không có sink nào thì span là đối tượng rỗng dùng chung
+_METRIC_SINKS = []
+
+# Đăng ký sink: hàm hoặc đối tượng callable nhận một event dict
+def addmetricsink(sink):
+    _METRIC_SINKS.append(sink)
+    return sink
+
+# Gỡ một sink đã đăng ký
+def removemetricsink(sink):
+    if sink in _METRIC_SINKS:
+        _METRIC_SINKS.remove(sink)
+
+# Gỡ mọi sink, tắt hoàn toàn việc đo đạc
+def clearmetricsinks():
+    del _METRIC_SINKS[:]
+
+# Sink ghi event qua module logging (mặc định logger của module này, mức INFO)
+class LoggingSink(object):
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def __call__(self, event):
+        self.logger.log(self.level, "[%s] Completed in %.3f seconds. %s", event['operation'],
+                        event['seconds'], json.dumps(event, default=str))
+
+# Sink ghi mỗi event thành một dòng JSON vào file (ghi nối tiếp, an toàn giữa các luồng)
+class JsonLinesSink(object):
+    def __init__(self, path):
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        removemetricsink(self)
+        self._file.close()
+
+    def __enter__(self):
+        return addmetricsink(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Span của một thao tác đang chạy
+class _Span(object):
+    def __init__(self, operation, attrs):
+        self.event = {'operation': operation}
+        self.event.update(attrs)
+        self.phases = {}
+        self.counters = {}
+        self._start = time.perf_counter()
+
+    # Đo thời gian một giai đoạn, cộng dồn nếu giai đoạn lặp lại
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addphase(name, time.perf_counter() - t0)
+
+    # Cộng thời gian đã đo ở nơi khác (ví dụ trong worker) vào một giai đoạn
+    def addphase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.event[name] = value
+
+    def finish(self, error=None):
+        self.event['seconds'] = time.perf_counter() - self._start
+        self.event['phases'] = self.phases
+        self.event['counters'] = self.counters
+        if error is not None:
+            self.event['error'] = error
+        for sink in list(_METRIC_SINKS):
+            try:
+                sink(self.event)
+            except Exception:
+                logging.getLogger(__name__).exception("Metric sink %r failed", sink)
+
+# Span rỗng dùng khi không có sink: mọi thao tác đều không làm gì
+class _NullSpan(object):
+    _PHASE = nullcontext()
+
+    def phase(self, name):
+        return self._PHASE
+
+    def addphase(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+# Mở span cho một thao tác, gửi event khi khối lệnh kết thúc (kể cả khi lỗi)
+@contextmanager
+def _span(operation, **attrs):
+    if not _METRIC_SINKS:
+        yield _NULL_SPAN
+        return
+    span = _Span(operation, attrs)
+    try:
+        yield span
+    except BaseException as e:
+        span.finish(repr(e))
+        raise
+    span.finish()
+
 # Hàm chèn dữ liệu theo từng batch vào mảnh phân vùng
 def batchinsert(tableName, columnTuples, dataTuples, batchSize, insertcur):
     for i in range(0, len(dataTuples), batchSize):
@@ -28,16 +223,176 @@ def batchinsert(tableName, columnTuples, dataTuples, batchSize, insertcur):
                            VALUES {values_str} """
         insertcur.execute(insert_query)
 
-# Hàm chuyển đổi dữ liệu từ file .dat sang file .csv
-def _preprocess_raw_to_csv(raw_path, csv_path):
-    with open(raw_path, 'r', encoding='utf-8') as fin, \
-         open(csv_path, 'w', encoding='utf-8', newline='') as fout:
-        writer = csv.writer(fout)
-        for line in fin:
-            parts = line.strip().split("::")
+# Các writer ghi một danh sách tuple (userid, movieid, rating) vào một mảnh
+# Mọi writer có cùng giao diện write(cur, tableName, dataTuples) để các worker dùng chung
+
+# Writer dùng INSERT ... VALUES nối chuỗi (đường ghi cũ qua batchinsert)
+class InsertWriter(object):
+    name = 'insert'
+
+    def __init__(self, columnTuples=RATING_COLUMNS, batchSize=BATCH_SIZE):
+        self.columns = columnTuples
+        self.batchSize = batchSize
+
+    def write(self, cur, tableName, dataTuples):
+        batchinsert(tableName, self.columns, dataTuples, self.batchSize, cur)
+
+# Writer dùng COPY định dạng text, bộ đệm StringIO được dùng lại giữa các lần ghi
+class CopyTextWriter(object):
+    name = 'text'
+
+    def __init__(self, columnTuples=RATING_COLUMNS):
+        self.columns = columnTuples
+        self._buf = io.StringIO()
+
+    def write(self, cur, tableName, dataTuples):
+        if not dataTuples:
+            return
+        buf = self._buf
+        buf.seek(0)
+        buf.truncate()
+        for row in dataTuples:
+            buf.write("\t".join(r"\N" if v is None else str(v) for v in row))
+            buf.write("\n")
+        buf.seek(0)
+        cur.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN").format(
+                sql.Identifier(tableName), sql.SQL(", ").join(map(sql.Identifier, self.columns))),
+            buf
+        )
+
+# Writer dùng COPY định dạng binary của PostgreSQL cho bảng (INTEGER, INTEGER, REAL)
+# Mỗi dòng được pack_into thẳng vào một bytearray được dùng lại giữa các lần ghi
+class CopyBinaryWriter(object):
+    name = 'binary'
+
+    _HEADER  = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+    _TRAILER = struct.pack("!h", -1)
+    _ROW     = struct.Struct("!hiiiiif")
+
+    def __init__(self, columnTuples=RATING_COLUMNS):
+        self.columns = columnTuples
+        self._buf = bytearray()
+
+    # Mã hóa một dòng có thể chứa NULL (độ dài trường -1), dùng khi pack_into thất bại
+    @staticmethod
+    def _pack_row(row):
+        out = [struct.pack("!h", len(row))]
+        for v, fmt in zip(row, ("!i", "!i", "!f")):
+            out.append(struct.pack("!i", -1) if v is None else struct.pack("!i", 4) + struct.pack(fmt, v))
+        return b"".join(out)
+
+    # Mã hóa danh sách dòng thành một khối dữ liệu COPY binary hoàn chỉnh (header + dòng + trailer)
+    # Kết quả trỏ vào bộ đệm dùng chung nên chỉ hợp lệ tới lần encode tiếp theo
+    def encode(self, dataTuples):
+        row_struct = self._ROW
+        header_size = len(self._HEADER)
+        size = header_size + row_struct.size * len(dataTuples) + len(self._TRAILER)
+        buf = self._buf
+        if len(buf) < size:
+            buf.extend(bytes(size - len(buf)))
+
+        buf[:header_size] = self._HEADER
+        offset = header_size
+        try:
+            pack_into = row_struct.pack_into
+            row_size = row_struct.size
+            for row in dataTuples:
+                pack_into(buf, offset, 3, 4, row[0], 4, row[1], 4, row[2])
+                offset += row_size
+        except struct.error:
+            return self._HEADER + b"".join(map(self._pack_row, dataTuples)) + self._TRAILER
+        buf[offset:offset + len(self._TRAILER)] = self._TRAILER
+        return memoryview(buf)[:size]
+
+    def write(self, cur, tableName, dataTuples):
+        if not dataTuples:
+            return
+        cur.copy_expert(
+            sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT binary)").format(
+                sql.Identifier(tableName), sql.SQL(", ").join(map(sql.Identifier, self.columns))),
+            io.BytesIO(self.encode(dataTuples))
+        )
+
+WRITERS = {
+    InsertWriter.name:     InsertWriter,
+    CopyTextWriter.name:   CopyTextWriter,
+    CopyBinaryWriter.name: CopyBinaryWriter,
+}
+
+# Tạo writer theo tên ('insert', 'text', 'binary') hoặc trả lại nguyên writer đã tạo sẵn
+def _make_writer(writer, columnTuples=RATING_COLUMNS):
+    if isinstance(writer, str):
+        if writer not in WRITERS:
+            raise ValueError(f"Unknown writer: {writer}")
+        return WRITERS[writer](columnTuples)
+    return writer
+
+# Lớp đọc file .dat theo dạng luồng cho COPY ... FROM STDIN
+# Mỗi dòng "userid::movieid::rating::timestamp" được chuyển ngay sang định dạng
+# text của COPY ("userid\tmovieid\trating\n") khi COPY gọi read(), bộ đệm chỉ
+# giữ tối đa khoảng một lần read() cộng một nhóm chunk_lines dòng nên không cần file tạm
+# limit: số byte tối đa được đọc kể từ vị trí hiện tại của fin (dùng khi nạp song song)
+class _RatingsDatStream(object):
+    def __init__(self, fin, chunk_lines=BATCH_SIZE, limit=None):
+        self._fin = fin
+        self._chunk_lines = chunk_lines
+        self._remaining = limit
+        self._buf = bytearray()
+        self._eof = False
+        self.rows = 0
+
+    # Đọc tối đa chunk_lines dòng, dừng lại khi đã đọc hết limit byte
+    def _read_lines(self):
+        if self._remaining is None:
+            return list(islice(self._fin, self._chunk_lines))
+        lines = []
+        while self._remaining > 0 and len(lines) < self._chunk_lines:
+            line = self._fin.readline()
+            if not line:
+                break
+            self._remaining -= len(line)
+            lines.append(line)
+        return lines
+
+    # Đọc thêm một nhóm dòng từ file và chuyển sang định dạng COPY
+    def _fill(self):
+        lines = self._read_lines()
+        if not lines:
+            self._eof = True
+            return
+        out = []
+        for line in lines:
+            parts = line.strip().split(b"::")
             if len(parts) < 3:
                 continue
-            writer.writerow([parts[0], parts[1], parts[2]])
+            out.append(b"\t".join(parts[:3]))
+        if out:
+            self.rows += len(out)
+            self._buf += b"\n".join(out)
+            self._buf += b"\n"
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buf) < size):
+            self._fill()
+        if size is None or size < 0 or size >= len(self._buf):
+            data = bytes(self._buf)
+            self._buf.clear()
+        else:
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+        return data
+
+    def readline(self, size=-1):
+        while not self._eof and b"\n" not in self._buf:
+            self._fill()
+        end = self._buf.find(b"\n")
+        end = len(self._buf) if end < 0 else end + 1
+        if size is not None and 0 <= size < end:
+            end = size
+        data = bytes(self._buf[:end])
+        del self._buf[:end]
+        return data
 
 # Đếm số lượng mảnh sau khi chia 
 def _count_partitions(prefix, openconnection):
@@ -52,70 +407,1393 @@ def _count_partitions(prefix, openconnection):
     cur.close()
     return cnt
 
-# Hàm COPY dữ liệu vào DB
-def loadratings(ratingstablename, ratingsfilepath, openconnection):
-    # Mở kết nối
-    conn = openconnection
-    cur = conn.cursor()
-    # Tên file CSV tạm 
-    temp_csv = ratingstablename + '_temp.csv'
+# Lấy thông tin kết nối từ openconnection để các tiến trình con tự mở kết nối riêng
+def _get_conn_info(openconnection):
+    dsn_params = openconnection.get_dsn_parameters()
+    return {
+        'dbname':   dsn_params['dbname'],
+        'user':     dsn_params['user'],
+        'password': DB_PASSWORD,
+        'host':     dsn_params.get('host', 'localhost'),
+        'port':     dsn_params.get('port', '5432')
+    }
 
-    # Thời gian bắt đầu
-    start = time.time()
+# Pool worker dùng lại giữa các lần phân vùng
+# Mỗi tiến trình worker mở một kết nối duy nhất trong initializer và giữ nó suốt đời pool,
+# chế độ luồng dùng ThreadedConnectionPool của psycopg2. Các pool được giữ theo conn_info
+_WORKER_CONN      = None
+_WORKER_CONN_INFO = None
+_PROCESS_POOLS    = {}
+_THREAD_POOLS     = {}
+_RETIRED_POOLS    = []
+_INHERITED_POOLS  = None
 
-    # Xóa bảng nếu đã tồn tại
-    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(ratingstablename)))
-    conn.commit()
+# Khóa định danh conn_info để tra cứu pool
+def _conn_key(conn_info):
+    return tuple(sorted(conn_info.items()))
+
+# Initializer của tiến trình worker: mở kết nối bền vững dùng cho mọi task
+# Tiến trình fork kế thừa các pool luồng của tiến trình cha, kết nối trong đó dùng chung socket
+# với tiến trình cha nên worker bỏ chúng để tự mở kết nối riêng; không đóng (đóng sẽ kết thúc
+# phiên của tiến trình cha), chỉ giữ tham chiếu để chúng không bị giải phóng
+def _init_worker(conn_info):
+    global _WORKER_CONN, _WORKER_CONN_INFO, _INHERITED_POOLS
+    _INHERITED_POOLS = (dict(_THREAD_POOLS), list(_RETIRED_POOLS))
+    _THREAD_POOLS.clear()
+    _RETIRED_POOLS.clear()
+    _WORKER_CONN_INFO = conn_info
+    _WORKER_CONN = psycopg2.connect(**conn_info)
 
-    # Tạo bảng ratings gốc mới
+# Lấy kết nối cho một task của worker: kết nối bền vững của tiến trình, kết nối mượn từ
+# ThreadedConnectionPool, hoặc kết nối mới (đóng lại sau task) khi chạy ngoài pool
+# Task tự commit; lỗi thì rollback để kết nối còn dùng lại được
+@contextmanager
+def _worker_connection(conn_info):
+    global _WORKER_CONN
+    key = _conn_key(conn_info)
+    if _WORKER_CONN_INFO is not None and _conn_key(_WORKER_CONN_INFO) == key:
+        if _WORKER_CONN is None or _WORKER_CONN.closed:
+            _WORKER_CONN = psycopg2.connect(**conn_info)
+        conn, release = _WORKER_CONN, None
+    elif key in _THREAD_POOLS:
+        conn_pool = _THREAD_POOLS[key][0]
+        conn = conn_pool.getconn()
+        release = lambda c: conn_pool.putconn(c)
+    else:
+        conn = psycopg2.connect(**conn_info)
+        release = lambda c: c.close()
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if release is not None:
+            release(conn)
+
+# Lấy (hoặc tạo mới) pool tiến trình có kết nối bền vững cho conn_info
+# Mỗi conn_info giữ một pool: cần số tiến trình khác thì pool cũ được đóng (chờ task đang chạy
+# xong, các kết nối của nó đóng theo tiến trình) rồi thay bằng pool mới, nên số kết nối rảnh
+# không vượt quá số tiến trình của lần gọi gần nhất
+def _get_process_pool(conn_info, processes):
+    key = _conn_key(conn_info)
+    entry = _PROCESS_POOLS.get(key)
+    if entry is not None and entry[1] != processes:
+        entry[0].close()
+        entry[0].join()
+        entry = None
+    if entry is None:
+        entry = _PROCESS_POOLS[key] = (Pool(processes=processes, initializer=_init_worker,
+                                            initargs=(conn_info,)), processes)
+    return entry[0]
+
+# Lấy (hoặc tạo mới) cặp ThreadedConnectionPool + ThreadPoolExecutor cho conn_info
+# Cần pool lớn hơn thì pool cũ được thay chứ không đóng ngay: task đang chạy và kết nối đang được
+# mượn vẫn dùng tiếp được (kết nối trả về đúng pool đã cho mượn), pool cũ được đóng ở closeworkerpools
+def _get_thread_pool(conn_info, threads):
+    key = _conn_key(conn_info)
+    entry = _THREAD_POOLS.get(key)
+    if entry is None or entry[2] < threads:
+        if entry is not None:
+            entry[1].shutdown(wait=False)
+            _RETIRED_POOLS.append(entry[0])
+        entry = _THREAD_POOLS[key] = (
+            ThreadedConnectionPool(1, threads, **conn_info),
+            ThreadPoolExecutor(max_workers=threads),
+            threads,
+        )
+    return entry[1]
+
+# Chạy danh sách task song song trên pool dùng lại được
+# executor = 'process': pool tiến trình (mặc định), 'thread': pool luồng trong tiến trình hiện tại
+def _run_tasks(func, tasks, conn_info, numworkers=None, executor='process'):
+    if not tasks:
+        return []
+    if numworkers is None:
+        numworkers = mp.cpu_count()
+    if executor == 'process':
+        return _get_process_pool(conn_info, numworkers).map(func, tasks)
+    if executor == 'thread':
+        return list(_get_thread_pool(conn_info, numworkers).map(func, tasks))
+    raise ValueError(f"Unknown executor: {executor}")
+
+# Đóng mọi pool worker và kết nối mà chúng đang giữ
+def closeworkerpools():
+    for pool, _ in _PROCESS_POOLS.values():
+        pool.terminate()
+        pool.join()
+    _PROCESS_POOLS.clear()
+    for conn_pool, executor, _ in _THREAD_POOLS.values():
+        executor.shutdown()
+        conn_pool.closeall()
+    _THREAD_POOLS.clear()
+    for conn_pool in _RETIRED_POOLS:
+        conn_pool.closeall()
+    _RETIRED_POOLS.clear()
+
+atexit.register(closeworkerpools)
+
+# Đặt mảnh trên nhiều node: mỗi node là một DSN (chuỗi libpq hoặc URI) tới một PostgreSQL khác
+# Bản đồ đặt mảnh (placement) là danh sách DSN theo chỉ số mảnh, None nghĩa là mọi mảnh nằm ở
+# cơ sở dữ liệu của openconnection (node điều phối). Kết nối tới các node đi qua
+# ThreadedConnectionPool theo conn_info giống pool worker
+_NODE_POOL_LOCK = threading.Lock()
+
+# Thông tin kết nối của một node từ DSN
+def _node_conn_info(dsn):
+    conn_info = psycopg2.extensions.parse_dsn(dsn)
+    conn_info.setdefault('host', 'localhost')
+    conn_info.setdefault('port', '5432')
+    return conn_info
+
+# Định danh một cơ sở dữ liệu (host, port, dbname) để so sánh node với node điều phối
+def _node_key(conn_info):
+    return (conn_info.get('host', 'localhost'), str(conn_info.get('port', '5432')), conn_info.get('dbname'))
+
+# Bản đồ đặt mảnh mặc định: mảnh i nằm trên node i % len(nodes)
+# Node trùng với cơ sở dữ liệu điều phối được ghi là None (mảnh cục bộ)
+def _place_fragments(openconnection, nodes, numberofpartitions):
+    if not nodes:
+        return None
+    local = _node_key(_get_conn_info(openconnection))
+    nodes = [None if _node_key(_node_conn_info(dsn)) == local else dsn for dsn in nodes]
+    placement = [nodes[i % len(nodes)] for i in range(numberofpartitions)]
+    return placement if any(placement) else None
+
+# Thông tin kết nối tới nơi chứa từng mảnh theo bản đồ đặt mảnh
+def _fragment_conn_infos(openconnection, numberofpartitions, placement=None):
+    local = _get_conn_info(openconnection)
+    return [_node_conn_info(placement[i]) if placement and placement[i] else local
+            for i in range(numberofpartitions)]
+
+# Mượn một kết nối tới node từ pool của node đó (tạo pool NODE_POOL_SIZE kết nối nếu chưa có)
+@contextmanager
+def _node_connection(conn_info):
+    with _NODE_POOL_LOCK:
+        if _conn_key(conn_info) not in _THREAD_POOLS:
+            _get_thread_pool(conn_info, NODE_POOL_SIZE)
+    with _worker_connection(conn_info) as conn:
+        yield conn
+
+# Kết nối tới nơi chứa mảnh idx: openconnection nếu mảnh cục bộ, ngược lại kết nối từ pool của node
+@contextmanager
+def _fragment_connection(openconnection, meta, idx):
+    dsn = meta['placement'][idx] if meta['placement'] else None
+    if not dsn:
+        yield openconnection
+        return
+    with _node_connection(_node_conn_info(dsn)) as conn:
+        yield conn
+
+# Mở một kết nối ghi cho mỗi node trong conn_infos, trả về (con trỏ của từng mảnh, các kết nối)
+def _open_fragment_cursors(conn_infos):
+    conns = {}
+    cursors = []
+    for conn_info in conn_infos:
+        key = _conn_key(conn_info)
+        if key not in conns:
+            conn = psycopg2.connect(**conn_info)
+            conns[key] = (conn, conn.cursor())
+        cursors.append(conns[key][1])
+    return cursors, [conn for conn, _ in conns.values()]
+
+# Từ chối nodes với các engine phải di chuyển dữ liệu trong cùng một cơ sở dữ liệu
+def _check_nodes(nodes, method, supported):
+    if nodes and method not in supported:
+        raise ValueError(f"method={method!r} does not support nodes, use one of {', '.join(supported)}")
+
+# Chia file .dat thành các khoảng byte [start, end) căn theo ranh giới dòng
+def _split_file_chunks(path, numchunks):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, numchunks):
+            offset = size * i // numchunks
+            # File nhỏ hơn numchunks byte (kể cả file rỗng): điểm cắt trùng điểm cắt trước, bỏ qua
+            if offset <= bounds[-1]:
+                continue
+            # Lùi 1 byte rồi đọc hết dòng hiện tại để điểm cắt luôn nằm đầu một dòng
+            f.seek(offset - 1)
+            f.readline()
+            pos = min(f.tell(), size)
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+# Hàm worker COPY một khoảng byte của file .dat vào bảng ratings trên kết nối riêng
+# Trả về thống kê của worker (số dòng, thời gian COPY và commit)
+def _load_chunk_worker(args):
+    ratingstablename, ratingsfilepath, start, end, conn_info = args
+    with _worker_connection(conn_info) as conn:
+        cur = conn.cursor()
+        t0 = time.perf_counter()
+        with open(ratingsfilepath, 'rb') as fin:
+            fin.seek(start)
+            stream = _RatingsDatStream(fin, limit=end - start)
+            cur.copy_expert(
+                sql=sql.SQL("COPY {} (userid, movieid, rating) FROM STDIN")
+                       .format(sql.Identifier(ratingstablename)),
+                file=stream
+            )
+        t1 = time.perf_counter()
+        conn.commit()
+        cur.close()
+    return {'pid': os.getpid(), 'start': start, 'end': end, 'rows': stream.rows,
+            'copy_seconds': t1 - t0, 'commit_seconds': time.perf_counter() - t1}
+
+# Xóa (nếu có) và tạo lại bảng ratings gốc, UNLOGGED nếu unlogged = True
+def _create_ratings_table(openconnection, ratingstablename, unlogged=False):
+    cur = openconnection.cursor()
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(ratingstablename)))
+    openconnection.commit()
     cur.execute(sql.SQL("""
-        CREATE TABLE {} (
+        CREATE {} TABLE {} (
             userid  INTEGER NOT NULL,
             movieid INTEGER NOT NULL,
             rating  REAL    NOT NULL
         );
-    """).format(sql.Identifier(ratingstablename)))
-    conn.commit()
+    """).format(sql.SQL('UNLOGGED' if unlogged else ''), sql.Identifier(ratingstablename)))
+    openconnection.commit()
+    cur.close()
 
-    # Chuyển đổi dữ liệu từ file .dat sang file .csv
-    _preprocess_raw_to_csv(ratingsfilepath, temp_csv)
+# Hàm COPY dữ liệu vào DB
+# numworkers > 1: chia file thành các khoảng byte và COPY song song trên nhiều kết nối
+# unlogged = True: nạp vào bảng UNLOGGED (không ghi WAL) rồi chuyển sang LOGGED sau khi nạp xong
+def loadratings(ratingstablename, ratingsfilepath, openconnection, numworkers=1, unlogged=False):
+    with _span('loadratings', table=ratingstablename, workers=numworkers, unlogged=unlogged) as span:
+        # Mở kết nối
+        conn = openconnection
+        cur = conn.cursor()
 
-    # Thực hiện COPY từ file CSV vào bảng ratings
-    with open(temp_csv, 'r', encoding='utf-8') as f:
-        cur.copy_expert(
-            sql=f"COPY {ratingstablename}(userid, movieid, rating) FROM STDIN WITH (FORMAT csv)",
-            file=f
-        )
+        # Xóa bảng nếu đã tồn tại và tạo bảng ratings gốc mới
+        with span.phase('create'):
+            _create_ratings_table(conn, ratingstablename, unlogged)
+
+        if numworkers > 1:
+            # Mỗi worker COPY một khoảng byte của file trên kết nối riêng
+            conn_info = _get_conn_info(conn)
+            tasks = [
+                (ratingstablename, ratingsfilepath, chunk_start, chunk_end, conn_info)
+                for chunk_start, chunk_end in _split_file_chunks(ratingsfilepath, numworkers)
+            ]
+            with span.phase('copy'):
+                stats = _run_tasks(_load_chunk_worker, tasks, conn_info, numworkers)
+            span.count('rows', sum(stat['rows'] for stat in stats))
+            span.set('workers_stats', stats)
+        else:
+            # Đọc file .dat theo luồng và COPY trực tiếp vào bảng ratings, không qua file CSV tạm
+            with span.phase('copy'), open(ratingsfilepath, 'rb') as fin:
+                stream = _RatingsDatStream(fin)
+                cur.copy_expert(
+                    sql=sql.SQL("COPY {} (userid, movieid, rating) FROM STDIN")
+                           .format(sql.Identifier(ratingstablename)),
+                    file=stream
+                )
+            with span.phase('commit'):
+                conn.commit()
+            span.count('rows', stream.rows)
+
+        # Chuyển bảng đã nạp xong sang LOGGED để dữ liệu an toàn khi server gặp sự cố
+        if unlogged:
+            with span.phase('set_logged'):
+                cur.execute(sql.SQL("ALTER TABLE {} SET LOGGED").format(sql.Identifier(ratingstablename)))
+                conn.commit()
+
+        # Đóng con trỏ DB
+        cur.close()
+
+
+# Hàm tính cận trên của từng mảnh range: mảnh 0 là [0, b0], mảnh i là (b(i-1), bi]
+# Cận được cộng dồn delta giống cách testHelper tính để so sánh số thực khớp nhau
+def _range_bounds(numberofpartitions):
+    if numberofpartitions <= 0:
+        return []
+    delta = 5.0 / numberofpartitions
+    bounds = []
+    min_val = 0.0
+    for i in range(numberofpartitions):
+        max_val = min_val + delta
+        if i == numberofpartitions - 1:
+            max_val = 5.0
+        bounds.append(max_val)
+        min_val += delta
+    return bounds
+
+# Số dòng mẫu mục tiêu khi ước lượng phân vị rating cho cận range theo phân vị
+QUANTILE_SAMPLE_ROWS = 100000
+
+# Cận range theo phân vị: lấy mẫu cột rating (TABLESAMPLE SYSTEM khoảng QUANTILE_SAMPLE_ROWS dòng)
+# và chọn các phân vị k/n làm cận để các mảnh có số dòng gần bằng nhau; cận cuối vẫn là 5.0
+# Rating rời rạc nên nhiều phân vị có thể trùng nhau, khi đó một số mảnh sẽ rỗng
+def _quantile_bounds(openconnection, ratingstablename, numberofpartitions):
+    if numberofpartitions <= 0:
+        return []
+    if numberofpartitions == 1:
+        return [5.0]
+    fractions = [k / numberofpartitions for k in range(1, numberofpartitions)]
+    table = sql.Identifier(ratingstablename)
+    cur = openconnection.cursor()
+
+    # Ước lượng số dòng từ thống kê, chưa ANALYZE thì suy từ kích thước bảng
+    cur.execute("""
+        SELECT reltuples, pg_relation_size(oid) / current_setting('block_size')::int
+          FROM pg_class WHERE oid = to_regclass(%s)
+    """, (ratingstablename,))
+    reltuples, blocks = cur.fetchone()
+    estimate = reltuples if reltuples and reltuples > 0 else blocks * _ROWS_PER_BLOCK
+    percent = min(100.0, 100.0 * QUANTILE_SAMPLE_ROWS / max(estimate, 1))
+
+    quantiles = None
+    if percent < 100.0:
+        cur.execute(sql.SQL("""
+            SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY rating)
+              FROM {} TABLESAMPLE SYSTEM (%s) REPEATABLE (0) WHERE rating >= 0 AND rating <= 5
+        """).format(table), (fractions, percent))
+        quantiles = cur.fetchone()[0]
+    if quantiles is None:
+        cur.execute(sql.SQL("""
+            SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY rating)
+              FROM {} WHERE rating >= 0 AND rating <= 5
+        """).format(table), (fractions,))
+        quantiles = cur.fetchone()[0]
+    cur.close()
+
+    if quantiles is None:
+        return _range_bounds(numberofpartitions)
+    return [float(q) for q in quantiles] + [5.0]
+
+# Tính cận range theo kiểu boundaries:
+# 'equal' = các khoảng bằng nhau 5.0 / n, 'quantile' = theo phân vị của dữ liệu,
+# hoặc một danh sách n cận trên tăng dần do người gọi tự chọn; danh sách phải phủ hết [0, 5]
+# (cận đầu >= 0, cận cuối >= 5.0), nếu không các dòng ngoài cận cuối bị các engine bỏ qua
+def _compute_range_bounds(openconnection, ratingstablename, numberofpartitions, boundaries='equal'):
+    if boundaries == 'equal':
+        return _range_bounds(numberofpartitions)
+    if boundaries == 'quantile':
+        return _quantile_bounds(openconnection, ratingstablename, numberofpartitions)
+    if isinstance(boundaries, (list, tuple)):
+        bounds = [float(b) for b in boundaries]
+        if len(bounds) != numberofpartitions or bounds != sorted(bounds):
+            raise ValueError("boundaries must be numberofpartitions ascending upper bounds")
+        if bounds[0] < 0.0 or bounds[-1] < 5.0:
+            raise ValueError("boundaries must start at or above 0 and end at or above 5.0")
+        return bounds
+    raise ValueError(f"Unknown boundaries: {boundaries}")
+
+# Làm tròn về float4: mảnh lưu rating dạng REAL và SQL so sánh float8(rating) với cận,
+# nên engine phía client phải so sánh cùng giá trị đó (vd. 0.1 được lưu là 0.10000000149...)
+_FLOAT4 = struct.Struct("f")
+
+def _float4(value):
+    return _FLOAT4.unpack(_FLOAT4.pack(value))[0]
+
+# Tìm chỉ số mảnh chứa rating, trả về None nếu rating nằm ngoài [0, cận trên cuối]
+# rating được làm tròn về float4 trước khi so sánh để khớp với engine SQL / columnar
+def _range_index(bounds, rating):
+    rating = _float4(rating)
+    if rating < 0.0:
+        return None
+    idx = bisect_left(bounds, rating)
+    if idx >= len(bounds):
+        return None
+    return idx
+
+# Tạo bộ định tuyến cho dòng COPY text "userid\tmovieid\trating" theo khoảng rating
+# Số giá trị rating khác nhau rất ít nên kết quả được ghi nhớ theo chuỗi rating
+def _range_router(bounds):
+    cache = {}
+
+    def route(line):
+        key = line[line.rindex(b"\t") + 1:]
+        try:
+            return cache[key]
+        except KeyError:
+            idx = cache[key] = _range_index(bounds, float(key))
+            return idx
+    return route
+
+# Xóa và tạo lại các mảnh prefix0 .. prefix(n-1)
+# replace = False: giữ nguyên mảnh đã có, chỉ tạo các mảnh còn thiếu
+# unlogged = True: tạo mảnh UNLOGGED, việc nạp dữ liệu không ghi WAL
+# placement: bản đồ đặt mảnh; mỗi mảnh được tạo trên node của nó, bản cũ cùng tên trên
+#            node điều phối và các node khác trong bản đồ bị xóa (khi replace = True)
+# replace = True cũng hủy job có checkpoint đang dở của các mảnh này và xóa các mảnh cũ theo
+# bản đồ đặt mảnh trước đó trong metadata, kể cả trên node không còn trong bản đồ mới
+def _create_fragments(openconnection, prefix, numberofpartitions, replace=True, unlogged=False, placement=None):
+    drop = range(numberofpartitions) if replace else ()
+    local_drop = set(drop)
+    nodes = {}
+    for i, dsn in enumerate(placement or ()):
+        if dsn:
+            conn_info = _node_conn_info(dsn)
+            nodes.setdefault(_node_key(conn_info), (conn_info, set(drop), []))[2].append(i)
+    if replace:
+        _cancel_partition_job(openconnection, prefix)
+        for i, dsn in _previous_placement(openconnection, prefix):
+            if dsn:
+                conn_info = _node_conn_info(dsn)
+                nodes.setdefault(_node_key(conn_info), (conn_info, set(), []))[1].add(i)
+            else:
+                local_drop.add(i)
+    local = [i for i in range(numberofpartitions) if not (placement and placement[i])]
+    _create_fragment_tables(openconnection, prefix, sorted(local_drop), local, unlogged)
+    for conn_info, fragments_drop, fragments in nodes.values():
+        with _node_connection(conn_info) as conn:
+            _create_fragment_tables(conn, prefix, sorted(fragments_drop), fragments, unlogged)
+
+# Các mảnh (chỉ số, DSN của node hoặc None nếu cục bộ) theo metadata hiện có của prefix
+def _previous_placement(openconnection, prefix):
+    scheme = {p: s for s, p in _SCHEME_PREFIXES.items()}.get(prefix)
+    cur = openconnection.cursor()
+    cur.execute("SELECT to_regclass(%s)", (PARTITION_META_TABLE,))
+    meta = _read_partition_meta(cur, scheme) if scheme and cur.fetchone()[0] is not None else None
+    cur.close()
+    if meta is None or meta['prefix'] != prefix:
+        return []
+    placement = meta['placement'] or [None] * meta['numpartitions']
+    return list(enumerate(placement[:meta['numpartitions']]))
+
+# Xóa các mảnh trong drop rồi tạo các mảnh trong create trên một kết nối
+def _create_fragment_tables(conn, prefix, drop, create, unlogged=False):
+    cur = conn.cursor()
+    for i in drop:
+        cur.execute(f"DROP TABLE IF EXISTS {prefix}{i};")
+    for i in create:
+        cur.execute(f"""
+                CREATE {'UNLOGGED' if unlogged else ''} TABLE IF NOT EXISTS {prefix}{i} (
+                    userid  INTEGER,
+                    movieid INTEGER,
+                    rating  REAL
+                );
+            """)
     conn.commit()
+    cur.close()
+
+# Kiểm tra danh sách tên index phụ, trả về tuple không trùng lặp theo thứ tự đã cho
+def _check_indexes(indexes):
+    indexes = tuple(dict.fromkeys(indexes or ()))
+    unknown = [name for name in indexes if name not in FRAGMENT_INDEXES]
+    if unknown:
+        raise ValueError(f"Unknown fragment index: {unknown[0]}")
+    return indexes
+
+# Tên index phụ của một mảnh
+def _fragment_index_name(tableName, index):
+    return f"{tableName}_{index}_idx"
+
+# Hàm worker hoàn tất một mảnh sau khi nạp: chuyển sang LOGGED, tạo các index phụ
+# rồi ANALYZE, theo đúng thứ tự đó để index được dựng một lần trên dữ liệu đã đầy đủ
+def _finish_fragment_worker(args):
+    tableName, conn_info, setlogged, analyze = args[:4]
+    indexes = args[4] if len(args) > 4 else ()
+    stats = {'table': tableName}
+    with _worker_connection(conn_info) as conn:
+        cur = conn.cursor()
+        t0 = time.perf_counter()
+        if setlogged:
+            cur.execute(sql.SQL("ALTER TABLE {} SET LOGGED").format(sql.Identifier(tableName)))
+        t1 = time.perf_counter()
+        stats['setlogged_seconds'] = t1 - t0
+        for index in indexes:
+            cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} USING " + FRAGMENT_INDEXES[index]).format(
+                sql.Identifier(_fragment_index_name(tableName, index)), sql.Identifier(tableName)))
+        t0 = time.perf_counter()
+        stats['index_seconds'] = t0 - t1
+        if analyze:
+            cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(tableName)))
+        conn.commit()
+        cur.close()
+    stats['analyze_seconds'] = time.perf_counter() - t0
+    return stats
+
+# Hoàn tất các mảnh prefix(first) .. prefix(n-1) sau khi nạp, mỗi mảnh một task trên pool luồng
+# nên các mảnh được xử lý song song (mỗi luồng một kết nối)
+# setlogged: chuyển mảnh UNLOGGED sang LOGGED (ghi lại toàn bộ mảnh vào WAL một lần)
+# indexes: tên các index phụ trong FRAGMENT_INDEXES, dựng sau khi đã nạp xong dữ liệu
+# analyze: cập nhật thống kê cho planner
+# placement: bản đồ đặt mảnh, mỗi mảnh được xử lý trên node chứa nó
+def _finish_fragments(openconnection, prefix, numberofpartitions, setlogged=False, analyze=False,
+                      span=_NULL_SPAN, indexes=(), first=0, numworkers=None, placement=None):
+    if numberofpartitions <= first or not (setlogged or analyze or indexes):
+        return []
+    if numworkers is None:
+        numworkers = mp.cpu_count()
+    conn_info = _get_conn_info(openconnection)
+    conn_infos = _fragment_conn_infos(openconnection, numberofpartitions, placement)
+    tasks = [(f"{prefix}{i}", conn_infos[i], setlogged, analyze, indexes) for i in range(first, numberofpartitions)]
+    with span.phase('finish'):
+        stats = _run_tasks(_finish_fragment_worker, tasks, conn_info, min(len(tasks), numworkers), 'thread')
+    span.set('finish_stats', stats)
+    return stats
+
+# Bảng metadata lưu thông tin các sơ đồ phân vùng hiện có (một dòng cho mỗi scheme)
+# Bộ nhớ đệm trong tiến trình theo (dsn, scheme) để rangeinsert / roundrobininsert
+# không phải truy vấn catalog ở mỗi lần chèn
+_PARTITION_CACHE = {}
+
+# Tạo bảng metadata và sequence cấp slot round-robin nếu chưa có
+def _ensure_partition_meta(cur):
+    cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            scheme        TEXT PRIMARY KEY,
+            prefix        TEXT NOT NULL,
+            source        TEXT NOT NULL,
+            numpartitions INTEGER NOT NULL,
+            boundaries    DOUBLE PRECISION[],
+            partkey       TEXT,
+            indexes       TEXT[],
+            placement     TEXT[],
+            updated_at    TIMESTAMP NOT NULL DEFAULT now()
+        );
+    """).format(sql.Identifier(PARTITION_META_TABLE)))
+    # Bảng metadata tạo từ phiên bản cũ có thể chưa có các cột partkey, indexes, placement
+    # (chỉ ALTER khi thiếu cột, tránh khóa ACCESS EXCLUSIVE bảng metadata ở mỗi lần gọi)
+    cur.execute("""
+        SELECT COUNT(*) FROM pg_attribute
+         WHERE attrelid = %s::regclass AND attname IN ('partkey', 'indexes', 'placement') AND NOT attisdropped
+    """, (PARTITION_META_TABLE,))
+    if cur.fetchone()[0] < 3:
+        cur.execute(sql.SQL("""
+            ALTER TABLE {} ADD COLUMN IF NOT EXISTS partkey TEXT,
+                           ADD COLUMN IF NOT EXISTS indexes TEXT[],
+                           ADD COLUMN IF NOT EXISTS placement TEXT[]
+        """).format(sql.Identifier(PARTITION_META_TABLE)))
+    cur.execute(sql.SQL("CREATE SEQUENCE IF NOT EXISTS {} MINVALUE 0 START 0")
+                   .format(sql.Identifier(RROBIN_INSERT_SEQ)))
+
+# Mệnh đề WITH khóa chia sẻ dòng metadata của scheme (tham số: scheme, updated_at) nếu updated_at
+# còn khớp, đặt trước câu lệnh ghi vào mảnh để kiểm tra phiên bản và ghi trong cùng một câu lệnh
+# (FROM meta: không ghi gì nếu metadata đã đổi). Việc đổi metadata cập nhật dòng đó nên phải chờ
+# các lệnh ghi đang giữ khóa theo định tuyến cũ, lệnh ghi đến sau chờ xong thì thấy updated_at mới
+_META_GUARD = sql.SQL("WITH meta AS MATERIALIZED (SELECT 1 FROM {} WHERE scheme = %s AND updated_at = %s "
+                      "FOR SHARE) ").format(sql.Identifier(PARTITION_META_TABLE))
+
+# Khóa độc quyền dòng metadata của scheme tới hết transaction (chờ các lệnh ghi đang dùng
+# định tuyến cũ), dùng trước khi đọc trạng thái các mảnh để đổi metadata
+def _lock_partition_meta(cur, scheme):
+    cur.execute(sql.SQL("SELECT 1 FROM {} WHERE scheme = %s FOR UPDATE")
+                   .format(sql.Identifier(PARTITION_META_TABLE)), (scheme,))
+
+# Ghi (hoặc cập nhật) metadata của một scheme và làm mới bộ nhớ đệm
+# nextslot: với round-robin, giá trị tiếp theo của RROBIN_INSERT_SEQ (= tổng số dòng đã chia)
+# partkey: với phân vùng băm, cột dùng làm khóa ('userid' hoặc 'movieid')
+# indexes: tên các index phụ (FRAGMENT_INDEXES) đang có trên mọi mảnh
+# placement: bản đồ đặt mảnh (DSN của node chứa từng mảnh, None nếu mảnh nằm ở node điều phối)
+# cur: con trỏ của một transaction đang mở để ghi metadata cùng transaction đó (người gọi commit)
+# updated_at (clock_timestamp) là phiên bản của metadata, các tiến trình khác so sánh nó với
+# bộ nhớ đệm của mình để biết cách phân vùng đã đổi
+def _save_partition_meta(openconnection, scheme, prefix, source, numberofpartitions,
+                         boundaries=None, nextslot=None, partkey=None, indexes=None, placement=None, cur=None):
+    indexes = list(indexes) if indexes else None
+    placement = list(placement) if placement else None
+    with nullcontext(cur) if cur is not None else _transaction(openconnection) as cur:
+        _ensure_partition_meta(cur)
+        cur.execute(sql.SQL("""
+            INSERT INTO {} (scheme, prefix, source, numpartitions, boundaries, partkey, indexes, placement,
+                            updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, clock_timestamp())
+            ON CONFLICT (scheme) DO UPDATE
+               SET prefix = EXCLUDED.prefix,
+                   source = EXCLUDED.source,
+                   numpartitions = EXCLUDED.numpartitions,
+                   boundaries = EXCLUDED.boundaries,
+                   partkey = EXCLUDED.partkey,
+                   indexes = EXCLUDED.indexes,
+                   placement = EXCLUDED.placement,
+                   updated_at = EXCLUDED.updated_at
+            RETURNING updated_at;
+        """).format(sql.Identifier(PARTITION_META_TABLE)),
+        (scheme, prefix, source, numberofpartitions, boundaries, partkey, indexes, placement))
+        updated_at = cur.fetchone()[0]
+        if nextslot is not None:
+            cur.execute("SELECT setval(%s, %s, false)", (RROBIN_INSERT_SEQ, nextslot))
+
+    meta = {'prefix': prefix, 'source': source, 'numpartitions': numberofpartitions,
+            'boundaries': boundaries, 'partkey': partkey, 'indexes': indexes, 'placement': placement,
+            'updated_at': updated_at}
+    _PARTITION_CACHE[(openconnection.dsn, scheme)] = meta
+    return meta
+
+# Đọc metadata của một scheme từ bảng metadata, None nếu chưa có dòng của scheme
+def _read_partition_meta(cur, scheme):
+    cur.execute(sql.SQL("""
+        SELECT prefix, source, numpartitions, boundaries, partkey, indexes, placement, updated_at
+          FROM {} WHERE scheme = %s
+    """).format(sql.Identifier(PARTITION_META_TABLE)), (scheme,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {'prefix': row[0], 'source': row[1], 'numpartitions': row[2], 'boundaries': row[3],
+            'partkey': row[4], 'indexes': row[5], 'placement': row[6], 'updated_at': row[7]}
+
+# Lấy metadata của một scheme: bộ nhớ đệm -> bảng metadata -> suy ra từ catalog
+# (trường hợp các mảnh được tạo trước khi có bảng metadata)
+# validate = True: bộ nhớ đệm chỉ được dùng khi updated_at còn khớp với bảng metadata (tiến trình
+#                  khác có thể đã phân vùng lại hoặc xóa các bảng); False: tin bộ nhớ đệm, người
+#                  gọi tự đối chiếu updated_at (xem _with_partition_meta)
+def _get_partition_meta(openconnection, scheme, ratingstablename=None, validate=True):
+    key = (openconnection.dsn, scheme)
+    meta = _PARTITION_CACHE.get(key)
+    if meta is not None and not validate:
+        return meta
+
+    cur = openconnection.cursor()
+    cur.execute("SELECT to_regclass(%s)", (PARTITION_META_TABLE,))
+    if cur.fetchone()[0] is not None:
+        if meta is not None:
+            cur.execute(sql.SQL("SELECT updated_at FROM {} WHERE scheme = %s")
+                           .format(sql.Identifier(PARTITION_META_TABLE)), (scheme,))
+            row = cur.fetchone()
+            if row is not None and row[0] == meta['updated_at']:
+                cur.close()
+                return meta
+        _ensure_partition_meta(cur)
+        meta = _read_partition_meta(cur, scheme)
+        if meta is not None:
+            cur.close()
+            _PARTITION_CACHE[key] = meta
+            return meta
+    cur.close()
+    _PARTITION_CACHE.pop(key, None)
 
-    # Xóa file CSV tạm
+    prefix = _SCHEME_PREFIXES[scheme]
+    num_parts = _count_partitions(prefix, openconnection)
+    if num_parts == 0:
+        return None
+    boundaries = nextslot = partkey = None
+    if scheme == 'range':
+        boundaries = _range_bounds(num_parts)
+    elif scheme == 'hash':
+        # Không suy ra được khóa từ catalog, giả định khóa mặc định của hashpartition
+        partkey = HASH_KEYS[0]
+    elif scheme == 'rrobin' and ratingstablename:
+        cur = openconnection.cursor()
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(ratingstablename)))
+        nextslot = cur.fetchone()[0]
+        cur.close()
+    return _save_partition_meta(openconnection, scheme, prefix, ratingstablename or '', num_parts,
+                                boundaries, nextslot, partkey)
+
+# Khóa chia sẻ dòng metadata của scheme trong transaction của cur, đọc lại metadata nếu
+# updated_at của meta đã cũ. Trả về metadata đang được khóa, None nếu không còn dòng của scheme
+def _guard_partition_meta(cur, scheme, meta):
+    while meta is not None:
+        cur.execute(_META_GUARD + sql.SQL("SELECT 1 FROM meta"), (scheme, meta['updated_at']))
+        if cur.fetchone() is not None:
+            break
+        meta = _read_partition_meta(cur, scheme)
+    return meta
+
+# Chạy write(cur, meta) trong một transaction giữ khóa chia sẻ dòng metadata của scheme, với
+# metadata đã đối chiếu updated_at trong chính transaction đó: bộ nhớ đệm cũ (tiến trình khác đã
+# phân vùng lại) được đọc lại trước khi định tuyến, và repartition chỉ chuyển định tuyến sau khi
+# transaction này commit, nên không dòng nào được ghi theo định tuyến cũ vào mảnh đã quét xong
+# Bảng metadata hoặc mảnh đã bị xóa (UndefinedTable): bỏ bộ nhớ đệm và thử lại một lần
+# Trả về kết quả của write, None nếu scheme chưa có mảnh nào
+def _with_partition_meta(openconnection, scheme, ratingstablename, write):
+    key = (openconnection.dsn, scheme)
+    for attempt in range(2):
+        meta = _get_partition_meta(openconnection, scheme, ratingstablename, validate=False)
+        if meta is None:
+            return None
+        try:
+            with _transaction(openconnection) as cur:
+                meta = _guard_partition_meta(cur, scheme, meta)
+                if meta is not None:
+                    _PARTITION_CACHE[key] = meta
+                    if meta['numpartitions'] == 0:
+                        return None
+                    return write(cur, meta)
+        except psycopg2.errors.UndefinedTable:
+            if attempt:
+                _PARTITION_CACHE.pop(key, None)
+                raise
+        # Không còn dòng metadata của scheme: lần thử sau suy ra lại từ catalog
+        _PARTITION_CACHE.pop(key, None)
+    return None
+
+# Chèn một dòng (userid, movieid, rating) theo metadata trong bộ nhớ đệm
+# route(meta, slot) trả về chỉ số mảnh đích; slot = True: trước đó cấp một slot từ
+# RROBIN_INSERT_SEQ (truyền cho route, None nếu không cấp)
+# Mảnh cục bộ: một câu INSERT có _META_GUARD (không cần BEGIN / COMMIT với kết nối autocommit),
+# không ghi được dòng nào nghĩa là metadata đã đổi thì đọc lại và chèn lại. Slot được cấp kèm
+# _META_GUARD trong cùng transaction với câu INSERT (BEGIN và COMMIT gửi chung câu lệnh) nên slot
+# cấp theo metadata cũ không rơi vào sequence đã được repartition đặt lại. Mảnh trên node khác
+# đi qua _with_partition_meta. Trả về chỉ số mảnh, None nếu scheme chưa có mảnh nào
+def _insert_one(openconnection, scheme, ratingstablename, route, row, slot=False):
+    key = (openconnection.dsn, scheme)
+    autocommit = openconnection.autocommit
+    meta = _get_partition_meta(openconnection, scheme, ratingstablename, validate=False)
+    retried = False
+    while meta is not None and meta['numpartitions'] > 0:
+        if meta['placement']:
+            def write(cur, meta):
+                value = None
+                if slot:
+                    cur.execute("SELECT nextval(%s)", (RROBIN_INSERT_SEQ,))
+                    value = cur.fetchone()[0]
+                idx = route(meta, value)
+                _insert_row(cur, openconnection, meta, idx, row)
+                return idx
+            return _with_partition_meta(openconnection, scheme, ratingstablename, write)
+
+        cur = openconnection.cursor()
+        error = None
+        try:
+            guard = (scheme, meta['updated_at'])
+            if slot:
+                cur.execute(sql.SQL("BEGIN; " if autocommit else "") + _META_GUARD
+                            + sql.SQL("SELECT nextval(%s) FROM meta"), guard + (RROBIN_INSERT_SEQ,))
+                value = cur.fetchone()
+                if value is not None:
+                    idx = route(meta, value[0])
+                    # Transaction đang giữ khóa metadata, câu INSERT không cần kiểm tra lại
+                    cur.execute(sql.SQL("INSERT INTO {} (userid, movieid, rating) VALUES (%s, %s, %s)"
+                                        + ("; COMMIT" if autocommit else "")).format(
+                        sql.Identifier(f"{meta['prefix']}{idx}")), tuple(row))
+                    if not autocommit:
+                        openconnection.commit()
+                    return idx
+                cur.execute("ROLLBACK") if autocommit else openconnection.rollback()
+            else:
+                idx = route(meta, None)
+                cur.execute(_META_GUARD + sql.SQL("INSERT INTO {} (userid, movieid, rating) "
+                                                  "SELECT %s, %s, %s FROM meta").format(
+                    sql.Identifier(f"{meta['prefix']}{idx}")), guard + tuple(row))
+                if cur.rowcount:
+                    if not autocommit:
+                        openconnection.commit()
+                    return idx
+            meta = _read_partition_meta(cur, scheme)
+        except psycopg2.errors.UndefinedTable as e:
+            if autocommit:
+                if openconnection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    cur.execute("ROLLBACK")
+            else:
+                openconnection.rollback()
+            meta, error = None, e
+        finally:
+            cur.close()
+
+        if meta is not None:
+            _PARTITION_CACHE[key] = meta
+            continue
+        # Bảng metadata, dòng của scheme hoặc mảnh đã bị xóa: suy ra lại từ catalog một lần
+        _PARTITION_CACHE.pop(key, None)
+        if retried:
+            if error is not None:
+                raise error
+            return None
+        retried = True
+        meta = _get_partition_meta(openconnection, scheme, ratingstablename)
+    return None
+
+# Chèn một dòng vào mảnh idx: mảnh cục bộ ghi qua cur của transaction đang mở, mảnh trên node
+# khác ghi và commit qua kết nối của node
+def _insert_row(cur, openconnection, meta, idx, row):
+    query = sql.SQL("INSERT INTO {} (userid, movieid, rating) VALUES (%s, %s, %s)").format(
+        sql.Identifier(f"{meta['prefix']}{idx}"))
+    with _fragment_connection(openconnection, meta, idx) as conn:
+        if conn is openconnection:
+            cur.execute(query, row)
+            return
+        node_cur = conn.cursor()
+        node_cur.execute(query, row)
+        conn.commit()
+        node_cur.close()
+
+# Ghi lại danh sách index phụ của một scheme vào metadata và bộ nhớ đệm
+def _set_meta_indexes(openconnection, scheme, indexes):
+    indexes = list(indexes) if indexes else None
+    with _transaction(openconnection) as cur:
+        cur.execute(sql.SQL("UPDATE {} SET indexes = %s, updated_at = clock_timestamp() WHERE scheme = %s "
+                            "RETURNING updated_at").format(sql.Identifier(PARTITION_META_TABLE)), (indexes, scheme))
+        row = cur.fetchone()
+    meta = _PARTITION_CACHE.get((openconnection.dsn, scheme))
+    if meta is not None:
+        meta['indexes'] = indexes
+        if row is not None:
+            meta['updated_at'] = row[0]
+
+# Chạy khối lệnh trong đúng một transaction, kể cả khi kết nối đang ở chế độ autocommit
+@contextmanager
+def _transaction(openconnection):
+    autocommit = openconnection.autocommit
+    cur = openconnection.cursor()
+    if autocommit:
+        cur.execute("BEGIN")
     try:
-        os.remove(temp_csv)
-    except OSError:
-        pass
+        yield cur
+    except Exception:
+        if autocommit:
+            cur.execute("ROLLBACK")
+        else:
+            openconnection.rollback()
+        cur.close()
+        raise
+    if autocommit:
+        cur.execute("COMMIT")
+    else:
+        openconnection.commit()
+    cur.close()
+
+# Gom các dòng theo mảnh đích: targets[k] là chỉ số mảnh của rows[k]
+# Dùng argsort ổn định của NumPy nếu có, giữ nguyên thứ tự dòng trong từng mảnh
+def _group_by_partition(rows, targets, numberofpartitions):
+    if np is not None:
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(targets, kind='stable')
+        counts = np.bincount(targets, minlength=numberofpartitions)
+        groups = []
+        start = 0
+        for cnt in counts.tolist():
+            groups.append([rows[k] for k in order[start:start + cnt].tolist()])
+            start += cnt
+        return groups
+    groups = [[] for _ in range(numberofpartitions)]
+    for row, target in zip(rows, targets):
+        groups[target].append(row)
+    return groups
+
+# Ghi từng nhóm dòng vào mảnh tương ứng (mỗi mảnh một lệnh COPY), trả về số dòng mỗi mảnh
+# Mảnh cục bộ ghi qua cur; với placement, mảnh trên node khác ghi qua kết nối từ pool của node
+# và commit theo từng node (không nguyên tử giữa các node)
+def _write_groups(cur, prefix, groups, writer, placement=None):
+    writer = _make_writer(writer)
+    remote = {}
+    for i, group in enumerate(groups):
+        if not group:
+            continue
+        if placement and placement[i]:
+            remote.setdefault(placement[i], []).append(i)
+        else:
+            writer.write(cur, f"{prefix}{i}", group)
+    for dsn, fragments in remote.items():
+        with _node_connection(_node_conn_info(dsn)) as conn:
+            node_cur = conn.cursor()
+            for i in fragments:
+                writer.write(node_cur, f"{prefix}{i}", groups[i])
+            conn.commit()
+            node_cur.close()
+    return [len(group) for group in groups]
+
+# Bộ điều chỉnh batch size và số luồng ghi (concurrency) trong lúc phân vùng bằng leo đồi:
+# mỗi cửa sổ AUTOTUNE_WINDOW batch đo rows/sec, rồi đánh giá lần chỉnh trước (thông lượng không
+# tăng thì đảo hướng của tham số vừa chỉnh) và chỉnh tham số còn lại: batch size nhân / chia
+# 2**step, concurrency cộng / trừ 1 trong [1, maxconcurrency]. Chỉ chỉnh batch size nếu
+# maxconcurrency = 1. Mỗi lần đảo hướng (kể cả khi chạm biên) bước của batch size giảm một nửa;
+# tham số đảo hướng đủ AUTOTUNE_REVERSALS lần thì dừng ở giá trị tốt nhất đã đo, khi mọi tham số
+# đã dừng thì giữ điểm có thông lượng đo được cao nhất cho phần còn lại của lần chạy
+class _AutoTuner(object):
+    def __init__(self, batch_size=BATCH_SIZE, concurrency=1, maxconcurrency=1, window=AUTOTUNE_WINDOW):
+        self.batch_size = batch_size
+        self.maxconcurrency = max(1, maxconcurrency)
+        self.concurrency = max(1, min(concurrency, self.maxconcurrency))
+        self.window = window
+        self.history = []
+        self.converged = False
+        self._knobs = ('batch_size', 'concurrency') if self.maxconcurrency > 1 else ('batch_size',)
+        self._direction = {'batch_size': 1, 'concurrency': 1}
+        self._step_exp = 1.0
+        self._reversals = {'batch_size': 0, 'concurrency': 0}
+        self._last_knob = None
+        self._last_rate = None
+        self._used = (self.batch_size, self.concurrency)
+        self._rows = 0
+        self._seconds = 0.0
+        self._batches = 0
+
+    # Ghi nhận một batch: số dòng và thời gian xử lý (với thiết lập hiện tại)
+    def record(self, rows, seconds):
+        self._used = (self.batch_size, self.concurrency)
+        if self.converged:
+            return
+        self._rows += rows
+        self._seconds += seconds
+        self._batches += 1
+        if self._batches >= self.window and self._seconds > 0:
+            self._adjust(self._rows / self._seconds)
+            self._rows, self._seconds, self._batches = 0, 0.0, 0
+
+    def _adjust(self, rate):
+        self.history.append((self.batch_size, self.concurrency, rate))
+        last = self._last_knob
+        if last is not None and rate <= self._last_rate * (1 + AUTOTUNE_TOLERANCE):
+            self._reverse(last)
+        active = [knob for knob in self._knobs if self._reversals[knob] < AUTOTUNE_REVERSALS]
+        if not active:
+            self._settle()
+            return
+        knob = active[0] if last not in active else active[(active.index(last) + 1) % len(active)]
+        if not self._step(knob):
+            # Đã chạm biên: đổi hướng và bước tiếp theo hướng mới
+            self._reverse(knob)
+            if self._reversals[knob] >= AUTOTUNE_REVERSALS or not self._step(knob):
+                self._settle()
+                return
+        self._last_knob = knob
+        self._last_rate = rate
+
+    def _reverse(self, knob):
+        self._direction[knob] = -self._direction[knob]
+        self._reversals[knob] += 1
+        if knob == 'batch_size':
+            self._step_exp /= 2
+        if self._reversals[knob] >= AUTOTUNE_REVERSALS:
+            best = self._best()
+            if knob == 'batch_size':
+                self.batch_size = best[0]
+            else:
+                self.concurrency = best[1]
+
+    def _step(self, knob):
+        up = self._direction[knob] > 0
+        if knob == 'batch_size':
+            factor = 2 ** self._step_exp
+            new = round(self.batch_size * factor) if up else round(self.batch_size / factor)
+            new = max(AUTOTUNE_MIN_BATCH, min(AUTOTUNE_MAX_BATCH, new))
+            changed, self.batch_size = new != self.batch_size, new
+        else:
+            new = max(1, min(self.maxconcurrency, self.concurrency + (1 if up else -1)))
+            changed, self.concurrency = new != self.concurrency, new
+        return changed
+
+    # Cửa sổ có thông lượng đo được cao nhất (batch_size, concurrency, rows/sec)
+    def _best(self):
+        return max(self.history, key=lambda h: h[2]) if self.history else None
+
+    # Dừng điều chỉnh và giữ thiết lập có thông lượng đo được cao nhất
+    def _settle(self):
+        self.batch_size, self.concurrency = self._best()[:2]
+        self.converged = True
+
+    # Thiết lập đã dùng cho batch cuối cùng, thiết lập tốt nhất và thông lượng qua từng cửa sổ
+    def report(self):
+        best = self._best()
+        return {'batch_size': self._used[0], 'concurrency': self._used[1],
+                'maxconcurrency': self.maxconcurrency, 'converged': self.converged, 'windows': len(self.history),
+                'best': {'batch_size': best[0], 'concurrency': best[1], 'rows_per_sec': best[2]} if best else None,
+                'history': [{'batch_size': b, 'concurrency': c, 'rows_per_sec': rate}
+                            for b, c, rate in self.history]}
+
+# Ghi các thiết lập autotune đã chọn vào span và log của module
+def _report_autotune(span, operation, report):
+    span.set('autotune', report)
+    logging.getLogger(__name__).info("[%s] autotune chose %s", operation,
+                                     json.dumps({k: v for k, v in report.items() if k != 'history'}))
+
+# Lớp nhận luồng COPY ... TO STDOUT của bảng gốc, định tuyến từng dòng vào bộ đệm
+# của mảnh đích và COPY bộ đệm vào mảnh khi đủ flush_rows dòng
+# tee_table: nếu có, mọi dòng (kể cả dòng không thuộc mảnh nào) cũng được COPY vào bảng này,
+#            số dòng ghi vào đó nằm ở tee_rows
+# write_cur: một con trỏ cho mọi bảng, hoặc danh sách con trỏ theo từng mảnh khi các mảnh
+#            nằm trên nhiều node (không dùng cùng tee_table)
+# tuner: _AutoTuner đo thông lượng từng lần COPY và chọn lại flush_rows
+class _PartitionRouter(object):
+    def __init__(self, write_cur, tables, route, flush_rows=BATCH_SIZE, tee_table=None, tuner=None):
+        self._tables = list(tables)
+        self._route = route
+        self._flush_rows = tuner.batch_size if tuner is not None else flush_rows
+        self._tuner = tuner
+        self._partial = b""
+        self._tee = None
+        if tee_table is not None:
+            self._tee = len(self._tables)
+            self._tables.append(tee_table)
+        self._curs = list(write_cur) if isinstance(write_cur, list) else [write_cur] * len(self._tables)
+        self._buffers = [[] for _ in self._tables]
+        self.counts = [0] * len(tables)
+        self.tee_rows = 0
+        self.write_seconds = 0.0
+
+    # Được COPY gọi với từng phần dữ liệu (thường là một dòng)
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self._partial:
+            data = self._partial + data
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._add(line)
+
+    def _add(self, line):
+        if self._tee is not None:
+            tee = self._buffers[self._tee]
+            tee.append(line)
+            if len(tee) >= self._flush_rows:
+                self._flush(self._tee)
+        idx = self._route(line)
+        if idx is None:
+            return
+        buf = self._buffers[idx]
+        buf.append(line)
+        if len(buf) >= self._flush_rows:
+            self._flush(idx)
+
+    def _flush(self, idx):
+        buf = self._buffers[idx]
+        if not buf:
+            return
+        buf.append(b"")
+        t0 = time.perf_counter()
+        self._curs[idx].copy_expert(
+            sql.SQL("COPY {} (userid, movieid, rating) FROM STDIN")
+               .format(sql.Identifier(self._tables[idx])),
+            io.BytesIO(b"\n".join(buf))
+        )
+        elapsed = time.perf_counter() - t0
+        self.write_seconds += elapsed
+        if idx == self._tee:
+            self.tee_rows += len(buf) - 1
+        else:
+            self.counts[idx] += len(buf) - 1
+            if self._tuner is not None:
+                self._tuner.record(len(buf) - 1, elapsed)
+                self._flush_rows = self._tuner.batch_size
+        self._buffers[idx] = []
+
+    # Ghi nốt dòng cuối (nếu thiếu ký tự xuống dòng) và toàn bộ bộ đệm còn lại
+    def close(self):
+        if self._partial:
+            self._add(self._partial)
+            self._partial = b""
+        for idx in range(len(self._buffers)):
+            self._flush(idx)
+
+# Engine phân vùng quét một lần: đọc bảng gốc đúng một lần bằng COPY TO STDOUT trên
+# openconnection và ghi vào các mảnh qua một kết nối riêng (mỗi node một kết nối nếu có
+# placement), commit một lần ở cuối
+# span nhận thời gian đọc ('fetch'), ghi ('write'), commit và số dòng của từng mảnh
+def _scan_partition(ratingstablename, prefix, numberofpartitions, route, openconnection, span=_NULL_SPAN,
+                    placement=None, tuner=None):
+    tables = [f"{prefix}{i}" for i in range(numberofpartitions)]
+    write_curs, write_conns = _open_fragment_cursors(
+        _fragment_conn_infos(openconnection, numberofpartitions, placement))
+    router = _PartitionRouter(write_curs, tables, route, tuner=tuner)
+
+    t0 = time.perf_counter()
+    read_cur = openconnection.cursor()
+    read_cur.copy_expert(
+        sql.SQL("COPY (SELECT userid, movieid, rating FROM {}) TO STDOUT")
+           .format(sql.Identifier(ratingstablename)),
+        router
+    )
+    read_cur.close()
+    router.close()
+    t1 = time.perf_counter()
+
+    with span.phase('commit'):
+        for write_conn in write_conns:
+            write_conn.commit()
+    for write_conn in write_conns:
+        write_conn.close()
+
+    span.addphase('fetch', t1 - t0 - router.write_seconds)
+    span.addphase('write', router.write_seconds)
+    span.count('rows', sum(router.counts))
+    span.set('partition_rows', router.counts)
+    return router.counts
+
+# Số dòng mỗi khối được chuyển thành mảng NumPy trong engine columnar
+COLUMNAR_CHUNK_ROWS = 65536
+
+# Một dòng COPY binary của (INTEGER, INTEGER, REAL) không NULL: số trường, rồi (độ dài, giá trị)
+# cho từng cột, tất cả big-endian, 26 byte cố định nên cả khối dòng đọc được bằng np.frombuffer
+# và một lát cắt của mảng ghi thẳng lại được thành dữ liệu COPY binary
+if np is not None:
+    _BINARY_ROW_DTYPE = np.dtype([
+        ('nfields', '>i2'),
+        ('len_userid', '>i4'), ('userid', '>i4'),
+        ('len_movieid', '>i4'), ('movieid', '>i4'),
+        ('len_rating', '>i4'), ('rating', '>f4'),
+    ])
+else:
+    _BINARY_ROW_DTYPE = None
+
+# Lớp nhận luồng COPY ... TO STDOUT (FORMAT binary) của bảng gốc, gom thành khối
+# COLUMNAR_CHUNK_ROWS dòng, tính mảnh đích cho cả khối bằng targets(arr, row_index)
+# (chỉ số mảnh, -1 để bỏ dòng), gom nhóm bằng argsort ổn định và slicing rồi COPY binary
+# từng nhóm vào mảnh khi đủ flush_rows dòng. Không có vòng lặp Python theo từng dòng
+# write_cur: một con trỏ cho mọi mảnh hoặc danh sách con trỏ theo từng mảnh (như _PartitionRouter)
+# tuner: _AutoTuner đo thông lượng từng lần COPY và chọn lại flush_rows
+class _ColumnarRouter(object):
+    _HEADER_SIZE = 19
+
+    def __init__(self, write_cur, tables, targets, flush_rows=BATCH_SIZE, tuner=None):
+        self._curs = list(write_cur) if isinstance(write_cur, list) else [write_cur] * len(tables)
+        self._tables = tables
+        self._targets = targets
+        self._flush_rows = tuner.batch_size if tuner is not None else flush_rows
+        self._tuner = tuner
+        self._buf = bytearray()
+        self._header = False
+        self._row_index = 0
+        self._pending = [[] for _ in tables]
+        self._pending_rows = [0] * len(tables)
+        self.counts = [0] * len(tables)
+        self.write_seconds = 0.0
+
+    def write(self, data):
+        buf = self._buf
+        buf += data
+        if not self._header:
+            if len(buf) < self._HEADER_SIZE:
+                return
+            # Header: chữ ký 11 byte, cờ 4 byte, độ dài vùng mở rộng 4 byte
+            ext = int.from_bytes(buf[15:19], 'big')
+            if len(buf) < self._HEADER_SIZE + ext:
+                return
+            del buf[:self._HEADER_SIZE + ext]
+            self._header = True
+        chunk_bytes = COLUMNAR_CHUNK_ROWS * _BINARY_ROW_DTYPE.itemsize
+        while len(buf) >= chunk_bytes:
+            self._route(COLUMNAR_CHUNK_ROWS)
+
+    def _route(self, numrows):
+        nbytes = numrows * _BINARY_ROW_DTYPE.itemsize
+        arr = np.frombuffer(bytes(self._buf[:nbytes]), dtype=_BINARY_ROW_DTYPE)
+        del self._buf[:nbytes]
+        if ((arr['nfields'] != 3).any() or (arr['len_userid'] != 4).any()
+                or (arr['len_movieid'] != 4).any() or (arr['len_rating'] != 4).any()):
+            raise ValueError("method='columnar' requires userid, movieid and rating to be NOT NULL")
+
+        targets = np.asarray(self._targets(arr, self._row_index), dtype=np.int64)
+        self._row_index += numrows
+        order = np.argsort(targets, kind='stable')
+        counts = np.bincount(targets + 1, minlength=len(self._tables) + 1)
+        ordered = arr[order]
+        start = int(counts[0])
+        for p, cnt in enumerate(counts[1:].tolist()):
+            if cnt:
+                self._pending[p].append(ordered[start:start + cnt].tobytes())
+                self._pending_rows[p] += cnt
+                if self._pending_rows[p] >= self._flush_rows:
+                    self._flush(p)
+            start += cnt
+
+    def _flush(self, p):
+        if not self._pending_rows[p]:
+            return
+        t0 = time.perf_counter()
+        self._curs[p].copy_expert(
+            sql.SQL("COPY {} (userid, movieid, rating) FROM STDIN WITH (FORMAT binary)")
+               .format(sql.Identifier(self._tables[p])),
+            io.BytesIO(CopyBinaryWriter._HEADER + b"".join(self._pending[p]) + CopyBinaryWriter._TRAILER)
+        )
+        elapsed = time.perf_counter() - t0
+        self.write_seconds += elapsed
+        if self._tuner is not None:
+            self._tuner.record(self._pending_rows[p], elapsed)
+            self._flush_rows = self._tuner.batch_size
+        self.counts[p] += self._pending_rows[p]
+        self._pending[p] = []
+        self._pending_rows[p] = 0
+
+    # Xử lý các dòng còn lại (bỏ trailer 2 byte) và ghi toàn bộ bộ đệm
+    def close(self):
+        remaining = (len(self._buf) - len(CopyBinaryWriter._TRAILER)) // _BINARY_ROW_DTYPE.itemsize
+        if remaining > 0:
+            self._route(remaining)
+        for p in range(len(self._tables)):
+            self._flush(p)
+
+# Engine phân vùng columnar: đọc bảng gốc một lần bằng COPY TO STDOUT dạng binary, định tuyến
+# theo khối mảng NumPy qua _ColumnarRouter và ghi vào các mảnh qua một kết nối riêng
+# (mỗi node một kết nối nếu có placement)
+# targets(arr, row_index): chỉ số mảnh của từng dòng trong khối, -1 để bỏ dòng
+def _columnar_partition(ratingstablename, prefix, numberofpartitions, targets, openconnection, span=_NULL_SPAN,
+                        placement=None, tuner=None):
+    if np is None:
+        raise ImportError("method='columnar' requires numpy")
+    tables = [f"{prefix}{i}" for i in range(numberofpartitions)]
+    write_curs, write_conns = _open_fragment_cursors(
+        _fragment_conn_infos(openconnection, numberofpartitions, placement))
+    router = _ColumnarRouter(write_curs, tables, targets, tuner=tuner)
+
+    t0 = time.perf_counter()
+    read_cur = openconnection.cursor()
+    read_cur.copy_expert(
+        sql.SQL("COPY (SELECT userid::int4, movieid::int4, rating::float4 FROM {}) TO STDOUT WITH (FORMAT binary)")
+           .format(sql.Identifier(ratingstablename)),
+        router
+    )
+    read_cur.close()
+    router.close()
+    t1 = time.perf_counter()
+
+    with span.phase('commit'):
+        for write_conn in write_conns:
+            write_conn.commit()
+    for write_conn in write_conns:
+        write_conn.close()
+
+    span.addphase('fetch', t1 - t0 - router.write_seconds)
+    span.addphase('write', router.write_seconds)
+    span.count('rows', sum(router.counts))
+    span.set('partition_rows', router.counts)
+    return router.counts
+
+# Mảnh range của cả khối: np.searchsorted trên các cận, -1 nếu rating nằm ngoài khoảng
+def _range_targets(bounds):
+    bounds_arr = np.asarray(bounds, dtype=np.float64)
+
+    def targets(arr, row_index):
+        ratings = arr['rating'].astype(np.float64)
+        idx = np.searchsorted(bounds_arr, ratings, side='left')
+        idx[(idx >= len(bounds_arr)) | (ratings < 0.0)] = -1
+        return idx
+    return targets
+
+# Mảnh round-robin của cả khối: (row_index + k) % n
+def _roundrobin_targets(numberofpartitions):
+    def targets(arr, row_index):
+        return (np.arange(row_index, row_index + len(arr), dtype=np.int64)) % numberofpartitions
+    return targets
+
+# Mảnh băm của cả khối theo cột key
+def _hash_array_targets(key, numberofpartitions):
+    def targets(arr, row_index):
+        return _hash_array(arr[key].astype(np.int64), numberofpartitions)
+    return targets
 
-    # In ra thời gian chạy và đóng con trỏ DB
-    end = time.time()
-    print(f"[loadratings] Completed in {end - start:.2f} seconds.")
+# Engine phân vùng phía server: một câu lệnh duy nhất quét bảng gốc một lần, tính mảnh
+# đích bằng part_expr rồi INSERT ... SELECT vào từng mảnh, không dòng nào đi qua client
+# Trả về tổng số dòng của bảng gốc
+def _server_side_partition(ratingstablename, prefix, numberofpartitions, part_expr, openconnection):
+    inserts = [
+        sql.SQL("i{0} AS (INSERT INTO {1} (userid, movieid, rating) "
+                "SELECT userid, movieid, rating FROM src WHERE part = {0})")
+           .format(sql.Literal(i), sql.Identifier(f"{prefix}{i}"))
+        for i in range(numberofpartitions)
+    ]
+    query = sql.SQL("""
+        WITH src AS MATERIALIZED (
+            SELECT userid, movieid, rating, {} AS part FROM {}
+        ), {}
+        SELECT COUNT(*) FROM src
+    """).format(part_expr, sql.Identifier(ratingstablename), sql.SQL(", ").join(inserts))
 
+    cur = openconnection.cursor()
+    cur.execute(query)
+    total_rows = cur.fetchone()[0]
+    openconnection.commit()
     cur.close()
+    return total_rows
+
+# Biểu thức SQL tính chỉ số mảnh range theo các cận, NULL nếu rating nằm ngoài khoảng
+def _range_case_sql(bounds):
+    whens = []
+    for i, max_val in enumerate(bounds):
+        if i == 0:
+            cond = sql.SQL("rating >= 0 AND rating <= {}").format(sql.Literal(max_val))
+        else:
+            cond = sql.SQL("rating > {} AND rating <= {}").format(sql.Literal(bounds[i - 1]), sql.Literal(max_val))
+        whens.append(sql.SQL("WHEN {} THEN {}").format(cond, sql.Literal(i)))
+    return sql.SQL("CASE {} END").format(sql.SQL(" ").join(whens))
+
+# Chia một batch dòng đọc từ bảng gốc theo round-robin: dòng thứ row_index + k thuộc mảnh
+# (row_index + k) % n. Trả về danh sách (chỉ số mảnh, các dòng) cho các mảnh có dữ liệu
+def _roundrobin_split(batch, row_index, numberofpartitions):
+    groups = []
+    for p in range(numberofpartitions):
+        first = (p - row_index) % numberofpartitions
+        if first < len(batch):
+            groups.append((p, batch[first::numberofpartitions]))
+    return groups
 
+# Tạo hàm chia batch theo khoảng rating, bỏ qua dòng có rating nằm ngoài các cận
+# Chỉ số mảnh được ghi nhớ theo giá trị rating giống _range_router
+def _range_splitter(bounds):
+    cache = {}
+
+    def split(batch, row_index):
+        parts = {}
+        for row in batch:
+            rating = row[2]
+            try:
+                idx = cache[rating]
+            except KeyError:
+                idx = cache[rating] = _range_index(bounds, rating)
+            if idx is not None:
+                parts.setdefault(idx, []).append(row)
+        return sorted(parts.items())
+    return split
+
+# Engine phân vùng asyncio: một coroutine đọc bảng gốc theo batch qua con trỏ phía server,
+# chia batch bằng split(batch, row_index) và đẩy từng nhóm vào hàng đợi có giới hạn;
+# concurrency coroutine ghi, mỗi coroutine một kết nối, COPY các nhóm vào mảnh đích
+# Tất cả chạy trong một tiến trình. Trả về tổng số dòng đã đọc
+async def _async_partition(ratingstablename, prefix, split, conn_info, concurrency):
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def write_loop():
+        encoder = CopyBinaryWriter()
+        async with await AsyncConnection.connect(**conn_info) as conn:
+            async with conn.cursor() as cur:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    tableName, dataTuples = item
+                    async with cur.copy(f"COPY {tableName} (userid, movieid, rating) FROM STDIN WITH (FORMAT binary)") as copy:
+                        await copy.write(bytes(encoder.encode(dataTuples)))
+            await conn.commit()
+
+    writers = [asyncio.ensure_future(write_loop()) for _ in range(concurrency)]
+    try:
+        row_index = 0
+        async with await AsyncConnection.connect(**conn_info) as read_conn:
+            async with read_conn.cursor(name='async_partition_reader') as read_cur:
+                await read_cur.execute(f"SELECT userid, movieid, rating FROM {ratingstablename}")
+                while True:
+                    batch = await read_cur.fetchmany(BATCH_SIZE)
+                    if not batch:
+                        break
+                    for p, dataTuples in split(batch, row_index):
+                        # Chờ chỗ trống trong hàng đợi, dừng sớm nếu có coroutine ghi đã lỗi
+                        put = asyncio.ensure_future(queue.put((f"{prefix}{p}", dataTuples)))
+                        done, _ = await asyncio.wait([put] + writers, return_when=asyncio.FIRST_COMPLETED)
+                        if put not in done:
+                            put.cancel()
+                            for w in done:
+                                w.result()
+                    row_index += len(batch)
+        for _ in writers:
+            await queue.put(None)
+        await asyncio.gather(*writers)
+    except BaseException:
+        for w in writers:
+            w.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+        raise
+    return row_index
+
+# Chạy engine asyncio từ hàm đồng bộ
+def _run_async_partition(ratingstablename, prefix, split, openconnection, concurrency):
+    if AsyncConnection is None:
+        raise ImportError("method='async' requires psycopg 3 (pip install 'psycopg[binary]')")
+    return asyncio.run(_async_partition(ratingstablename, prefix, split,
+                                        _get_conn_info(openconnection), max(1, concurrency)))
 
 # Hàm worker cho thực hiện rangepartition song song và ghi dữ liệu vào các mảnh
+# Tham số thứ 6 (không bắt buộc) autotune = True: worker tự chọn batch size theo thông lượng
+# Trả về thống kê của worker (số dòng, thời gian đọc, ghi, commit và batch size cuối cùng)
 def _range_worker(args):
     # Lấy thông số kết nối DB
-    i, ratingstablename, numberofpartitions, conn_info = args
-    conn = psycopg2.connect(**conn_info)
+    i, ratingstablename, bounds, conn_info, writer = args[:5]
+    tuner = _AutoTuner() if len(args) > 5 and args[5] else None
     part_name = f"{RANGE_TABLE_PREFIX}{i}"
+    writer = _make_writer(writer)
+    stats = {'table': part_name, 'pid': os.getpid(), 'rows': 0,
+             'fetch_seconds': 0.0, 'write_seconds': 0.0, 'commit_seconds': 0.0}
 
-    # Tính toán khoảng giá trị cho phân vùng
-    delta = 5.0 / numberofpartitions
-    min_val = 0.0
-    for _ in range(i):
-        min_val += delta
-    max_val = min_val + delta
-    if i == numberofpartitions - 1:
-        max_val = 5.0
+    # Khoảng giá trị cho phân vùng
+    min_val = bounds[i - 1] if i > 0 else 0.0
+    max_val = bounds[i]
 
     # Điều kiện INSERT vào mảnh
     if i == 0:
@@ -123,129 +1801,260 @@ def _range_worker(args):
     else:
         where_clause = "rating > %s AND rating <= %s"
 
-    # Tạo con trỏ riêng cho đọc dữ liệu từ bảng ratings
-    read_cur = conn.cursor()
-    
-    # Thực hiện truy vấn để lấy dữ liệu từ bảng ratings
-    read_cur.execute(
-        sql.SQL("SELECT userid, movieid, rating FROM {} WHERE " + where_clause)
-        .format(sql.Identifier(ratingstablename)),
-        (min_val, max_val)
-    )
+    # Dùng kết nối bền vững của worker (hoặc kết nối riêng khi chạy ngoài pool)
+    with _worker_connection(conn_info) as conn:
+        # Tạo con trỏ riêng cho đọc dữ liệu từ bảng ratings
+        read_cur = conn.cursor()
 
-    # Khởi tạo con trỏ ghi dữ liệu vào mảnh
-    write_cur = conn.cursor()
+        # Thực hiện truy vấn để lấy dữ liệu từ bảng ratings
+        t0 = time.perf_counter()
+        read_cur.execute(
+            sql.SQL("SELECT userid, movieid, rating FROM {} WHERE " + where_clause)
+            .format(sql.Identifier(ratingstablename)),
+            (min_val, max_val)
+        )
 
-    # Thực hiện INSERT theo BATCH_SIZE
-    while True:
-        batch = read_cur.fetchmany(BATCH_SIZE)
-        if not batch:
-            break
+        # Khởi tạo con trỏ ghi dữ liệu vào mảnh
+        write_cur = conn.cursor()
 
-        batchinsert(part_name, ['userid', 'movieid', 'rating'], batch, BATCH_SIZE, write_cur)
+        # Thực hiện ghi vào mảnh theo BATCH_SIZE (hoặc batch size do tuner chọn)
+        while True:
+            batch = read_cur.fetchmany(tuner.batch_size if tuner is not None else BATCH_SIZE)
+            t1 = time.perf_counter()
+            stats['fetch_seconds'] += t1 - t0
+            if not batch:
+                break
 
-    # Đóng con trỏ đọc và ghi, commit và đóng kết nối
-    conn.commit()
-    read_cur.close()
-    write_cur.close()
-    conn.close()
+            writer.write(write_cur, part_name, batch)
+            t0 = time.perf_counter()
+            stats['write_seconds'] += t0 - t1
+            stats['rows'] += len(batch)
+            if tuner is not None:
+                tuner.record(len(batch), t0 - t1)
+
+        # Commit và đóng con trỏ đọc và ghi
+        conn.commit()
+        stats['commit_seconds'] = time.perf_counter() - t1
+        read_cur.close()
+        write_cur.close()
+    if tuner is not None:
+        stats['batch_size'] = tuner.report()['batch_size']
+    return stats
+
+# Ghi thống kê trả về từ các worker vào span: số dòng từng mảnh và danh sách thống kê
+def _record_worker_stats(span, stats):
+    span.count('rows', sum(stat['rows'] for stat in stats))
+    span.set('partition_rows', {stat['table']: stat['rows'] for stat in stats})
+    span.set('workers_stats', stats)
+
+# Số kết nối tới conn_info mà các pool bền vững (xem closeworkerpools) đang giữ và lần chạy với
+# executor không dùng lại: pool cùng loại executor của conn_info được dùng lại (hoặc thay bằng pool
+# đúng kích thước) nên không tính; executor = None: lần chạy không dùng pool nào, tính mọi pool
+def _pooled_connections(conn_info, executor=None):
+    key = _conn_key(conn_info)
+    held = 0
+    if executor != 'process' and key in _PROCESS_POOLS:
+        held += _PROCESS_POOLS[key][1]
+    conn_pools = list(_RETIRED_POOLS)
+    if executor != 'thread' and key in _THREAD_POOLS:
+        conn_pools.append(_THREAD_POOLS[key][0])
+    for conn_pool in conn_pools:
+        if not conn_pool.closed and _conn_key(conn_pool._kwargs) == key:
+            held += len(conn_pool._pool) + len(conn_pool._used)
+    return held
+
+# Ngân sách kết nối của autotune: số kết nối mà worker / tiến trình ghi (và con trỏ đọc) của lần
+# chạy được mở tới cơ sở dữ liệu, ngoài openconnection: maxconnections (mặc định mp.cpu_count())
+# trừ các kết nối pool bền vững đang giữ (_pooled_connections)
+# minimum: số kết nối tối thiểu lần chạy cần; maxconnections do người gọi đặt mà không đủ thì báo
+# lỗi (đóng các pool không dùng bằng closeworkerpools để giải phóng kết nối)
+def _connection_budget(maxconnections, conn_info, executor=None, minimum=1):
+    budget = (maxconnections if maxconnections else mp.cpu_count()) - _pooled_connections(conn_info, executor)
+    if budget < minimum:
+        if maxconnections:
+            raise ValueError(f"maxconnections={maxconnections} leaves {max(budget, 0)} connections after "
+                             f"the worker pools, need at least {minimum} (closeworkerpools() frees them)")
+        budget = minimum
+    return budget
+
+# Báo cáo autotune của method = 'workers': số worker là giới hạn theo ngân sách kết nối (không đo
+# thông lượng), batch size cuối của từng mảnh do tuner của worker chọn
+def _workers_autotune_report(numworkers, budget, stats):
+    return {'maxworkers': numworkers, 'maxconcurrency': budget,
+            'batch_size': {stat['table']: stat['batch_size'] for stat in stats}}
 
 # Hàm phân vùng theo khoảng giá trị (rangepartition)
-def rangepartition(ratingstablename, numberofpartitions, openconnection):
-    # Đặt thời gian bắt đầu
-    start = time.time()
-    # Thực hiện đánh index cho cột rating bảng ratings
-    with openconnection.cursor() as cur:
-        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_rating ON {ratingstablename}(rating);")
-        openconnection.commit()
+# method = 'scan': quét bảng ratings một lần và định tuyến từng dòng vào mảnh (mặc định)
+# method = 'columnar': quét một lần dạng binary, định tuyến theo khối mảng NumPy (cần numpy)
+# method = 'workers': mỗi mảnh một worker với truy vấn BETWEEN riêng trên index idx_rating
+# method = 'server': di chuyển dữ liệu hoàn toàn phía server bằng INSERT ... SELECT
+# method = 'async': engine asyncio một tiến trình, concurrency kết nối ghi chạy đồng thời
+# method = 'checkpoint': job có checkpoint, bảng ratings chia theo khoảng ctid thành các chunk, mỗi chunk
+#                        commit cùng tiến độ trong bảng job; resumepartition('range', ...) chạy tiếp
+#                        job bị dừng giữa chừng (không dùng được với unlogged)
+# writer: cách worker ghi vào mảnh ('insert', 'text', 'binary'), dùng cho method = 'workers' / 'checkpoint'
+# numworkers, executor: số worker và loại pool ('process' / 'thread') cho method = 'workers' / 'checkpoint'
+# boundaries: 'equal' (khoảng bằng nhau, mặc định), 'quantile' (cân bằng số dòng theo phân vị)
+#             hoặc danh sách n cận trên tăng dần (cận đầu >= 0, cận cuối >= 5.0); cận được lưu vào
+#             metadata để rangeinsert dùng lại
+# unlogged = True: chế độ bulk-load, tạo mảnh UNLOGGED nên việc nạp không ghi WAL; sau khi nạp
+#                  setlogged = True chuyển mảnh sang LOGGED (False: nhanh hơn nhưng mảnh bị
+#                  xóa trắng nếu server gặp sự cố)
+# analyze = True: chạy ANALYZE các mảnh sau khi nạp
+# indexes: tên các index phụ trong FRAGMENT_INDEXES dựng song song trên mọi mảnh sau khi nạp
+# nodes: danh sách DSN của các node PostgreSQL để đặt mảnh (mảnh i trên node i % len(nodes),
+#        bản đồ đặt mảnh lưu trong metadata), chỉ dùng với method = 'scan' / 'columnar'
+# autotune = True: tự chọn batch size theo rows/sec đo được trong lúc chạy ('scan', 'columnar', 'workers'),
+#                  số worker / kết nối ghi chỉ bị giới hạn (không đo) để cùng các kết nối pool
+#                  worker đang giữ không vượt quá maxconnections (mặc định mp.cpu_count());
+#                  thiết lập đã chọn được ghi vào span ('autotune') và log của module
+def rangepartition(ratingstablename, numberofpartitions, openconnection, method='scan', writer='binary',
+                   numworkers=None, executor='process', concurrency=4, boundaries='equal',
+                   unlogged=False, setlogged=True, analyze=False, indexes=(), nodes=None,
+                   autotune=False, maxconnections=None):
+    if method not in ('scan', 'columnar', 'workers', 'server', 'async', 'checkpoint'):
+        raise ValueError(f"Unknown rangepartition method: {method}")
+    # Mảnh UNLOGGED bị xóa trắng khi server gặp sự cố, checkpoint của các chunk sẽ không còn đúng
+    if method == 'checkpoint' and unlogged:
+        raise ValueError("method='checkpoint' does not support unlogged fragments")
+    _check_nodes(nodes, method, ('scan', 'columnar'))
+    indexes = _check_indexes(indexes)
+    placement = _place_fragments(openconnection, nodes, numberofpartitions)
 
-    # Khởi tạo con trỏ để tạo các mảnh
-    setup_cur = openconnection.cursor()
+    # Autotune: tuner cho engine quét một lần, giới hạn số worker / kết nối theo ngân sách
+    # (với 'async' một kết nối của ngân sách dành cho kết nối đọc)
+    tuner = None
+    if autotune:
+        if method in ('scan', 'columnar'):
+            tuner = _AutoTuner()
+        elif method == 'workers':
+            budget = _connection_budget(maxconnections, _get_conn_info(openconnection), executor)
+            numworkers = max(1, min(numworkers or budget, budget, numberofpartitions))
+        elif method == 'async':
+            budget = _connection_budget(maxconnections, _get_conn_info(openconnection), minimum=2)
+            concurrency = max(1, min(concurrency, budget - 1))
 
-    # Hàm tạo các mảnh phân vùng
-    for i in range(numberofpartitions) :
-        part_name = f"{RANGE_TABLE_PREFIX}{i}"
-        setup_cur.execute(f"DROP TABLE IF EXISTS {part_name};")
-        setup_cur.execute(f"""
-                CREATE TABLE {part_name} (
-                    userid  INTEGER,
-                    movieid INTEGER,
-                    rating  REAL
-                );
-            """)
-        openconnection.commit()
-    setup_cur.close()
+    with _span('rangepartition', table=ratingstablename, partitions=numberofpartitions,
+               method=method) as span:
+        # Tính cận của từng mảnh và tạo các mảnh phân vùng
+        with span.phase('bounds'):
+            bounds = _compute_range_bounds(openconnection, ratingstablename, numberofpartitions, boundaries)
+        span.set('boundaries', bounds)
+        with span.phase('create'):
+            _create_fragments(openconnection, RANGE_TABLE_PREFIX, numberofpartitions, unlogged=unlogged,
+                              placement=placement)
 
-    # Lấy thông tin kết nối từ đối tượng openconnection
-    dsn_params = openconnection.get_dsn_parameters()
-    conn_info = {
-        'dbname':   dsn_params['dbname'],
-        'user':     dsn_params['user'],
-        'password': DB_PASSWORD,
-        'host':     dsn_params.get('host', 'localhost'),
-        'port':     dsn_params.get('port', '5432')
-    }
+        if method == 'scan':
+            if numberofpartitions > 0:
+                _scan_partition(ratingstablename, RANGE_TABLE_PREFIX, numberofpartitions,
+                                _range_router(bounds), openconnection, span, placement, tuner)
+        elif method == 'columnar':
+            if numberofpartitions > 0:
+                _columnar_partition(ratingstablename, RANGE_TABLE_PREFIX, numberofpartitions,
+                                    _range_targets(bounds), openconnection, span, placement, tuner)
+        elif method == 'server':
+            if numberofpartitions > 0:
+                with span.phase('insert_select'):
+                    total_rows = _server_side_partition(ratingstablename, RANGE_TABLE_PREFIX, numberofpartitions,
+                                                        _range_case_sql(bounds), openconnection)
+                span.count('rows', total_rows)
+        elif method == 'async':
+            if numberofpartitions > 0:
+                with span.phase('async'):
+                    total_rows = _run_async_partition(ratingstablename, RANGE_TABLE_PREFIX, _range_splitter(bounds),
+                                                      openconnection, concurrency)
+                span.count('rows', total_rows)
+        elif method == 'checkpoint':
+            with span.phase('plan'):
+                _start_partition_job(openconnection, 'range', ratingstablename, numberofpartitions, bounds,
+                                     writer, indexes, analyze)
+            _run_partition_job(openconnection, 'range', numworkers, executor, span)
+        else:
+            # Thực hiện đánh index cho cột rating bảng ratings
+            with span.phase('index'), openconnection.cursor() as cur:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS idx_rating ON {ratingstablename}(rating);")
+                openconnection.commit()
 
-    # Tạo tham số cho hàm _range_worker
-    args_list = [
-        (i, ratingstablename, numberofpartitions, conn_info)
-        for i in range(numberofpartitions)
-    ]
+            # Lấy thông tin kết nối từ đối tượng openconnection
+            conn_info = _get_conn_info(openconnection)
 
-    # Xác định số lượng worker và thực hiện phân vùng song song
-    num_workers = mp.cpu_count()
-    with mp.Pool(processes=num_workers) as pool:
-        pool.map(_range_worker, args_list)
-    
-    # Thời gian kết thúc
-    end = time.time()
-    print(f"[rangepartition] Completed in {end - start:.2f} seconds.")
+            # Tạo tham số cho hàm _range_worker
+            args_list = [
+                (i, ratingstablename, bounds, conn_info, writer, autotune)
+                for i in range(numberofpartitions)
+            ]
+
+            # Thực hiện phân vùng song song trên pool worker dùng lại được
+            with span.phase('workers'):
+                stats = _run_tasks(_range_worker, args_list, conn_info, numworkers, executor)
+            _record_worker_stats(span, stats)
+            if autotune:
+                _report_autotune(span, 'rangepartition', _workers_autotune_report(numworkers, budget, stats))
+        if tuner is not None:
+            _report_autotune(span, 'rangepartition', tuner.report())
+        elif autotune and method == 'async':
+            _report_autotune(span, 'rangepartition', {'concurrency': concurrency, 'maxconcurrency': budget})
+
+        # Hoàn tất các mảnh ở chế độ bulk-load và dựng index phụ
+        _finish_fragments(openconnection, RANGE_TABLE_PREFIX, numberofpartitions,
+                          unlogged and setlogged, analyze, span, indexes, placement=placement)
+
+        # Lưu metadata (số mảnh, cận, index, nơi đặt mảnh) để rangeinsert định tuyến không cần
+        # truy vấn catalog
+        with span.phase('metadata'):
+            _save_partition_meta(openconnection, 'range', RANGE_TABLE_PREFIX, ratingstablename,
+                                 numberofpartitions, bounds, indexes=indexes, placement=placement)
+            if method == 'checkpoint':
+                _end_partition_job(openconnection, 'range')
 
 # Hàm chèn bản ghi mới vào mảnh phân vùng theo khoảng giá trị
 def rangeinsert(ratingstablename, userid, itemid, rating, openconnection):
-    # Lấy thời gian bắt đầu
-    start = time.time()
-    
-    # Tạo kết nối và con trỏ
-    conn = openconnection
-    cur = conn.cursor()
+    with _span('rangeinsert', table=ratingstablename) as span:
+        # Số mảnh và cận lấy từ metadata (thường có sẵn trong bộ nhớ đệm, được đối chiếu với
+        # bảng metadata trong chính câu INSERT)
+        def route(meta, slot):
+            # Kiểm tra xem rating nằm trong mảnh nào (ngoài khoảng thì vào mảnh 0 như trước)
+            idx = _range_index(meta['boundaries'], rating)
+            if idx is None:
+                idx = 0
+            span.set('partition', f"{meta['prefix']}{idx}")
+            return idx
 
-    # Đếm số lượng mảnh phân vùng hiện tại
-    num_parts = _count_partitions(RANGE_TABLE_PREFIX, conn)
-    if num_parts == 0:
-        cur.close()
-        return
+        # Thực hiện INSERT vào mảnh tương ứng trên node chứa mảnh
+        with span.phase('insert'):
+            idx = _insert_one(openconnection, 'range', ratingstablename, route, (userid, itemid, rating))
+        if idx is not None:
+            span.count('rows')
 
-    # Kiểm tra xem rating nằm trong mảnh nào
-    delta = 5.0 / num_parts
-    idx = 0
-    min_val = 0.0
-    for i in range(num_parts):
-        if i == 0:
-            if min_val <= rating <= min_val + delta :
-                idx = i
-                break
-        else :
-            if min_val < rating <= min_val + delta :
-                idx = i
-                break
-        min_val = min_val + delta
-    part_table = f"{RANGE_TABLE_PREFIX}{idx}"
+# Hàm chèn nhiều bản ghi (userid, movieid, rating) vào các mảnh theo khoảng giá trị
+# Mảnh đích được tính một lượt (np.searchsorted trên các cận), mỗi mảnh ghi bằng một lệnh
+# COPY và tất cả nằm trong một transaction. Trả về số dòng đã ghi vào từng mảnh
+def rangeinsert_many(ratingstablename, ratings, openconnection, writer='binary'):
+    with _span('rangeinsert_many', table=ratingstablename) as span:
+        rows = list(ratings)
+        if not rows:
+            return []
 
-    # Thực hiện INSERT vào mảnh tương ứng
-    cur.execute(sql.SQL("""
-        INSERT INTO {} (userid, movieid, rating)
-        VALUES (%s, %s, %s)
-    """).format(sql.Identifier(part_table)),
-    (userid, itemid, rating))
-    
-    # In ra thời gian thực hiện chèn dữ liệu
-    end = time.time()
-    print(f"[rangeinsert] Inserted into {part_table} in {end - start:.2f} seconds.")
-    
-    # Commit các thay đổi và đóng con trỏ
-    conn.commit()
-    cur.close()
+        def insert(cur, meta):
+            # Rating ngoài khoảng vào mảnh 0 giống rangeinsert; rating làm tròn về float4 như _range_index
+            with span.phase('route'):
+                bounds = meta['boundaries']
+                if np is not None:
+                    values = np.fromiter((row[2] for row in rows), dtype=np.float32, count=len(rows)).astype(np.float64)
+                    targets = np.searchsorted(np.asarray(bounds, dtype=np.float64), values, side='left')
+                    targets[(targets >= len(bounds)) | (values < 0.0)] = 0
+                else:
+                    targets = [_range_index(bounds, row[2]) or 0 for row in rows]
+                groups = _group_by_partition(rows, targets, meta['numpartitions'])
+            with span.phase('write'):
+                return _write_groups(cur, meta['prefix'], groups, writer, meta['placement'])
+
+        counts = _with_partition_meta(openconnection, 'range', ratingstablename, insert)
+        if counts is None:
+            return []
+        span.count('rows', len(rows))
+        span.set('partition_rows', counts)
+        return counts
 
 
 # Hàm worker để chèn dữ liệu song song vào các mảnh phân vùng theo round-robin
@@ -256,46 +2065,300 @@ def _batchinsert_worker(args):
     # dataTuples = dữ liệu cần chèn
     # batchSize = kích thước batch
     # conn_params = thông tin kết nối DB
-    tableName, columnTuples, dataTuples, batchSize, conn_params = args
+    # writer = cách ghi vào mảnh ('insert', 'text', 'binary')
+    # autotune = True (tham số thứ 7, không bắt buộc): chọn batch size theo thông lượng
+    tableName, columnTuples, dataTuples, batchSize, conn_params, writer = args[:6]
+    tuner = _AutoTuner(batchSize) if len(args) > 6 and args[6] else None
+    writer = _make_writer(writer, columnTuples)
 
-    # Mở kết nối và con trỏ
-    conn = psycopg2.connect(**conn_params)
-    cur = conn.cursor()
+    # Dùng kết nối bền vững của worker (hoặc kết nối riêng khi chạy ngoài pool)
+    with _worker_connection(conn_params) as conn:
+        cur = conn.cursor()
 
-    # Thực hiện chèn dữ liệu theo từng batch trong mảnh này
-    for i in range(0, len(dataTuples), batchSize):
-        batch = dataTuples[i : i + batchSize]
-        batchinsert(tableName, columnTuples, batch, batchSize, cur)
+        # Thực hiện chèn dữ liệu theo từng batch trong mảnh này
+        t0 = time.perf_counter()
+        i = 0
+        while i < len(dataTuples):
+            if tuner is not None:
+                batchSize = tuner.batch_size
+            batch = dataTuples[i : i + batchSize]
+            tb = time.perf_counter()
+            writer.write(cur, tableName, batch)
+            if tuner is not None:
+                tuner.record(len(batch), time.perf_counter() - tb)
+            i += len(batch)
+        t1 = time.perf_counter()
 
-    # Commit các thay đổi và đóng kết nối
-    # Đóng con trỏ và kết nối
-    conn.commit()
-    cur.close()
-    conn.close()
+        # Commit các thay đổi và đóng con trỏ
+        conn.commit()
+        cur.close()
+
+    # Trả về thống kê của worker
+    return {'table': tableName, 'pid': os.getpid(), 'rows': len(dataTuples),
+            'write_seconds': t1 - t0, 'commit_seconds': time.perf_counter() - t1, 'batch_size': batchSize}
+
+# Tiến trình ghi của pipeline round-robin dạng luồng: nhận các nhóm (tên mảnh, dòng)
+# từ hàng đợi và ghi vào mảnh, gặp None thì commit, gửi thống kê qua stats_queue và kết thúc
+# table_conn_infos: conn_info của các mảnh nằm trên node khác, mỗi node một kết nối mở khi cần
+def _stream_writer_worker(queue, conn_info, writer, stats_queue=None, table_conn_infos=None):
+    conns = {}
+
+    def cursor(tableName):
+        info = table_conn_infos.get(tableName, conn_info) if table_conn_infos else conn_info
+        key = _conn_key(info)
+        if key not in conns:
+            conn = psycopg2.connect(**info)
+            conns[key] = (conn, conn.cursor())
+        return conns[key][1]
+
+    writer = _make_writer(writer)
+    rows = {}
+    wait_seconds = write_seconds = 0.0
+    while True:
+        t0 = time.perf_counter()
+        groups = queue.get()
+        t1 = time.perf_counter()
+        wait_seconds += t1 - t0
+        if groups is None:
+            break
+        for tableName, dataTuples in groups:
+            writer.write(cursor(tableName), tableName, dataTuples)
+            rows[tableName] = rows.get(tableName, 0) + len(dataTuples)
+        write_seconds += time.perf_counter() - t1
+    for conn, cur in conns.values():
+        conn.commit()
+        cur.close()
+        conn.close()
+    if stats_queue is not None:
+        stats_queue.put({'pid': os.getpid(), 'rows': sum(rows.values()), 'partition_rows': rows,
+                         'wait_seconds': wait_seconds, 'write_seconds': write_seconds,
+                         'commit_seconds': time.perf_counter() - t1})
+
+# Đưa một phần tử vào hàng đợi có giới hạn, báo lỗi nếu tiến trình ghi tương ứng đã chết
+# (tránh treo vô hạn khi hàng đợi đầy mà không còn ai đọc)
+def _queue_put(queue, item, proc):
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            if not proc.is_alive():
+                raise RuntimeError(f"Partition writer {proc.name} exited with code {proc.exitcode}")
+
+# Nhận thống kê từ các tiến trình ghi, bỏ qua tiến trình đã chết trước khi kịp gửi
+def _collect_stats(stats_queue, procs):
+    stats = []
+    while len(stats) < len(procs):
+        try:
+            stats.append(stats_queue.get(timeout=1))
+        except Empty:
+            if not any(proc.is_alive() for proc in procs):
+                break
+    return stats
+
+# Phân vùng round-robin dạng luồng với bộ nhớ giới hạn: một con trỏ phía server đọc
+# bảng gốc theo từng batch, mỗi batch được chia theo round-robin bằng slicing và đẩy
+# qua hàng đợi có giới hạn tới các tiến trình ghi (mảnh i do tiến trình i % numwriters ghi)
+# tuner: _AutoTuner chọn kích thước batch đọc và số tiến trình ghi đang dùng (tối đa
+#        tuner.maxconcurrency tiến trình được khởi động, mảnh i do tiến trình i % concurrency ghi)
+# Trả về tổng số dòng đã đọc
+def _roundrobin_stream(ratingstablename, numberofpartitions, conn, writer,
+                       numwriters=None, queuesize=4, span=_NULL_SPAN, placement=None, tuner=None):
+    if numberofpartitions <= 0:
+        return 0
+    if tuner is not None:
+        numwriters = tuner.maxconcurrency
+    elif numwriters is None:
+        numwriters = mp.cpu_count()
+    numwriters = max(1, min(numwriters, numberofpartitions))
+
+    conn_info = _get_conn_info(conn)
+    tables = [f"{RROBIN_TABLE_PREFIX}{i}" for i in range(numberofpartitions)]
+    table_conn_infos = None
+    if placement:
+        table_conn_infos = {tables[i]: _node_conn_info(dsn) for i, dsn in enumerate(placement) if dsn}
+    queues = [mp.Queue(maxsize=queuesize) for _ in range(numwriters)]
+    stats_queue = mp.Queue() if span is not _NULL_SPAN else None
+    procs = [mp.Process(target=_stream_writer_worker,
+                        args=(queues[w], conn_info, writer, stats_queue, table_conn_infos),
+                        name=f"rrobin_writer{w}")
+             for w in range(numwriters)]
+    for proc in procs:
+        proc.start()
+
+    read_conn = psycopg2.connect(**conn_info)
+    try:
+        read_cur = read_conn.cursor(name='rrobin_stream_reader')
+        read_cur.itersize = BATCH_SIZE
+        read_cur.execute(sql.SQL("SELECT userid, movieid, rating FROM {}")
+                            .format(sql.Identifier(ratingstablename)))
+        row_index = 0
+        batchsize, active = BATCH_SIZE, numwriters
+        while True:
+            t0 = time.perf_counter()
+            if tuner is not None:
+                batchsize, active = tuner.batch_size, min(tuner.concurrency, numwriters)
+            with span.phase('fetch'):
+                batch = read_cur.fetchmany(batchsize)
+            if not batch:
+                break
+            # Dòng thứ row_index + k của batch thuộc mảnh (row_index + k) % n
+            with span.phase('dispatch'):
+                groups = [[] for _ in range(active)]
+                for p, dataTuples in _roundrobin_split(batch, row_index, numberofpartitions):
+                    groups[p % active].append((tables[p], dataTuples))
+                for w in range(active):
+                    if groups[w]:
+                        _queue_put(queues[w], groups[w], procs[w])
+            row_index += len(batch)
+            if tuner is not None:
+                tuner.record(len(batch), time.perf_counter() - t0)
+        read_cur.close()
+
+        with span.phase('drain'):
+            for w in range(numwriters):
+                _queue_put(queues[w], None, procs[w])
+            stats = _collect_stats(stats_queue, procs) if stats_queue is not None else []
+            for proc in procs:
+                proc.join()
+        if stats:
+            span.set('workers_stats', stats)
+    finally:
+        read_conn.close()
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+
+    failed = [proc for proc in procs if proc.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Partition writer {failed[0].name} exited with code {failed[0].exitcode}")
+    return row_index
 
 # Hàm phân vùng theo round-robin (roundrobinpartition)
-def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
-    
-    # Mở kết nối và con trỏ
-    conn = openconnection
-    cur = conn.cursor()
-    
-    # Lấy thời gian bắt đầu
-    start = time.time()
+# method = 'stream': đọc theo batch qua con trỏ phía server và đẩy qua hàng đợi có giới hạn
+#                    tới các tiến trình ghi, bộ nhớ không phụ thuộc kích thước bảng (mặc định)
+# method = 'columnar': quét một lần dạng binary, định tuyến theo khối mảng NumPy (cần numpy)
+# method = 'workers': đọc toàn bộ dữ liệu về client rồi chèn song song vào các mảnh
+# method = 'server': di chuyển dữ liệu hoàn toàn phía server bằng INSERT ... SELECT
+# method = 'checkpoint': job có checkpoint, bảng ratings chia theo khoảng ctid thành các chunk (dòng
+#                        thứ k theo thứ tự ctid vào mảnh k % n), mỗi chunk commit cùng tiến độ trong
+#                        bảng job; resumepartition('rrobin', ...) chạy tiếp job bị dừng giữa chừng
+# writer: cách ghi vào mảnh ('insert', 'text', 'binary'), dùng cho method = 'stream', 'workers', 'checkpoint'
+# numworkers: số tiến trình ghi (method = 'stream') hoặc số worker (method = 'workers' / 'checkpoint'),
+#             mặc định mp.cpu_count()
+# executor: loại pool ('process' / 'thread') cho method = 'workers' / 'checkpoint'
+# method = 'async': engine asyncio một tiến trình, concurrency kết nối ghi chạy đồng thời
+# unlogged = True: chế độ bulk-load, tạo mảnh UNLOGGED nên việc nạp không ghi WAL; sau khi nạp
+#                  setlogged = True chuyển mảnh sang LOGGED (False: nhanh hơn nhưng mảnh bị
+#                  xóa trắng nếu server gặp sự cố)
+# analyze = True: chạy ANALYZE các mảnh sau khi nạp
+# indexes: tên các index phụ trong FRAGMENT_INDEXES dựng song song trên mọi mảnh sau khi nạp
+# nodes: danh sách DSN của các node PostgreSQL để đặt mảnh (mảnh i trên node i % len(nodes),
+#        bản đồ đặt mảnh lưu trong metadata), chỉ dùng với method = 'stream' / 'columnar'
+# autotune = True: tự chọn batch size theo rows/sec đo được trong lúc chạy ('stream', 'columnar', 'workers'; với 'stream' còn
+#                  chọn số tiến trình ghi đang dùng), các kết nối đọc / ghi cùng các kết nối pool
+#                  worker đang giữ không vượt quá maxconnections (mặc định mp.cpu_count(); 'stream'
+#                  và 'async' cần ít nhất 2), số worker của 'workers' chỉ là giới hạn, không đo;
+#                  thiết lập đã chọn được ghi vào span ('autotune') và log của module
+def roundrobinpartition(ratingstablename, numberofpartitions, openconnection, method='stream', writer='binary',
+                        numworkers=None, executor='process', concurrency=4,
+                        unlogged=False, setlogged=True, analyze=False, indexes=(), nodes=None,
+                        autotune=False, maxconnections=None):
+    if method not in ('stream', 'columnar', 'workers', 'server', 'async', 'checkpoint'):
+        raise ValueError(f"Unknown roundrobinpartition method: {method}")
+    if method == 'checkpoint' and unlogged:
+        raise ValueError("method='checkpoint' does not support unlogged fragments")
+    _check_nodes(nodes, method, ('stream', 'columnar'))
+    indexes = _check_indexes(indexes)
+    placement = _place_fragments(openconnection, nodes, numberofpartitions)
 
-    # Thực hiện tạo các mảnh phân vùng theo round-robin
-    for i in range(numberofpartitions):
-        tbl = f"{RROBIN_TABLE_PREFIX}{i}"
-        cur.execute(f"DROP TABLE IF EXISTS {tbl};")
-        cur.execute(f"""
-            CREATE TABLE {tbl} (
-                userid  INTEGER,
-                movieid INTEGER,
-                rating  REAL
-            );
-        """)
+    # Autotune: với 'stream' / 'async' một kết nối của ngân sách dành cho con trỏ đọc (cần ít nhất
+    # hai kết nối), phần còn lại cho các tiến trình / kết nối ghi; 'stream' bắt đầu từ khoảng giữa
+    # số tiến trình ghi cho phép
+    tuner = None
+    if autotune:
+        if method == 'stream':
+            budget = _connection_budget(maxconnections, _get_conn_info(openconnection), minimum=2)
+            maxwriters = max(1, min(budget - 1, numberofpartitions))
+            tuner = _AutoTuner(concurrency=(maxwriters + 1) // 2, maxconcurrency=maxwriters)
+        elif method == 'columnar':
+            tuner = _AutoTuner()
+        elif method == 'workers':
+            budget = _connection_budget(maxconnections, _get_conn_info(openconnection), executor)
+            numworkers = max(1, min(numworkers or budget, budget, numberofpartitions))
+        elif method == 'async':
+            budget = _connection_budget(maxconnections, _get_conn_info(openconnection), minimum=2)
+            concurrency = max(1, min(concurrency, budget - 1))
+
+    with _span('roundrobinpartition', table=ratingstablename, partitions=numberofpartitions,
+               method=method) as span:
+        # Mở kết nối
+        conn = openconnection
+
+        # Thực hiện tạo các mảnh phân vùng theo round-robin
+        with span.phase('create'):
+            _create_fragments(conn, RROBIN_TABLE_PREFIX, numberofpartitions, unlogged=unlogged,
+                              placement=placement)
+
+        total_rows = 0
+        if method == 'server':
+            if numberofpartitions > 0:
+                part_expr = sql.SQL("(row_number() OVER () - 1) % {}").format(sql.Literal(numberofpartitions))
+                with span.phase('insert_select'):
+                    total_rows = _server_side_partition(ratingstablename, RROBIN_TABLE_PREFIX, numberofpartitions,
+                                                        part_expr, conn)
+        elif method == 'async':
+            if numberofpartitions > 0:
+                with span.phase('async'):
+                    total_rows = _run_async_partition(
+                        ratingstablename, RROBIN_TABLE_PREFIX,
+                        lambda batch, row_index: _roundrobin_split(batch, row_index, numberofpartitions),
+                        conn, concurrency)
+        elif method == 'columnar':
+            if numberofpartitions > 0:
+                total_rows = sum(_columnar_partition(ratingstablename, RROBIN_TABLE_PREFIX, numberofpartitions,
+                                                     _roundrobin_targets(numberofpartitions), conn, span,
+                                                     placement, tuner))
+        elif method == 'checkpoint':
+            with span.phase('plan'):
+                _start_partition_job(conn, 'rrobin', ratingstablename, numberofpartitions, writer=writer,
+                                     indexes=indexes, analyze=analyze)
+            total_rows = _run_partition_job(conn, 'rrobin', numworkers, executor, span)
+        elif method == 'stream':
+            total_rows = _roundrobin_stream(ratingstablename, numberofpartitions, conn, writer, numworkers,
+                                            span=span, placement=placement, tuner=tuner)
+        else:
+            total_rows, stats = _roundrobin_workers(ratingstablename, numberofpartitions, conn, writer,
+                                                    numworkers, executor, span, placement, autotune)
+            if autotune:
+                _report_autotune(span, 'roundrobinpartition', _workers_autotune_report(numworkers, budget, stats))
+        if method not in ('columnar', 'checkpoint'):
+            span.count('rows', total_rows)
+        if tuner is not None:
+            _report_autotune(span, 'roundrobinpartition', tuner.report())
+        elif autotune and method == 'async':
+            _report_autotune(span, 'roundrobinpartition', {'concurrency': concurrency, 'maxconcurrency': budget})
+
+        # Hoàn tất các mảnh ở chế độ bulk-load và dựng index phụ
+        _finish_fragments(conn, RROBIN_TABLE_PREFIX, numberofpartitions, unlogged and setlogged, analyze, span,
+                          indexes, placement=placement)
+
+        # Lưu metadata và đặt slot round-robin tiếp theo bằng tổng số dòng đã chia
+        with span.phase('metadata'):
+            _save_partition_meta(conn, 'rrobin', RROBIN_TABLE_PREFIX, ratingstablename,
+                                 numberofpartitions, nextslot=total_rows, indexes=indexes, placement=placement)
+            if method == 'checkpoint':
+                _end_partition_job(conn, 'rrobin')
+
+# Phân vùng round-robin phía client: đọc toàn bộ bảng ratings rồi chèn song song từng mảnh
+# Trả về (tổng số dòng, thống kê của từng worker)
+def _roundrobin_workers(ratingstablename, numberofpartitions, conn, writer, numworkers=None,
+                        executor='process', span=_NULL_SPAN, placement=None, autotune=False):
+    cur = conn.cursor()
 
     # Lấy dữ liệu từ bảng ratings 
+    t0 = time.perf_counter()
     cur.execute(f"SELECT userid, movieid, rating FROM {ratingstablename};")
     row_index = 0
     batch = cur.fetchmany(BATCH_SIZE)
@@ -304,23 +2367,21 @@ def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
     tuple_inserts = [[] for _ in range(numberofpartitions)]
     
     # Thực hiện phân phối dữ liệu vào các mảnh theo round-robin theo từng batch
+    # (chia cả batch bằng slicing thay vì xét từng dòng)
     while batch:
-        for row in batch:
-            # Xác định mảnh cần chèn dữ liệu
-            part_index = row_index % numberofpartitions
-            
-            # Lưu dữ liệu tạm vào mảng danh sách dữ liệu các mảnh
-            tuple_inserts[part_index].append((row[0], row[1], row[2]))
-            row_index += 1
+        for p, dataTuples in _roundrobin_split(batch, row_index, numberofpartitions):
+            tuple_inserts[p].extend(dataTuples)
+        row_index += len(batch)
         batch = cur.fetchmany(BATCH_SIZE)
         
     # Đóng con trỏ đọc dữ liệu và commit các thay đổi
     cur.close()
     conn.commit()
+    span.addphase('fetch', time.perf_counter() - t0)
 
-    # Lấy các thông số kết nối để sử dụng trong multiprocessing
-    conn_params = conn.get_dsn_parameters()
-    conn_params['password'] = DB_PASSWORD  
+    # Lấy các thông số kết nối để sử dụng trong multiprocessing (theo node chứa từng mảnh)
+    conn_params = _get_conn_info(conn)
+    fragment_params = _fragment_conn_infos(conn, numberofpartitions, placement)
     
     # Tạo danh sách các task để thực hiện chèn dữ liệu song song
     # Mỗi task sẽ ứng với một mảnh 
@@ -332,57 +2393,909 @@ def roundrobinpartition(ratingstablename, numberofpartitions, openconnection):
 
         tableName = f"{RROBIN_TABLE_PREFIX}{i}"
         columnTuples = ('userid', 'movieid', 'rating')
-        tasks.append((tableName, columnTuples, dataTuples, BATCH_SIZE, conn_params))
-
-    # Tạo pool các task cho thực hiện song song
-    # Thực hiện chèn dữ liệu song song vào các mảnh 
-    pool = Pool(processes=len(tasks))
-    pool.map(_batchinsert_worker, tasks)
-    pool.close()
-    pool.join()
-    
-    # THời gian kết thúc 
-    end = time.time()
-    print(f"[roundrobinpartition] Completed in {end - start:.2f} seconds. ")
-    
+        tasks.append((tableName, columnTuples, dataTuples, BATCH_SIZE, fragment_params[i], writer, autotune))
+
+    # Thực hiện chèn dữ liệu song song vào các mảnh trên pool worker dùng lại được
+    with span.phase('workers'):
+        stats = _run_tasks(_batchinsert_worker, tasks, conn_params, numworkers, executor)
+    span.set('partition_rows', {stat['table']: stat['rows'] for stat in stats})
+    span.set('workers_stats', stats)
+    return row_index, stats
 
 
 # Hàm chèn bản ghi mới vào các mảnh phân vùng theo round-robin
 def roundrobininsert(ratingstablename, userid, movieid, rating, openconnection):
-    # Lấy thời gian bắt đầu
-    start = time.time()
-    
-    # Mở kết nối và con trỏ
-    conn = openconnection
-    cur = conn.cursor()
-    
-    # Đếm số lượng mảnh phân vùng hiện tại
-    cur.execute("""
-        SELECT COUNT(*) 
-        FROM pg_catalog.pg_tables
-        WHERE schemaname NOT IN ('pg_catalog', 'information_schema')
-        AND tablename LIKE %s;
-    """, (RROBIN_TABLE_PREFIX + '%',))
-    partition_number = cur.fetchone()[0]
-    
-    
-    # Đếm số lượng bản ghi trong bảng ratings
-    cur.execute(f"SELECT COUNT(*) FROM {ratingstablename}")
-    total_rows = cur.fetchone()[0]
+    with _span('roundrobininsert', table=ratingstablename) as span:
+        # Số mảnh lấy từ metadata (thường có sẵn trong bộ nhớ đệm, được đối chiếu với bảng
+        # metadata khi cấp slot và trong chính câu INSERT)
+        # Mảnh đích từ slot tiếp theo của sequence, không cần đếm lại bảng ratings
+        def route(meta, slot):
+            partition_index = slot % meta['numpartitions']
+            span.set('partition', f"{meta['prefix']}{partition_index}")
+            return partition_index
 
-    # Tính toán chỉ số mảnh phân vùng cần chèn dữ liệu
-    partition_index = (total_rows) % partition_number
-    
-    # Thực hiện chèn dữ liệu vào mảnh phân vùng theo round-robin
-    cur.execute(f"""
-        INSERT INTO {RROBIN_TABLE_PREFIX}{partition_index} (userid, movieid, rating)
-        VALUES ({userid}, {movieid}, {rating});
-    """)
-    
-    # In ra thời gian thực hiện chèn dữ liệu
-    end = time.time()
-    print(f"[roundrobininsert] Inserted into {RROBIN_TABLE_PREFIX}{partition_index} in {end - start:.2f} seconds.")
-    
-    # Commit các thay đổi và đóng con trỏ
+        # Thực hiện chèn dữ liệu vào mảnh phân vùng theo round-robin trên node chứa mảnh
+        with span.phase('insert'):
+            idx = _insert_one(openconnection, 'rrobin', ratingstablename, route, (userid, movieid, rating),
+                              slot=True)
+        if idx is not None:
+            span.count('rows')
+
+# Hàm chèn nhiều bản ghi (userid, movieid, rating) vào các mảnh theo round-robin
+# Các slot được cấp một lượt từ RROBIN_INSERT_SEQ (an toàn khi có nhiều tiến trình cùng chèn),
+# mảnh đích = slot % n, mỗi mảnh ghi bằng một lệnh COPY trong cùng một transaction
+# Trả về số dòng đã ghi vào từng mảnh
+def roundrobininsert_many(ratingstablename, ratings, openconnection, writer='binary'):
+    with _span('roundrobininsert_many', table=ratingstablename) as span:
+        rows = list(ratings)
+        if not rows:
+            return []
+
+        def insert(cur, meta):
+            with span.phase('route'):
+                cur.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (RROBIN_INSERT_SEQ, len(rows)))
+                slots = [r[0] for r in cur.fetchall()]
+                if np is not None:
+                    targets = np.asarray(slots, dtype=np.int64) % meta['numpartitions']
+                else:
+                    targets = [slot % meta['numpartitions'] for slot in slots]
+                groups = _group_by_partition(rows, targets, meta['numpartitions'])
+            with span.phase('write'):
+                return _write_groups(cur, meta['prefix'], groups, writer, meta['placement'])
+
+        counts = _with_partition_meta(openconnection, 'rrobin', ratingstablename, insert)
+        if counts is None:
+            return []
+        span.count('rows', len(rows))
+        span.set('partition_rows', counts)
+        return counts
+
+# Hàm băm ổn định cho khóa số nguyên (băm nhân Knuth trên 32 bit), cho cùng kết quả
+# ở Python, NumPy và SQL nên mảnh đích không phụ thuộc nơi tính
+_HASH_MULTIPLIER = 2654435761
+_HASH_MODULUS    = 4294967296
+
+# Chỉ số mảnh băm của một giá trị khóa
+def _hash_index(value, numberofpartitions):
+    return (int(value) * _HASH_MULTIPLIER) % _HASH_MODULUS % numberofpartitions
+
+# Biểu thức SQL tính chỉ số mảnh băm của cột key (giống _hash_index, kể cả với khóa âm)
+def _hash_sql(key, numberofpartitions):
+    return sql.SQL("((({key}::bigint * {mul}) % {mod} + {mod}) % {mod}) % {n}").format(
+        key=sql.Identifier(key), mul=sql.Literal(_HASH_MULTIPLIER), mod=sql.Literal(_HASH_MODULUS),
+        n=sql.Literal(numberofpartitions))
+
+# Chỉ số mảnh băm của một mảng khóa int64
+def _hash_array(keys, numberofpartitions):
+    return (keys * _HASH_MULTIPLIER) % _HASH_MODULUS % numberofpartitions
+
+# Chỉ số mảnh băm của từng dòng theo cột thứ column, tính một lượt bằng NumPy nếu có
+def _hash_targets(rows, column, numberofpartitions):
+    if np is not None:
+        keys = np.fromiter((row[column] for row in rows), dtype=np.int64, count=len(rows))
+        return _hash_array(keys, numberofpartitions)
+    return [_hash_index(row[column], numberofpartitions) for row in rows]
+
+# Kiểm tra tên cột khóa băm, trả về vị trí cột trong (userid, movieid, rating)
+def _hash_column(key):
+    if key not in HASH_KEYS:
+        raise ValueError(f"Unknown hash key: {key}")
+    return RATING_COLUMNS.index(key)
+
+# Tạo bộ định tuyến cho dòng COPY text "userid\tmovieid\trating" theo băm của cột khóa
+def _hash_router(column, numberofpartitions):
+    def route(line):
+        return _hash_index(line.split(b"\t", 2)[column], numberofpartitions)
+    return route
+
+# Tạo hàm chia batch theo băm của cột khóa cho engine asyncio
+def _hash_splitter(column, numberofpartitions):
+    def split(batch, row_index):
+        groups = _group_by_partition(batch, _hash_targets(batch, column, numberofpartitions),
+                                     numberofpartitions)
+        return [(p, dataTuples) for p, dataTuples in enumerate(groups) if dataTuples]
+    return split
+
+# Hàm phân vùng băm (hashpartition) theo cột key ('userid' hoặc 'movieid')
+# Mọi bản ghi của cùng một userid / movieid nằm trong đúng một mảnh, nên truy vấn điểm và
+# phép nối theo khóa chỉ cần đọc một mảnh
+# method = 'scan': quét bảng ratings một lần và định tuyến từng dòng vào mảnh (mặc định)
+# method = 'columnar': quét một lần dạng binary, định tuyến theo khối mảng NumPy (cần numpy)
+# method = 'server': di chuyển dữ liệu hoàn toàn phía server bằng INSERT ... SELECT
+# method = 'async': engine asyncio một tiến trình, concurrency kết nối ghi chạy đồng thời
+# unlogged = True: chế độ bulk-load, tạo mảnh UNLOGGED nên việc nạp không ghi WAL; sau khi nạp
+#                  setlogged = True chuyển mảnh sang LOGGED (False: nhanh hơn nhưng mảnh bị
+#                  xóa trắng nếu server gặp sự cố)
+# analyze = True: chạy ANALYZE các mảnh sau khi nạp
+# indexes: tên các index phụ trong FRAGMENT_INDEXES dựng song song trên mọi mảnh sau khi nạp
+# nodes: danh sách DSN của các node PostgreSQL để đặt mảnh (mảnh i trên node i % len(nodes),
+#        bản đồ đặt mảnh lưu trong metadata), chỉ dùng với method = 'scan' / 'columnar'
+def hashpartition(ratingstablename, numberofpartitions, openconnection, key='userid', method='scan',
+                  concurrency=4, unlogged=False, setlogged=True, analyze=False, indexes=(), nodes=None):
+    if method not in ('scan', 'columnar', 'server', 'async'):
+        raise ValueError(f"Unknown hashpartition method: {method}")
+    _check_nodes(nodes, method, ('scan', 'columnar'))
+    indexes = _check_indexes(indexes)
+    placement = _place_fragments(openconnection, nodes, numberofpartitions)
+    column = _hash_column(key)
+
+    with _span('hashpartition', table=ratingstablename, partitions=numberofpartitions,
+               method=method, key=key) as span:
+        # Tạo các mảnh phân vùng băm
+        with span.phase('create'):
+            _create_fragments(openconnection, HASH_TABLE_PREFIX, numberofpartitions, unlogged=unlogged,
+                              placement=placement)
+
+        if numberofpartitions > 0:
+            if method == 'scan':
+                _scan_partition(ratingstablename, HASH_TABLE_PREFIX, numberofpartitions,
+                                _hash_router(column, numberofpartitions), openconnection, span, placement)
+            elif method == 'columnar':
+                _columnar_partition(ratingstablename, HASH_TABLE_PREFIX, numberofpartitions,
+                                    _hash_array_targets(key, numberofpartitions), openconnection, span,
+                                    placement)
+            elif method == 'server':
+                with span.phase('insert_select'):
+                    total_rows = _server_side_partition(ratingstablename, HASH_TABLE_PREFIX, numberofpartitions,
+                                                        _hash_sql(key, numberofpartitions), openconnection)
+                span.count('rows', total_rows)
+            else:
+                with span.phase('async'):
+                    total_rows = _run_async_partition(ratingstablename, HASH_TABLE_PREFIX,
+                                                      _hash_splitter(column, numberofpartitions),
+                                                      openconnection, concurrency)
+                span.count('rows', total_rows)
+
+        # Hoàn tất các mảnh ở chế độ bulk-load và dựng index phụ
+        _finish_fragments(openconnection, HASH_TABLE_PREFIX, numberofpartitions,
+                          unlogged and setlogged, analyze, span, indexes, placement=placement)
+
+        # Lưu metadata (số mảnh, cột khóa, index, nơi đặt mảnh) để hashinsert định tuyến không cần
+        # truy vấn catalog
+        with span.phase('metadata'):
+            _save_partition_meta(openconnection, 'hash', HASH_TABLE_PREFIX, ratingstablename,
+                                 numberofpartitions, partkey=key, indexes=indexes, placement=placement)
+
+# Hàm chèn bản ghi mới vào mảnh phân vùng băm theo cột khóa đã lưu trong metadata
+def hashinsert(ratingstablename, userid, movieid, rating, openconnection):
+    with _span('hashinsert', table=ratingstablename) as span:
+        # Số mảnh và cột khóa lấy từ metadata (thường có sẵn trong bộ nhớ đệm, được đối chiếu
+        # với bảng metadata trong chính câu INSERT)
+        row = (userid, movieid, rating)
+
+        def route(meta, slot):
+            # Tính mảnh đích từ giá trị khóa
+            idx = _hash_index(row[_hash_column(meta['partkey'])], meta['numpartitions'])
+            span.set('partition', f"{meta['prefix']}{idx}")
+            return idx
+
+        # Thực hiện INSERT vào mảnh tương ứng trên node chứa mảnh
+        with span.phase('insert'):
+            idx = _insert_one(openconnection, 'hash', ratingstablename, route, row)
+        if idx is not None:
+            span.count('rows')
+
+# Hàm chèn nhiều bản ghi (userid, movieid, rating) vào các mảnh băm, mỗi mảnh ghi bằng một
+# lệnh COPY trong cùng một transaction. Trả về số dòng đã ghi vào từng mảnh
+def hashinsert_many(ratingstablename, ratings, openconnection, writer='binary'):
+    with _span('hashinsert_many', table=ratingstablename) as span:
+        rows = list(ratings)
+        if not rows:
+            return []
+
+        def insert(cur, meta):
+            with span.phase('route'):
+                targets = _hash_targets(rows, _hash_column(meta['partkey']), meta['numpartitions'])
+                groups = _group_by_partition(rows, targets, meta['numpartitions'])
+            with span.phase('write'):
+                return _write_groups(cur, meta['prefix'], groups, writer, meta['placement'])
+
+        counts = _with_partition_meta(openconnection, 'hash', ratingstablename, insert)
+        if counts is None:
+            return []
+        span.count('rows', len(rows))
+        span.set('partition_rows', counts)
+        return counts
+
+# Hàm chèn theo lô của từng scheme, dùng cho InsertBuffer
+_INSERT_MANY = {
+    'range':  rangeinsert_many,
+    'rrobin': roundrobininsert_many,
+    'hash':   hashinsert_many,
+}
+
+# Bộ đệm ghi sau (write-behind) cho chèn từng dòng tốc độ cao: add() chỉ đưa bản ghi vào
+# bộ nhớ, các bản ghi được gom theo mảnh đích và ghi bằng rangeinsert_many /
+# roundrobininsert_many / hashinsert_many (mỗi mảnh một lệnh COPY, một transaction mỗi lần flush)
+# scheme: 'range', 'rrobin' hoặc 'hash'
+# flush_rows: flush khi bộ đệm đủ số dòng này
+# flush_seconds: flush khi dòng cũ nhất đã chờ quá số giây này (luồng nền), None để tắt
+# Lỗi của lần flush nền được ném lại ở lần gọi add / flush / close tiếp theo, các dòng chưa ghi
+# được vẫn giữ trong bộ đệm. Khi bộ đệm đang mở, không dùng openconnection cho transaction khác
+# Dùng với with: thoát khối with sẽ flush nốt và đóng bộ đệm
+class InsertBuffer(object):
+    def __init__(self, ratingstablename, openconnection, scheme='range', flush_rows=BATCH_SIZE,
+                 flush_seconds=1.0, writer='binary'):
+        if scheme not in _INSERT_MANY:
+            raise ValueError(f"Unknown partition scheme: {scheme}")
+        self.table = ratingstablename
+        self.scheme = scheme
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows = 0
+        self.flushes = 0
+        self._conn = openconnection
+        self._writer = _make_writer(writer)
+        self._pending = []
+        self._oldest = None
+        self._error = None
+        self._closed = False
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._timer = None
+        if flush_seconds:
+            self._timer = threading.Thread(target=self._run, name=f"insertbuffer-{scheme}", daemon=True)
+            self._timer.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Nhận một bản ghi, flush ngay nếu bộ đệm đã đủ flush_rows dòng
+    def add(self, userid, movieid, rating):
+        self._check()
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((userid, movieid, rating))
+            if len(self._pending) >= self.flush_rows:
+                self._flush()
+
+    # Nhận nhiều bản ghi (userid, movieid, rating)
+    def extend(self, ratings):
+        for userid, movieid, rating in ratings:
+            self.add(userid, movieid, rating)
+
+    # Ghi toàn bộ bộ đệm vào các mảnh, trả về số dòng đã ghi
+    def flush(self):
+        self._check()
+        return self._flush()
+
+    # Dừng luồng nền, flush nốt bộ đệm và đóng; gọi nhiều lần không sao
+    def close(self):
+        if self._closed:
+            return
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        # Lỗi flush nền (nếu có) được bỏ qua khi lần flush cuối ghi được các dòng còn lại;
+        # nếu lần flush này lỗi thì bộ đệm chưa đóng, các dòng vẫn còn và có thể gọi lại close
+        self._error = None
+        self._flush()
+        self._closed = True
+
+    def _check(self):
+        if self._closed:
+            raise ValueError("InsertBuffer is closed")
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _flush(self):
+        with self._lock:
+            rows = self._pending
+            if not rows:
+                return 0
+            with _span('insertbuffer.flush', table=self.table, scheme=self.scheme) as span:
+                counts = _INSERT_MANY[self.scheme](self.table, rows, self._conn, self._writer)
+                # Chưa có mảnh nào thì hàm _many không ghi gì: giữ các dòng trong bộ đệm và báo lỗi
+                if not counts:
+                    raise ValueError(f"No {self.scheme} partitions to insert into")
+                span.count('rows', len(rows))
+            self._pending = []
+            self._oldest = None
+            self.rows += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    # Luồng nền: flush khi dòng cũ nhất đã chờ đủ flush_seconds
+    def _run(self):
+        wait = self.flush_seconds
+        while not self._stop.wait(wait):
+            with self._lock:
+                oldest = self._oldest
+                wait = self.flush_seconds
+                if oldest is None or self._error is not None:
+                    continue
+                age = time.monotonic() - oldest
+                if age < self.flush_seconds:
+                    wait = self.flush_seconds - age
+                    continue
+                try:
+                    self._flush()
+                except Exception as e:
+                    self._error = e
+
+# Bộ định tuyến round-robin theo thứ tự dòng đi qua: dòng thứ k vào mảnh k % n
+def _roundrobin_router(numberofpartitions):
+    slots = count()
+
+    def route(line):
+        return next(slots) % numberofpartitions
+    return route
+
+# Nạp file .dat và phân vùng trong một lượt đọc: mỗi dòng được COPY thẳng vào mảnh đích của
+# scheme ('range', 'rrobin' hoặc 'hash') và, nếu loadbase = True, cả vào bảng ratingstablename,
+# nên không phải đọc lại bảng ratings sau khi nạp
+# key: cột khóa cho scheme 'hash'
+# boundaries: 'equal' hoặc danh sách cận cho scheme 'range' ('quantile' cần dữ liệu đã nạp)
+# unlogged, setlogged, analyze: chế độ bulk-load, áp dụng cho cả mảnh và bảng ratings
+# indexes: các index phụ dựng trên mảnh sau khi nạp (xem rangepartition)
+# Trả về số dòng đã ghi vào từng mảnh
+def loadandpartition(ratingsfilepath, scheme, numberofpartitions, openconnection, ratingstablename='ratings',
+                     loadbase=True, key='userid', boundaries='equal', unlogged=False, setlogged=True,
+                     analyze=False, indexes=()):
+    if scheme not in _SCHEME_PREFIXES:
+        raise ValueError(f"Unknown partition scheme: {scheme}")
+    if numberofpartitions <= 0:
+        raise ValueError("numberofpartitions must be positive")
+    indexes = _check_indexes(indexes)
+
+    # Chọn bộ định tuyến dòng COPY text theo scheme
+    prefix = _SCHEME_PREFIXES[scheme]
+    bounds = partkey = None
+    if scheme == 'range':
+        if boundaries == 'quantile':
+            raise ValueError("quantile boundaries need loaded data, use loadratings + rangepartition")
+        bounds = _compute_range_bounds(openconnection, ratingstablename, numberofpartitions, boundaries)
+        route = _range_router(bounds)
+    elif scheme == 'hash':
+        partkey = key
+        route = _hash_router(_hash_column(key), numberofpartitions)
+    else:
+        route = _roundrobin_router(numberofpartitions)
+
+    with _span('loadandpartition', table=ratingstablename, scheme=scheme, partitions=numberofpartitions,
+               loadbase=loadbase) as span:
+        # Tạo bảng ratings (nếu cần) và các mảnh
+        with span.phase('create'):
+            if loadbase:
+                _create_ratings_table(openconnection, ratingstablename, unlogged)
+            _create_fragments(openconnection, prefix, numberofpartitions, unlogged=unlogged)
+
+        # Đọc file một lần, mỗi dòng vào bộ đệm của mảnh đích (và của bảng ratings)
+        cur = openconnection.cursor()
+        tables = [f"{prefix}{i}" for i in range(numberofpartitions)]
+        router = _PartitionRouter(cur, tables, route, tee_table=ratingstablename if loadbase else None)
+        t0 = time.perf_counter()
+        with open(ratingsfilepath, 'rb') as fin:
+            stream = _RatingsDatStream(fin)
+            while True:
+                data = stream.read(1 << 20)
+                if not data:
+                    break
+                router.write(data)
+        router.close()
+        span.addphase('parse', time.perf_counter() - t0 - router.write_seconds)
+        span.addphase('write', router.write_seconds)
+
+        with span.phase('commit'):
+            openconnection.commit()
+        cur.close()
+        span.count('rows', stream.rows)
+        span.set('partition_rows', router.counts)
+
+        # Hoàn tất các mảnh (và bảng ratings) ở chế độ bulk-load
+        _finish_fragments(openconnection, prefix, numberofpartitions, unlogged and setlogged, analyze, span,
+                          indexes)
+        if loadbase and (unlogged and setlogged or analyze):
+            with span.phase('finish'):
+                _finish_fragment_worker((ratingstablename, _get_conn_info(openconnection),
+                                         unlogged and setlogged, analyze))
+
+        # Lưu metadata giống các hàm phân vùng, slot round-robin tiếp theo = số dòng đã chia
+        with span.phase('metadata'):
+            _save_partition_meta(openconnection, scheme, prefix, ratingstablename, numberofpartitions,
+                                 bounds, stream.rows if scheme == 'rrobin' else None, partkey, indexes)
+    return router.counts
+
+# Số block hiện tại của một bảng
+def _relation_blocks(cur, tableName):
+    cur.execute("SELECT pg_relation_size(%s) / current_setting('block_size')::int", (tableName,))
+    return cur.fetchone()[0]
+
+# Câu lệnh chuyển các dòng của src có target_expr khác src_index sang mảnh đích tương ứng
+# Trong một câu lệnh: DELETE ... RETURNING trên khoảng ctid rồi INSERT vào từng mảnh đích
+def _move_rows_sql(src, src_index, prefix, target_expr, targets, where):
+    inserts = [
+        sql.SQL("i{0} AS (INSERT INTO {1} (userid, movieid, rating) "
+                "SELECT userid, movieid, rating FROM moved WHERE part = {0})")
+           .format(sql.Literal(j), sql.Identifier(f"{prefix}{j}"))
+        for j in targets if j != src_index
+    ]
+    return sql.SQL("""
+        WITH moved AS (
+            DELETE FROM {src} WHERE {where} AND ({expr}) <> {idx}
+            RETURNING userid, movieid, rating, {expr} AS part
+        ), {inserts}
+        SELECT COUNT(*) FROM moved
+    """).format(src=sql.Identifier(src), where=where, expr=target_expr, idx=sql.Literal(src_index),
+                inserts=sql.SQL(", ").join(inserts))
+
+# Di chuyển trực tuyến các dòng không còn thuộc mảnh src_index, theo từng khoảng block,
+# mỗi khoảng một transaction ngắn để rangeinsert / roundrobininsert vẫn chạy song song
+# Các block được thêm vào cuối bảng trong lúc di chuyển cũng được quét. Trả về số dòng đã chuyển
+def _move_rows_online(openconnection, prefix, src_index, target_expr, targets, batchsize):
+    src = f"{prefix}{src_index}"
+    if not [j for j in targets if j != src_index]:
+        return 0
+    step = max(1, batchsize // _ROWS_PER_BLOCK)
+    moved = 0
+    block = 0
+    while True:
+        with _transaction(openconnection) as cur:
+            if block >= _relation_blocks(cur, src):
+                break
+            where = sql.SQL("ctid >= {}::tid AND ctid < {}::tid").format(
+                sql.Literal(f"({block},0)"), sql.Literal(f"({block + step},0)"))
+            cur.execute(_move_rows_sql(src, src_index, prefix, target_expr, targets, where))
+            moved += cur.fetchone()[0]
+        block += step
+    return moved
+
+# Xóa một mảnh thừa: khóa bảng, chuyển nốt các dòng còn sót (do chèn đồng thời) rồi DROP,
+# tất cả trong một transaction để không mất dòng nào
+def _drop_fragment(openconnection, prefix, src_index, target_expr, targets):
+    src = f"{prefix}{src_index}"
+    with _transaction(openconnection) as cur:
+        cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(src)))
+        cur.execute(_move_rows_sql(src, src_index, prefix, target_expr, targets, sql.SQL("TRUE")))
+        cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(src)))
+
+# Chuyển k dòng từ src sang dst, lấy dần từ cuối bảng về đầu theo khoảng block
+# (tránh quét lại các dòng chết ở đầu bảng). Trả về số dòng đã chuyển
+def _move_count_online(openconnection, src, dst, k, batchsize):
+    step = max(1, batchsize // _ROWS_PER_BLOCK)
+    with _transaction(openconnection) as cur:
+        block = _relation_blocks(cur, src)
+    moved = 0
+    while moved < k and block > 0:
+        start = max(0, block - step)
+        limit = min(batchsize, k - moved)
+        with _transaction(openconnection) as cur:
+            cur.execute(sql.SQL("""
+                WITH moved AS (
+                    DELETE FROM {src} WHERE ctid = ANY(ARRAY(
+                        SELECT ctid FROM {src} WHERE ctid >= {lo}::tid AND ctid < {hi}::tid LIMIT {limit}))
+                    RETURNING userid, movieid, rating
+                ), ins AS (
+                    INSERT INTO {dst} (userid, movieid, rating) SELECT userid, movieid, rating FROM moved
+                )
+                SELECT COUNT(*) FROM moved
+            """).format(src=sql.Identifier(src), dst=sql.Identifier(dst),
+                        lo=sql.Literal(f"({start},0)"), hi=sql.Literal(f"({block},0)"),
+                        limit=sql.Literal(limit)))
+            count = cur.fetchone()[0]
+        moved += count
+        if count < limit:
+            block = start
+    return moved
+
+# Dựng các index phụ đã ghi trong metadata trên những mảnh mới được repartition thêm vào,
+# trước khi có dữ liệu nên chi phí dựng không đáng kể
+def _index_new_fragments(openconnection, meta, numberofpartitions):
+    if meta['indexes']:
+        _finish_fragments(openconnection, meta['prefix'], numberofpartitions, indexes=tuple(meta['indexes']),
+                          first=meta['numpartitions'])
+
+# Đổi số mảnh range mà chỉ di chuyển các dòng có mảnh đích thay đổi
+def _range_repartition(openconnection, meta, numberofpartitions, batchsize, boundaries):
+    old_n, old_bounds = meta['numpartitions'], meta['boundaries']
+    new_bounds = _compute_range_bounds(openconnection, meta['source'], numberofpartitions, boundaries)
+    prefix = meta['prefix']
+
+    # Tạo mảnh mới và chuyển định tuyến sang cận mới trước khi di chuyển dữ liệu,
+    # từ đây các bản ghi chèn mới đã vào đúng mảnh cuối cùng
+    _create_fragments(openconnection, prefix, numberofpartitions, replace=False)
+    _index_new_fragments(openconnection, meta, numberofpartitions)
+    _save_partition_meta(openconnection, 'range', prefix, meta['source'], numberofpartitions, new_bounds,
+                         indexes=meta['indexes'])
+
+    targets = list(range(numberofpartitions))
+    case_sql = _range_case_sql(new_bounds)
+    moved = 0
+    for s in range(min(old_n, numberofpartitions)):
+        old_interval = (old_bounds[s - 1] if s > 0 else 0.0, old_bounds[s])
+        new_interval = (new_bounds[s - 1] if s > 0 else 0.0, new_bounds[s])
+        if old_interval == new_interval:
+            continue
+        # Rating ngoài mọi khoảng ở lại mảnh hiện tại
+        expr = sql.SQL("COALESCE({}, {})").format(case_sql, sql.Literal(s))
+        moved += _move_rows_online(openconnection, prefix, s, expr, targets, batchsize)
+    for s in range(numberofpartitions, old_n):
+        # Mảnh bị bỏ: rating ngoài mọi khoảng chuyển về mảnh 0 giống rangeinsert
+        expr = sql.SQL("COALESCE({}, 0)").format(case_sql)
+        moved += _move_rows_online(openconnection, prefix, s, expr, targets, batchsize)
+        _drop_fragment(openconnection, prefix, s, expr, targets)
+    return moved
+
+# Đổi số mảnh round-robin: giữ nguyên các dòng, chỉ chuyển phần dư của mảnh đông sang mảnh
+# thiếu để kích thước các mảnh đúng bằng kết quả chia round-robin trên tổng số dòng
+def _roundrobin_repartition(openconnection, meta, numberofpartitions, batchsize):
+    old_n, prefix = meta['numpartitions'], meta['prefix']
+
+    # Tạo mảnh mới, rồi đếm và chuyển định tuyến trước khi di chuyển dữ liệu trong cùng một
+    # transaction giữ khóa độc quyền trên metadata: các lệnh chèn theo định tuyến cũ đã commit
+    # trước khi đếm, các lệnh chèn sau đó bắt đầu từ slot tiếp theo = tổng số dòng
+    _create_fragments(openconnection, prefix, numberofpartitions, replace=False)
+    _index_new_fragments(openconnection, meta, numberofpartitions)
+    with _transaction(openconnection) as cur:
+        _lock_partition_meta(cur, 'rrobin')
+        counts = []
+        for i in range(old_n):
+            cur.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(sql.Identifier(f"{prefix}{i}")))
+            counts.append(cur.fetchone()[0])
+        total_rows = sum(counts)
+        _save_partition_meta(openconnection, 'rrobin', prefix, meta['source'], numberofpartitions,
+                             nextslot=total_rows, indexes=meta['indexes'], cur=cur)
+
+    size = max(old_n, numberofpartitions)
+    counts += [0] * (size - old_n)
+    wanted = [total_rows // numberofpartitions + (1 if i < total_rows % numberofpartitions else 0)
+              if i < numberofpartitions else 0 for i in range(size)]
+    donors = [[i, counts[i] - wanted[i]] for i in range(size) if counts[i] > wanted[i]]
+    receivers = [[i, wanted[i] - counts[i]] for i in range(size) if counts[i] < wanted[i]]
+
+    moved = 0
+    while donors and receivers:
+        donor, receiver = donors[-1], receivers[-1]
+        k = min(donor[1], receiver[1])
+        count = _move_count_online(openconnection, f"{prefix}{donor[0]}", f"{prefix}{receiver[0]}", k, batchsize)
+        moved += count
+        donor[1] -= k
+        receiver[1] -= k
+        if donor[1] == 0 or count < k:
+            donors.pop()
+        if receiver[1] == 0:
+            receivers.pop()
+
+    # Bỏ các mảnh thừa, dòng còn sót (do chèn đồng thời) về mảnh 0
+    for s in range(numberofpartitions, old_n):
+        _drop_fragment(openconnection, prefix, s, sql.SQL("0"), [0])
+    return moved
+
+# Đổi số mảnh băm: mỗi mảnh cũ chuyển các dòng có băm mới khác chỉ số của nó,
+# các mảnh thừa được dồn hết sang mảnh mới rồi xóa
+def _hash_repartition(openconnection, meta, numberofpartitions, batchsize):
+    old_n, prefix, key = meta['numpartitions'], meta['prefix'], meta['partkey']
+
+    # Tạo mảnh mới và chuyển định tuyến trước khi di chuyển dữ liệu
+    _create_fragments(openconnection, prefix, numberofpartitions, replace=False)
+    _index_new_fragments(openconnection, meta, numberofpartitions)
+    _save_partition_meta(openconnection, 'hash', prefix, meta['source'], numberofpartitions, partkey=key,
+                         indexes=meta['indexes'])
+
+    targets = list(range(numberofpartitions))
+    expr = _hash_sql(key, numberofpartitions)
+    moved = 0
+    for s in range(old_n):
+        moved += _move_rows_online(openconnection, prefix, s, expr, targets, batchsize)
+        if s >= numberofpartitions:
+            _drop_fragment(openconnection, prefix, s, expr, targets)
+    return moved
+
+# Đổi số mảnh của một scheme ('range', 'rrobin' hoặc 'hash') mà không dựng lại từ bảng ratings
+# Chỉ các dòng cần đổi mảnh được di chuyển, theo từng batch trong transaction ngắn nên
+# rangeinsert / roundrobininsert có thể tiếp tục chạy trong lúc di chuyển
+# boundaries: cách tính cận mới cho scheme 'range' (xem rangepartition)
+# Trả về số dòng đã di chuyển
+def repartition(scheme, numberofpartitions, openconnection, batchsize=BATCH_SIZE, boundaries='equal'):
+    if scheme not in _SCHEME_PREFIXES:
+        raise ValueError(f"Unknown partition scheme: {scheme}")
+    if numberofpartitions <= 0:
+        raise ValueError("numberofpartitions must be positive")
+
+    meta = _get_partition_meta(openconnection, scheme)
+    if meta is None:
+        raise ValueError(f"No {scheme} partitions to repartition")
+    # Việc di chuyển dòng chạy trong một câu lệnh SQL nên các mảnh phải cùng cơ sở dữ liệu
+    if meta['placement']:
+        raise ValueError("repartition does not support fragments placed on other nodes")
+
+    with _span('repartition', scheme=scheme, partitions=numberofpartitions,
+               previous=meta['numpartitions']) as span:
+        if scheme == 'range':
+            moved = _range_repartition(openconnection, meta, numberofpartitions, batchsize, boundaries)
+        elif scheme == 'hash':
+            moved = _hash_repartition(openconnection, meta, numberofpartitions, batchsize)
+        else:
+            moved = _roundrobin_repartition(openconnection, meta, numberofpartitions, batchsize)
+        span.count('moved', moved)
+    return moved
+
+# Job phân vùng có checkpoint: bảng gốc được chia theo khoảng block (ctid) thành các chunk
+# khoảng CHECKPOINT_CHUNK_ROWS dòng. Mỗi chunk được ghi vào các mảnh và đánh dấu xong trong
+# PARTITION_CHUNK_TABLE trong cùng một transaction, nên khi job bị dừng giữa chừng các mảnh chỉ
+# chứa trọn vẹn các chunk đã xong và resumepartition chạy tiếp đúng các chunk còn lại
+# Bảng gốc không được thay đổi cho tới khi job hoàn tất (ctid của các dòng phải giữ nguyên)
+
+# Tạo bảng job (một dòng cho mỗi scheme) và bảng chunk nếu chưa có
+def _ensure_partition_jobs(cur):
+    cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            scheme        TEXT PRIMARY KEY,
+            prefix        TEXT NOT NULL,
+            source        TEXT NOT NULL,
+            filenode      OID,
+            numpartitions INTEGER NOT NULL,
+            boundaries    DOUBLE PRECISION[],
+            writer        TEXT NOT NULL,
+            indexes       TEXT[],
+            runanalyze    BOOLEAN NOT NULL DEFAULT false,
+            totalrows     BIGINT NOT NULL,
+            status        TEXT NOT NULL,
+            updated_at    TIMESTAMP NOT NULL DEFAULT now()
+        );
+    """).format(sql.Identifier(PARTITION_JOB_TABLE)))
+    cur.execute(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {} (
+            scheme      TEXT REFERENCES {} (scheme) ON DELETE CASCADE,
+            chunk       INTEGER,
+            firstblock  BIGINT NOT NULL,
+            lastblock   BIGINT NOT NULL,
+            firstrow    BIGINT NOT NULL,
+            numrows     BIGINT NOT NULL,
+            done        BOOLEAN NOT NULL DEFAULT false,
+            finished_at TIMESTAMP,
+            PRIMARY KEY (scheme, chunk)
+        );
+    """).format(sql.Identifier(PARTITION_CHUNK_TABLE), sql.Identifier(PARTITION_JOB_TABLE)))
+
+# Hủy job của các mảnh prefix (gọi khi các mảnh bị tạo lại), để resumepartition không ghi
+# chồng các chunk cũ lên mảnh mới
+def _cancel_partition_job(openconnection, prefix):
+    cur = openconnection.cursor()
+    cur.execute("SELECT to_regclass(%s)", (PARTITION_JOB_TABLE,))
+    if cur.fetchone()[0] is not None:
+        cur.execute(sql.SQL("DELETE FROM {} WHERE prefix = %s").format(sql.Identifier(PARTITION_JOB_TABLE)),
+                    (prefix,))
+    openconnection.commit()
     cur.close()
-    conn.commit()
\ No newline at end of file
+
+# Lấy job của một scheme dạng dict, None nếu chưa có
+def _get_partition_job(openconnection, scheme):
+    with _transaction(openconnection) as cur:
+        cur.execute("SELECT to_regclass(%s)", (PARTITION_JOB_TABLE,))
+        if cur.fetchone()[0] is None:
+            return None
+        cur.execute(sql.SQL("""
+            SELECT prefix, source, filenode, numpartitions, boundaries, writer, indexes, runanalyze,
+                   totalrows, status
+              FROM {} WHERE scheme = %s
+        """).format(sql.Identifier(PARTITION_JOB_TABLE)), (scheme,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip(('prefix', 'source', 'filenode', 'numpartitions', 'boundaries', 'writer', 'indexes',
+                     'analyze', 'totalrows', 'status'), row))
+
+# Chia bảng gốc thành các chunk, mỗi chunk step block liên tiếp, chỉ giữ các khoảng có dữ liệu
+# firstrow là số dòng đứng trước chunk theo thứ tự ctid, tức vị trí round-robin của dòng đầu chunk
+# Trả về danh sách (chunk, firstblock, lastblock, firstrow, numrows)
+def _plan_chunks(cur, ratingstablename, step):
+    cur.execute(sql.SQL("""
+        SELECT (ctid::text::point)[0]::bigint / {0} AS chunk, COUNT(*)
+          FROM {1} GROUP BY 1 ORDER BY 1
+    """).format(sql.Literal(step), sql.Identifier(ratingstablename)))
+    chunks = []
+    firstrow = 0
+    for chunk, numrows in cur.fetchall():
+        chunks.append((chunk, chunk * step, (chunk + 1) * step, firstrow, numrows))
+        firstrow += numrows
+    return chunks
+
+# Ghi job mới của một scheme (thay job cũ nếu có) cùng danh sách chunk của bảng gốc
+# Trả về số chunk
+def _start_partition_job(openconnection, scheme, ratingstablename, numberofpartitions, boundaries=None,
+                         writer='binary', indexes=(), analyze=False):
+    step = max(1, CHECKPOINT_CHUNK_ROWS // _ROWS_PER_BLOCK)
+    with _transaction(openconnection) as cur:
+        _ensure_partition_jobs(cur)
+        chunks = _plan_chunks(cur, ratingstablename, step)
+        cur.execute("SELECT pg_relation_filenode(%s)", (ratingstablename,))
+        filenode = cur.fetchone()[0]
+        cur.execute(sql.SQL("DELETE FROM {} WHERE scheme = %s").format(sql.Identifier(PARTITION_JOB_TABLE)),
+                    (scheme,))
+        cur.execute(sql.SQL("""
+            INSERT INTO {} (scheme, prefix, source, filenode, numpartitions, boundaries, writer, indexes,
+                            runanalyze, totalrows, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'running')
+        """).format(sql.Identifier(PARTITION_JOB_TABLE)),
+        (scheme, _SCHEME_PREFIXES[scheme], ratingstablename, filenode, numberofpartitions, boundaries, writer,
+         list(indexes) if indexes else None, analyze, sum(chunk[4] for chunk in chunks)))
+        extras.execute_values(cur, sql.SQL("""
+            INSERT INTO {} (scheme, chunk, firstblock, lastblock, firstrow, numrows) VALUES %s
+        """).format(sql.Identifier(PARTITION_CHUNK_TABLE)).as_string(cur),
+        [(scheme,) + chunk for chunk in chunks])
+    return len(chunks)
+
+# Hàm worker của job có checkpoint: khóa dòng của chunk, đọc các dòng của bảng gốc trong khoảng
+# block của chunk, chia vào các mảnh rồi đánh dấu chunk đã xong, tất cả trong một transaction
+# Chunk đã xong (ở lần chạy trước hoặc bởi một resume khác chạy song song) được bỏ qua
+# Trả về thống kê của chunk
+def _checkpoint_chunk_worker(args):
+    scheme, chunk, firstblock, lastblock, firstrow, ratingstablename, numberofpartitions, bounds, \
+        conn_info, writer = args
+    prefix = _SCHEME_PREFIXES[scheme]
+    if scheme == 'range':
+        split = _range_splitter(bounds)
+    else:
+        split = lambda batch, row_index: _roundrobin_split(batch, row_index, numberofpartitions)
+    writer = _make_writer(writer)
+    stats = {'chunk': chunk, 'pid': os.getpid(), 'rows': 0, 'skipped': False}
+
+    t0 = time.perf_counter()
+    with _worker_connection(conn_info) as conn:
+        cur = conn.cursor()
+        cur.execute(sql.SQL("SELECT done FROM {} WHERE scheme = %s AND chunk = %s FOR UPDATE")
+                       .format(sql.Identifier(PARTITION_CHUNK_TABLE)), (scheme, chunk))
+        row = cur.fetchone()
+        if row is None or row[0]:
+            conn.rollback()
+            cur.close()
+            stats['skipped'] = True
+            return stats
+
+        # Quét theo khoảng ctid (TID Range Scan), dòng được đọc theo thứ tự vật lý như lúc lập kế hoạch
+        read_cur = conn.cursor()
+        read_cur.execute(sql.SQL("SELECT userid, movieid, rating FROM {} WHERE ctid >= {}::tid AND ctid < {}::tid")
+                            .format(sql.Identifier(ratingstablename), sql.Literal(f"({firstblock},0)"),
+                                    sql.Literal(f"({lastblock},0)")))
+        row_index = firstrow
+        while True:
+            batch = read_cur.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            for p, dataTuples in split(batch, row_index):
+                writer.write(cur, f"{prefix}{p}", dataTuples)
+            row_index += len(batch)
+        read_cur.close()
+
+        # Checkpoint: đánh dấu chunk xong cùng transaction với dữ liệu đã ghi
+        cur.execute(sql.SQL("UPDATE {} SET done = true, finished_at = now() WHERE scheme = %s AND chunk = %s")
+                       .format(sql.Identifier(PARTITION_CHUNK_TABLE)), (scheme, chunk))
+        conn.commit()
+        cur.close()
+    stats['rows'] = row_index - firstrow
+    stats['seconds'] = time.perf_counter() - t0
+    return stats
+
+# Chạy các chunk chưa xong của job trên pool worker dùng lại được
+# Trả về số dòng đã ghi trong lần chạy này
+def _run_partition_job(openconnection, scheme, numworkers=None, executor='process', span=_NULL_SPAN):
+    job = _get_partition_job(openconnection, scheme)
+    with _transaction(openconnection) as cur:
+        # VACUUM FULL / CLUSTER / TRUNCATE ghi bảng gốc ra file mới, ctid trong kế hoạch không còn đúng
+        cur.execute("SELECT pg_relation_filenode(%s)", (job['source'],))
+        if cur.fetchone()[0] != job['filenode']:
+            raise ValueError(f"Table {job['source']} was rewritten since the {scheme} job started, "
+                             f"partition it again")
+        cur.execute(sql.SQL("""
+            SELECT chunk, firstblock, lastblock, firstrow FROM {}
+             WHERE scheme = %s AND NOT done ORDER BY chunk
+        """).format(sql.Identifier(PARTITION_CHUNK_TABLE)), (scheme,))
+        chunks = cur.fetchall()
+
+    conn_info = _get_conn_info(openconnection)
+    tasks = [(scheme, chunk, firstblock, lastblock, firstrow, job['source'], job['numpartitions'],
+              job['boundaries'], conn_info, job['writer'])
+             for chunk, firstblock, lastblock, firstrow in chunks]
+    with span.phase('chunks'):
+        stats = _run_tasks(_checkpoint_chunk_worker, tasks, conn_info, numworkers, executor)
+    rows = sum(stat['rows'] for stat in stats)
+    span.count('rows', rows)
+    span.set('chunks', len(tasks))
+    span.set('workers_stats', stats)
+    return rows
+
+# Đánh dấu job đã hoàn tất (sau khi các mảnh đã được hoàn tất và metadata đã lưu)
+def _end_partition_job(openconnection, scheme):
+    with _transaction(openconnection) as cur:
+        cur.execute(sql.SQL("UPDATE {} SET status = 'done', updated_at = now() WHERE scheme = %s")
+                       .format(sql.Identifier(PARTITION_JOB_TABLE)), (scheme,))
+
+# Chạy tiếp job phân vùng có checkpoint ('range' hoặc 'rrobin') bị dừng giữa chừng: chỉ các chunk
+# chưa xong được ghi, sau đó hoàn tất mảnh (index phụ, ANALYZE) và lưu metadata như lần chạy đầu
+# numworkers, executor: số worker và loại pool ('process' / 'thread') chạy các chunk
+# Trả về số dòng đã ghi trong lần chạy này (0 nếu job đã hoàn tất)
+def resumepartition(scheme, openconnection, numworkers=None, executor='process'):
+    if scheme not in ('range', 'rrobin'):
+        raise ValueError(f"Unknown checkpointed partition scheme: {scheme}")
+    job = _get_partition_job(openconnection, scheme)
+    if job is None:
+        raise ValueError(f"No {scheme} partitioning job to resume")
+    if job['status'] == 'done':
+        return 0
+
+    prefix, numberofpartitions = job['prefix'], job['numpartitions']
+    indexes = tuple(job['indexes'] or ())
+    with _span('resumepartition', scheme=scheme, table=job['source'], partitions=numberofpartitions) as span:
+        # Tạo lại các mảnh còn thiếu, giữ nguyên dữ liệu của các chunk đã xong
+        with span.phase('create'):
+            _create_fragments(openconnection, prefix, numberofpartitions, replace=False)
+        rows = _run_partition_job(openconnection, scheme, numworkers, executor, span)
+
+        _finish_fragments(openconnection, prefix, numberofpartitions, analyze=job['analyze'], span=span,
+                          indexes=indexes)
+        with span.phase('metadata'):
+            _save_partition_meta(openconnection, scheme, prefix, job['source'], numberofpartitions,
+                                 job['boundaries'], job['totalrows'] if scheme == 'rrobin' else None,
+                                 indexes=indexes)
+            _end_partition_job(openconnection, scheme)
+    return rows
+
+# Tiến độ job phân vùng có checkpoint của một scheme, None nếu chưa có job
+# Trả về dict gồm status ('running' / 'done'), source, numpartitions, số chunk và số dòng
+# (tổng và đã xong)
+def partitionjobstatus(scheme, openconnection):
+    job = _get_partition_job(openconnection, scheme)
+    if job is None:
+        return None
+    with _transaction(openconnection) as cur:
+        cur.execute(sql.SQL("""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE done), COALESCE(SUM(numrows) FILTER (WHERE done), 0)
+              FROM {} WHERE scheme = %s
+        """).format(sql.Identifier(PARTITION_CHUNK_TABLE)), (scheme,))
+        chunks, donechunks, donerows = cur.fetchone()
+    return {'status': job['status'], 'source': job['source'], 'numpartitions': job['numpartitions'],
+            'chunks': chunks, 'donechunks': donechunks, 'rows': job['totalrows'], 'donerows': int(donerows)}
+
+# Dựng các index phụ (tên trong FRAGMENT_INDEXES) trên mọi mảnh của một scheme, song song
+# giữa các mảnh trên pool luồng (numworkers kết nối), rồi ghi danh sách index vào metadata
+# indexes = None: dùng DEFAULT_FRAGMENT_INDEXES của scheme
+# Trả về danh sách index phụ hiện có trên các mảnh
+def createfragmentindexes(scheme, openconnection, indexes=None, numworkers=None, analyze=False):
+    if scheme not in _SCHEME_PREFIXES:
+        raise ValueError(f"Unknown partition scheme: {scheme}")
+    indexes = _check_indexes(DEFAULT_FRAGMENT_INDEXES[scheme] if indexes is None else indexes)
+    meta = _get_partition_meta(openconnection, scheme)
+    if meta is None:
+        raise ValueError(f"No {scheme} partitions to index")
+
+    with _span('createfragmentindexes', scheme=scheme, partitions=meta['numpartitions'],
+               indexes=list(indexes)) as span:
+        _finish_fragments(openconnection, meta['prefix'], meta['numpartitions'], analyze=analyze, span=span,
+                          indexes=indexes, numworkers=numworkers, placement=meta['placement'])
+        current = _check_indexes(tuple(meta['indexes'] or ()) + indexes)
+        with span.phase('metadata'):
+            _set_meta_indexes(openconnection, scheme, current)
+    return list(current)
+
+# Xóa các index phụ trên mọi mảnh của một scheme (indexes = None: xóa tất cả index đã ghi
+# trong metadata) và cập nhật metadata. Trả về danh sách index phụ còn lại
+def dropfragmentindexes(scheme, openconnection, indexes=None):
+    if scheme not in _SCHEME_PREFIXES:
+        raise ValueError(f"Unknown partition scheme: {scheme}")
+    meta = _get_partition_meta(openconnection, scheme)
+    if meta is None:
+        return []
+    current = tuple(meta['indexes'] or ())
+    indexes = current if indexes is None else _check_indexes(indexes)
+
+    with _span('dropfragmentindexes', scheme=scheme, partitions=meta['numpartitions'],
+               indexes=list(indexes)) as span:
+        with span.phase('drop'):
+            for i in range(meta['numpartitions']):
+                with _fragment_connection(openconnection, meta, i) as conn, _transaction(conn) as cur:
+                    for index in indexes:
+                        cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(
+                            sql.Identifier(_fragment_index_name(f"{meta['prefix']}{i}", index))))
+        remaining = tuple(index for index in current if index not in indexes)
+        with span.phase('metadata'):
+            _set_meta_indexes(openconnection, scheme, remaining)
+    return list(remaining)
@@ -0,0 +1,339 @@
+#
+# Đo hiệu năng các thao tác của Interface.py
+#
+DATABASE_NAME = 'dds_assgn1'
+BENCH_TABLE   = 'bench_writer'
+BENCH_RATINGS = 'ratings'
+
+# Kích thước file dữ liệu giả của bộ benchmark (số dòng)
+SUITE_SIZES = {
+    '1m':  1000000,
+    '10m': 10000000,
+    '25m': 25000000,
+}
+
+# Các giá trị rating giống MovieLens (bội số của 0.5)
+RATING_VALUES = [v / 2.0 for v in range(1, 11)]
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import contextlib
+import multiprocessing as mp
+import testHelper
+import Interface
+
+
+# Sinh dữ liệu giả (userid, movieid, rating) với rating là bội số của 0.5
+def generaterows(numrows, seed=0):
+    rnd = random.Random(seed)
+    return [(rnd.randint(1, 100000), rnd.randint(1, 50000), rnd.randint(0, 10) / 2.0)
+            for _ in range(numrows)]
+
+
+# Sinh file ratings dạng "userid::movieid::rating::timestamp" giống MovieLens
+# skew = 0: rating phân bố đều; skew > 0: dồn về phía rating cao (trọng số tỉ lệ rating ** skew)
+def generateratingsfile(path, numrows, skew=2.0, seed=0, numusers=100000, nummovies=50000):
+    rnd = random.Random(seed)
+    weights = [r ** skew for r in RATING_VALUES]
+    chunk = Interface.BATCH_SIZE
+    with open(path, 'w') as f:
+        for start in range(0, numrows, chunk):
+            k = min(chunk, numrows - start)
+            ratings = rnd.choices(RATING_VALUES, weights=weights, k=k)
+            f.write("".join(
+                f"{rnd.randint(1, numusers)}::{rnd.randint(1, nummovies)}::{rating}::{978300760 + start + i}\n"
+                for i, rating in enumerate(ratings)))
+    return path
+
+
+# So sánh tốc độ ghi (rows/sec) của các writer trên cùng một tập dữ liệu
+def benchmarkwriters(openconnection, numrows=200000, batchsize=Interface.BATCH_SIZE,
+                     writers=tuple(Interface.WRITERS)):
+    rows = generaterows(numrows)
+    cur = openconnection.cursor()
+    results = {}
+    for name in writers:
+        cur.execute("DROP TABLE IF EXISTS {0}".format(BENCH_TABLE))
+        cur.execute("CREATE TABLE {0} (userid INTEGER, movieid INTEGER, rating REAL)".format(BENCH_TABLE))
+        openconnection.commit()
+
+        writer = Interface._make_writer(name)
+        start = time.perf_counter()
+        for i in range(0, numrows, batchsize):
+            writer.write(cur, BENCH_TABLE, rows[i:i + batchsize])
+        openconnection.commit()
+        elapsed = time.perf_counter() - start
+
+        results[name] = {'rows': numrows, 'seconds': elapsed, 'rows_per_sec': numrows / elapsed}
+
+    cur.execute("DROP TABLE IF EXISTS {0}".format(BENCH_TABLE))
+    openconnection.commit()
+    cur.close()
+    return results
+
+
+# Các engine phân vùng có thể so sánh với nhau
+PARTITION_METHODS = {
+    'rangepartition':      ('scan', 'columnar', 'workers', 'server', 'async'),
+    'roundrobinpartition': ('stream', 'columnar', 'workers', 'server', 'async'),
+    'hashpartition':       ('scan', 'columnar', 'server', 'async'),
+}
+
+# Các engine có dùng tham số numworkers
+WORKER_METHODS = {
+    'rangepartition':      ('workers',),
+    'roundrobinpartition': ('stream', 'workers'),
+}
+
+# Các hàm chèn một dòng được đo độ trễ, cùng hàm phân vùng cần chạy trước khi chèn
+INSERT_FUNCTIONS = {
+    'rangeinsert':      'rangepartition',
+    'roundrobininsert': 'roundrobinpartition',
+    'hashinsert':       'hashpartition',
+}
+
+# Scheme của InsertBuffer tương ứng với từng hàm chèn
+INSERT_SCHEMES = {
+    'rangeinsert':      'range',
+    'roundrobininsert': 'rrobin',
+    'hashinsert':       'hash',
+}
+
+
+# So sánh thời gian chạy các engine phân vùng (process pool, asyncio, server-side, ...)
+# trên bảng ratings đã nạp sẵn
+def benchmarkpartitionmethods(openconnection, ratingstablename, numberofpartitions, concurrency=4):
+    cur = openconnection.cursor()
+    cur.execute("SELECT COUNT(*) FROM {0}".format(ratingstablename))
+    numrows = cur.fetchone()[0]
+    cur.close()
+
+    results = {}
+    for function, methods in PARTITION_METHODS.items():
+        for method in methods:
+            options = {'concurrency': concurrency} if method == 'async' else {}
+            start = time.perf_counter()
+            getattr(Interface, function)(ratingstablename, numberofpartitions, openconnection,
+                                         method=method, **options)
+            elapsed = time.perf_counter() - start
+            results['{0}:{1}'.format(function, method)] = {
+                'rows': numrows, 'partitions': numberofpartitions,
+                'seconds': elapsed, 'rows_per_sec': numrows / elapsed}
+    return results
+
+
+# Các phân vị độ trễ (ms) của một danh sách thời gian (giây)
+def latencypercentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000.0
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': ordered[-1] * 1000.0,
+            'mean': sum(ordered) / len(ordered) * 1000.0}
+
+
+# RSS lớn nhất (MB) của tiến trình hiện tại và của các tiến trình con đã kết thúc
+def _peak_rss_mb():
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'self': self_kb / 1024.0, 'children': children_kb / 1024.0}
+
+
+# Chạy một trường hợp benchmark trong tiến trình con riêng (kết nối riêng, RSS đo riêng),
+# output của Interface được bỏ đi để không làm bẩn báo cáo
+def _case_main(result_queue, dbname, case, args):
+    try:
+        conn = testHelper.getopenconnection(dbname=dbname)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = case(conn, *args)
+        finally:
+            Interface.closeworkerpools()
+            conn.close()
+        result['peak_rss_mb'] = _peak_rss_mb()
+        result_queue.put(result)
+    except Exception as e:
+        result_queue.put({'error': repr(e)})
+
+
+def _run_case(dbname, case, *args):
+    result_queue = mp.Queue()
+    proc = mp.Process(target=_case_main, args=(result_queue, dbname, case, args))
+    proc.start()
+    result = result_queue.get()
+    proc.join()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def _load_case(conn, path, numworkers):
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS {0}".format(BENCH_RATINGS))
+    conn.commit()
+    cur.close()
+    start = time.perf_counter()
+    Interface.loadratings(BENCH_RATINGS, path, conn, numworkers=numworkers)
+    return {'seconds': time.perf_counter() - start}
+
+
+def _partition_case(conn, function, numberofpartitions, method, numworkers):
+    options = {'method': method}
+    if method in WORKER_METHODS.get(function, ()):
+        options['numworkers'] = numworkers
+    start = time.perf_counter()
+    getattr(Interface, function)(BENCH_RATINGS, numberofpartitions, conn, **options)
+    return {'seconds': time.perf_counter() - start}
+
+
+def _insert_case(conn, function, numinserts, batchsize):
+    rows = generaterows(numinserts, seed=1)
+    insert = getattr(Interface, function)
+    latencies = []
+    start = time.perf_counter()
+    for userid, movieid, rating in rows:
+        t0 = time.perf_counter()
+        insert(BENCH_RATINGS, userid, movieid, rating, conn)
+        latencies.append(time.perf_counter() - t0)
+    single = time.perf_counter() - start
+
+    insert_many = getattr(Interface, function + '_many')
+    start = time.perf_counter()
+    for i in range(0, numinserts, batchsize):
+        insert_many(BENCH_RATINGS, rows[i:i + batchsize], conn)
+    many = time.perf_counter() - start
+
+    # Chèn từng dòng qua InsertBuffer: độ trễ của add() và tổng thời gian tới khi flush xong
+    latencies_buffered = []
+    start = time.perf_counter()
+    with Interface.InsertBuffer(BENCH_RATINGS, conn, INSERT_SCHEMES[function], batchsize) as buffer:
+        for userid, movieid, rating in rows:
+            t0 = time.perf_counter()
+            buffer.add(userid, movieid, rating)
+            latencies_buffered.append(time.perf_counter() - t0)
+    return {'seconds': single, 'latency_ms': latencypercentiles(latencies),
+            'many_seconds': many, 'buffer_seconds': time.perf_counter() - start,
+            'buffer_latency_ms': latencypercentiles(latencies_buffered)}
+
+
+# Bộ benchmark đầy đủ: với mỗi kích thước file sinh dữ liệu giả, đo loadratings, các engine
+# phân vùng theo số mảnh và số worker, rồi đo vòng lặp chèn từng dòng (độ trễ) và chèn theo lô
+# Mỗi trường hợp chạy trong tiến trình con riêng để đo RSS lớn nhất
+# Trả về danh sách kết quả, mỗi phần tử là một dict có 'operation' và các tham số của nó
+def benchmarksuite(dbname=DATABASE_NAME, sizes=('1m',), partitioncounts=(5, 20), workercounts=(1, 4),
+                   skew=2.0, numinserts=1000, datadir='.', methods=PARTITION_METHODS, log=None):
+    results = []
+
+    def record(result, **params):
+        result.update(params)
+        if result.get('seconds'):
+            result['rows_per_sec'] = params['rows'] / result['seconds']
+        results.append(result)
+        if log is not None:
+            log(result)
+
+    for size in sizes:
+        numrows = SUITE_SIZES[size] if size in SUITE_SIZES else int(size)
+        path = os.path.join(datadir, f"ratings_{size}_skew{skew:g}.dat")
+        if not os.path.exists(path):
+            generateratingsfile(path, numrows, skew)
+
+        for workers in workercounts:
+            record(_run_case(dbname, _load_case, path, workers),
+                   operation='loadratings', size=size, rows=numrows, workers=workers)
+
+        for n in partitioncounts:
+            for function, function_methods in methods.items():
+                for method in function_methods:
+                    worker_options = workercounts if method in WORKER_METHODS.get(function, ()) else (None,)
+                    for workers in worker_options:
+                        record(_run_case(dbname, _partition_case, function, n, method, workers),
+                               operation=function, method=method, size=size, rows=numrows,
+                               partitions=n, workers=workers)
+
+            for function, partition_function in INSERT_FUNCTIONS.items():
+                if partition_function not in methods:
+                    continue
+                _run_case(dbname, _partition_case, partition_function, n, methods[partition_function][0], None)
+                record(_run_case(dbname, _insert_case, function, numinserts, Interface.BATCH_SIZE),
+                       operation=function, size=size, rows=numinserts, partitions=n)
+    return results
+
+
+# Khóa để ghép cùng một trường hợp giữa hai báo cáo
+def _result_key(result):
+    return tuple((k, result.get(k)) for k in ('operation', 'method', 'size', 'partitions', 'workers'))
+
+
+# So sánh kết quả suite với báo cáo cũ, trả về các trường hợp chậm hơn quá threshold (tỉ lệ)
+def compareresults(baseline, results, threshold=0.10):
+    old = {_result_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = old.get(_result_key(result))
+        if before is None or not before.get('seconds'):
+            continue
+        change = result['seconds'] / before['seconds'] - 1.0
+        if change > threshold:
+            regressions.append({'case': dict(_result_key(result)), 'before': before['seconds'],
+                                'after': result['seconds'], 'change': change})
+    return regressions
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark cho Interface.py')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=Interface.BATCH_SIZE)
+    parser.add_argument('--ratings-file', help='File .dat dùng để so sánh các engine phân vùng')
+    parser.add_argument('--partitions', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--suite', action='store_true',
+                        help='Chạy bộ benchmark đầy đủ (load, phân vùng, chèn) trên dữ liệu giả')
+    parser.add_argument('--sizes', default='1m', help='Kích thước dữ liệu giả, ví dụ 1m,10m,25m')
+    parser.add_argument('--skew', type=float, default=2.0)
+    parser.add_argument('--partition-counts', type=_int_list, default=[5, 20])
+    parser.add_argument('--workers', type=_int_list, default=[1, 4])
+    parser.add_argument('--inserts', type=int, default=1000)
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--baseline', help='Báo cáo JSON cũ để so sánh (chỉ với --suite)')
+    parser.add_argument('--output', help='Ghi báo cáo JSON ra file thay vì stdout')
+    args = parser.parse_args()
+
+    testHelper.createdb(DATABASE_NAME)
+    if args.suite:
+        sizes = args.sizes.split(',')
+        report = {
+            'config': {'sizes': sizes, 'skew': args.skew, 'partition_counts': args.partition_counts,
+                       'workers': args.workers, 'inserts': args.inserts, 'cpu_count': mp.cpu_count()},
+            'results': benchmarksuite(DATABASE_NAME, sizes, args.partition_counts, args.workers,
+                                      args.skew, args.inserts, args.data_dir,
+                                      log=lambda r: print(json.dumps(r), file=sys.stderr)),
+        }
+        if args.baseline:
+            with open(args.baseline) as f:
+                report['regressions'] = compareresults(json.load(f)['results'], report['results'])
+    else:
+        with testHelper.getopenconnection(dbname=DATABASE_NAME) as conn:
+            report = {'writers': benchmarkwriters(conn, args.rows, args.batch_size)}
+            if args.ratings_file:
+                Interface.loadratings('ratings', args.ratings_file, conn)
+                report['partition_methods'] = benchmarkpartitionmethods(conn, 'ratings', args.partitions,
+                                                                        args.concurrency)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
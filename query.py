@@ -0,0 +1,294 @@
+#
+# Truy vấn trên các mảnh range_part* / rrobin_part* do Interface.py tạo ra
+#
+import atexit
+import heapq
+import threading
+from queue import Empty, Full, Queue
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+import Interface
+
+# Số dòng lấy mỗi lần từ một mảnh và số batch tối đa chờ trong hàng đợi gộp kết quả
+FETCH_SIZE  = Interface.BATCH_SIZE
+QUEUE_SIZE  = 16
+MAX_THREADS = 8
+# Số kết nối đọc mở sẵn và giữ lại cho mỗi node, tách khỏi pool ghi (pool worker / node) của Interface
+READ_POOL_SIZE = MAX_THREADS
+
+# Các cột được phép gom nhóm trong aggregate
+GROUP_COLUMNS = ('userid', 'movieid')
+
+_DONE = object()
+
+
+# Pool kết nối đọc theo conn_info: {_conn_key: ThreadedConnectionPool}
+_READ_POOLS = {}
+_READ_POOL_LOCK = threading.Lock()
+
+
+# Mượn một kết nối đọc tới conn_info, trả về (kết nối, hàm trả kết nối)
+# Pool đọc của node đã cho mượn hết (vd. truy vấn lồng nhau trong lúc vòng lặp ngoài còn giữ kết
+# nối) thì mở kết nối mới và đóng khi trả, nên truy vấn không bao giờ phải chờ pool
+def _read_connection(conn_info):
+    key = Interface._conn_key(conn_info)
+    with _READ_POOL_LOCK:
+        conn_pool = _READ_POOLS.get(key)
+        if conn_pool is None:
+            conn_pool = _READ_POOLS[key] = ThreadedConnectionPool(READ_POOL_SIZE, READ_POOL_SIZE, **conn_info)
+    try:
+        conn = conn_pool.getconn()
+    except PoolError:
+        conn = psycopg2.connect(**conn_info)
+        return conn, lambda c, close=False: c.close()
+
+    # Trả kết nối về pool (đóng nếu close = True); pool đã bị closereadpools đóng thì chỉ đóng kết nối
+    def release(c, close=False):
+        try:
+            conn_pool.putconn(c, close=close or c.closed)
+        except PoolError:
+            c.close()
+    return conn, release
+
+
+# Đóng mọi pool kết nối đọc
+def closereadpools():
+    with _READ_POOL_LOCK:
+        for conn_pool in _READ_POOLS.values():
+            conn_pool.closeall()
+        _READ_POOLS.clear()
+
+atexit.register(closereadpools)
+
+
+# Chỉ số các mảnh range có khoảng giao với [ratingminvalue, ratingmaxvalue]
+# Mảnh 0 là [0, b0], mảnh i là (b(i-1), bi]
+def _range_candidates(bounds, ratingminvalue, ratingmaxvalue):
+    parts = []
+    for i, max_val in enumerate(bounds):
+        min_val = bounds[i - 1] if i > 0 else 0.0
+        if ratingminvalue > max_val:
+            continue
+        if (i == 0 and ratingmaxvalue < min_val) or (i > 0 and ratingmaxvalue <= min_val):
+            continue
+        parts.append(i)
+    return parts
+
+
+# Danh sách mảnh cần đọc của một scheme; với 'range' chỉ giữ các mảnh giao với khoảng rating,
+# với 'hash' chỉ giữ mảnh chứa khóa key = (cột, giá trị) nếu cột đó là khóa phân vùng
+# Mỗi phần tử là (tên mảnh, conn_info của node chứa mảnh theo bản đồ đặt mảnh)
+def _fragments(openconnection, scheme, ratingminvalue=None, ratingmaxvalue=None, key=None):
+    meta = Interface._get_partition_meta(openconnection, scheme)
+    if meta is None:
+        return []
+    indexes = range(meta['numpartitions'])
+    if scheme == 'range' and ratingminvalue is not None:
+        indexes = _range_candidates(meta['boundaries'], ratingminvalue, ratingmaxvalue)
+    elif scheme == 'hash' and key is not None and key[0] == meta['partkey'] and meta['numpartitions']:
+        indexes = [Interface._hash_index(key[1], meta['numpartitions'])]
+    conn_infos = Interface._fragment_conn_infos(openconnection, meta['numpartitions'], meta['placement'])
+    return [(f"{meta['prefix']}{i}", conn_infos[i]) for i in indexes]
+
+
+# Chạy cùng một truy vấn trên nhiều mảnh song song và trả về từng dòng (tên mảnh, *cột) ngay khi
+# có, không chờ mảnh chậm nhất
+# Mỗi lần gọi có các luồng riêng, mỗi luồng mượn một kết nối tới mỗi node chứa mảnh nó đọc từ
+# pool đọc của node (_read_connection) và trả lại khi xong; pool đọc tách khỏi pool worker của
+# Interface và không bao giờ bắt chờ, nên các truy vấn lồng nhau (vd. ratingstats trong vòng lặp
+# rangequery) không tranh nhau kết nối với nhau hoặc với các lệnh ghi
+# fragments là danh sách (tên mảnh, conn_info) của _fragments, query là sql.SQL có một chỗ {}
+# cho tên mảnh
+def _fanout(openconnection, fragments, query, params=()):
+    if not fragments:
+        return
+    pending = Queue()
+    for item in fragments:
+        pending.put(item)
+    results = Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+
+    # Đưa một phần tử vào hàng đợi, bỏ cuộc nếu bên đọc đã dừng
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except Full:
+                pass
+        return False
+
+    # Luồng đọc lần lượt các mảnh còn lại, giữ một kết nối mượn cho mỗi node
+    def scan_loop():
+        conns = {}
+        try:
+            while not stop.is_set():
+                try:
+                    fragment, fragment_conn_info = pending.get_nowait()
+                except Empty:
+                    break
+                key = Interface._conn_key(fragment_conn_info)
+                try:
+                    if key not in conns:
+                        conns[key] = _read_connection(fragment_conn_info)
+                    conn = conns[key][0]
+                    cur = conn.cursor(name=f"fanout_{fragment}")
+                    cur.execute(query.format(sql.Identifier(fragment)), params)
+                    while not stop.is_set():
+                        rows = cur.fetchmany(FETCH_SIZE)
+                        if not rows or not put((fragment, rows)):
+                            break
+                    cur.close()
+                    conn.rollback()
+                    put(_DONE)
+                except Exception as e:
+                    # Kết nối lỗi không trả lại pool để dùng tiếp
+                    borrowed = conns.pop(key, None)
+                    if borrowed is not None:
+                        borrowed[1](borrowed[0], close=True)
+                    put(e)
+        finally:
+            for conn, release in conns.values():
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+                release(conn)
+
+    threads = [threading.Thread(target=scan_loop, daemon=True)
+               for _ in range(min(len(fragments), MAX_THREADS))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = len(fragments)
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                fragment, rows = item
+                for row in rows:
+                    yield (fragment,) + tuple(row)
+    finally:
+        # Dừng các luồng (bỏ các batch còn chờ để luồng đang put thoát ra) và chờ chúng trả kết nối
+        stop.set()
+        for thread in threads:
+            while thread.is_alive():
+                try:
+                    while True:
+                        results.get_nowait()
+                except Empty:
+                    pass
+                thread.join(0.01)
+
+
+# Truy vấn khoảng: các bản ghi có ratingminvalue <= rating <= ratingmaxvalue
+# Với mảnh range chỉ đọc các mảnh giao với khoảng, mảnh round-robin được đọc song song
+# Trả về generator các tuple (tên mảnh, userid, movieid, rating)
+def rangequery(ratingminvalue, ratingmaxvalue, openconnection, schemes=('range', 'rrobin')):
+    fragments = []
+    for scheme in schemes:
+        fragments += _fragments(openconnection, scheme, ratingminvalue, ratingmaxvalue)
+    query = sql.SQL("SELECT userid, movieid, rating FROM {} WHERE rating >= %s AND rating <= %s")
+    return _fanout(openconnection, fragments, query, (ratingminvalue, ratingmaxvalue))
+
+
+# Truy vấn điểm: các bản ghi có rating = ratingvalue, với mảnh range chỉ đọc đúng một mảnh
+def pointquery(ratingvalue, openconnection, schemes=('range', 'rrobin')):
+    fragments = []
+    for scheme in schemes:
+        fragments += _fragments(openconnection, scheme, ratingvalue, ratingvalue)
+    query = sql.SQL("SELECT userid, movieid, rating FROM {} WHERE rating = %s")
+    return _fanout(openconnection, fragments, query, (ratingvalue,))
+
+
+# Các bản ghi của một userid hoặc movieid; với mảnh băm theo đúng cột đó chỉ đọc một mảnh
+# Trả về generator các tuple (tên mảnh, userid, movieid, rating)
+def keyquery(openconnection, userid=None, movieid=None, scheme='hash'):
+    if (userid is None) == (movieid is None):
+        raise ValueError("keyquery needs exactly one of userid or movieid")
+    column, value = ('userid', userid) if userid is not None else ('movieid', movieid)
+    query = sql.SQL("SELECT userid, movieid, rating FROM {} WHERE " + column + " = %s")
+    return _fanout(openconnection, _fragments(openconnection, scheme, key=(column, value)), query, (value,))
+
+
+# Thống kê rating (count, avg, min, max) của một userid hoặc movieid trên các mảnh của một scheme
+# Mỗi mảnh trả về tổng riêng phần, kết quả được gộp phía client
+def ratingstats(openconnection, userid=None, movieid=None, scheme='range'):
+    if (userid is None) == (movieid is None):
+        raise ValueError("ratingstats needs exactly one of userid or movieid")
+    column, value = ('userid', userid) if userid is not None else ('movieid', movieid)
+
+    query = sql.SQL("SELECT COUNT(*), SUM(rating::float8), MIN(rating), MAX(rating) FROM {} WHERE "
+                    + column + " = %s")
+    count, total, low, high = 0, 0.0, None, None
+    fragments = _fragments(openconnection, scheme, key=(column, value))
+    for _, cnt, part_sum, part_min, part_max in _fanout(openconnection, fragments, query, (value,)):
+        if not cnt:
+            continue
+        count += cnt
+        total += part_sum
+        low = part_min if low is None else min(low, part_min)
+        high = part_max if high is None else max(high, part_max)
+
+    return {'count': count, 'avg': total / count if count else None, 'min': low, 'max': high}
+
+
+# Gộp tổng riêng phần (count, sum, min, max) của một khóa vào kết quả chung
+def _merge_partial(merged, key, cnt, part_sum, part_min, part_max):
+    stats = merged.get(key)
+    if stats is None:
+        merged[key] = [cnt, part_sum, part_min, part_max]
+    else:
+        stats[0] += cnt
+        stats[1] += part_sum
+        if part_min < stats[2]:
+            stats[2] = part_min
+        if part_max > stats[3]:
+            stats[3] = part_max
+
+
+# Tổng hợp scatter-gather: mỗi mảnh của scheme tính COUNT/SUM/MIN/MAX theo groupby trên kết nối
+# riêng và song song với nhau, các tổng riêng phần được gộp phía client
+# Trả về dict khóa -> {'count', 'sum', 'min', 'max', 'avg'}
+def aggregate(openconnection, groupby='movieid', scheme='range'):
+    if groupby not in GROUP_COLUMNS:
+        raise ValueError(f"Unknown group by column: {groupby}")
+    query = sql.SQL("SELECT " + groupby + ", COUNT(*), SUM(rating::float8), MIN(rating), MAX(rating) "
+                    "FROM {} GROUP BY " + groupby)
+
+    merged = {}
+    for _, key, cnt, part_sum, part_min, part_max in _fanout(openconnection, _fragments(openconnection, scheme),
+                                                             query):
+        _merge_partial(merged, key, cnt, part_sum, part_min, part_max)
+
+    return {key: {'count': cnt, 'sum': total, 'min': low, 'max': high, 'avg': total / cnt}
+            for key, (cnt, total, low, high) in merged.items()}
+
+
+# Rating trung bình của từng phim
+def movieaverages(openconnection, scheme='range'):
+    return {key: stats['avg'] for key, stats in aggregate(openconnection, 'movieid', scheme).items()}
+
+
+# Số lượt đánh giá của từng người dùng
+def usercounts(openconnection, scheme='range'):
+    return {key: stats['count'] for key, stats in aggregate(openconnection, 'userid', scheme).items()}
+
+
+# Top-k theo một chỉ số tổng hợp ('count', 'avg', 'sum', 'min', 'max'), mặc định là k phim
+# được đánh giá nhiều nhất. Trả về danh sách (khóa, thống kê) giảm dần
+def topk(k, openconnection, groupby='movieid', by='count', scheme='range'):
+    stats = aggregate(openconnection, groupby, scheme)
+    return heapq.nlargest(k, stats.items(), key=lambda item: (item[1][by], -item[0]))
+
+
+# k phim có nhiều lượt đánh giá nhất
+def mostratedmovies(k, openconnection, scheme='range'):
+    return [(movieid, stats['count']) for movieid, stats in topk(k, openconnection, 'movieid', 'count', scheme)]
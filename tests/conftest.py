@@ -0,0 +1,78 @@
+import os
+import sys
+
+# Các module của repo nằm ở thư mục gốc (Interface.py, query.py, testHelper.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import pytest
+
+import Interface
+import testHelper
+
+# Cơ sở dữ liệu riêng cho kiểm thử, tạo bằng testHelper giống Assignment1Tester
+TEST_DATABASE = 'dds_unittest'
+# Cơ sở dữ liệu thứ hai đóng vai một node chứa mảnh
+NODE_DATABASE = 'dds_unittest_node'
+
+
+# Kết nối tới cơ sở dữ liệu kiểm thử (autocommit như Assignment1Tester), bỏ qua nếu không có PostgreSQL
+# Mỗi test bắt đầu với cơ sở dữ liệu trống và bộ nhớ đệm metadata trống
+@pytest.fixture
+def conn():
+    try:
+        testHelper.createdb(TEST_DATABASE)
+        connection = testHelper.getopenconnection(dbname=TEST_DATABASE)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    testHelper.deleteAllPublicTables(connection)
+    Interface._PARTITION_CACHE.clear()
+    yield connection
+    testHelper.deleteAllPublicTables(connection)
+    Interface._PARTITION_CACHE.clear()
+    connection.close()
+
+
+# Node thứ hai: trả về (DSN của node, kết nối autocommit tới node), bảng của node được dọn trước và sau test
+@pytest.fixture
+def node(conn):
+    testHelper.createdb(NODE_DATABASE)
+    connection = testHelper.getopenconnection(dbname=NODE_DATABASE)
+    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    testHelper.deleteAllPublicTables(connection)
+    yield f"dbname={NODE_DATABASE} host=localhost user=postgres password=123456", connection
+    testHelper.deleteAllPublicTables(connection)
+    connection.close()
+
+
+# Ghi danh sách (userid, movieid, rating) ra file .dat tạm và trả về đường dẫn
+@pytest.fixture
+def ratingsfile(tmp_path):
+    def write(rows, name='ratings.dat'):
+        path = tmp_path / name
+        path.write_text("".join(f"{u}::{m}::{r}::978300760\n" for u, m, r in rows))
+        return str(path)
+    return write
+
+
+# Chạy một đoạn mã trong tiến trình Python khác, với biến conn là kết nối tới cơ sở dữ liệu kiểm thử
+# (tiến trình đó có bộ nhớ đệm metadata riêng, giống một client khác)
+@pytest.fixture
+def other_process():
+    import subprocess
+    import textwrap
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    prelude = (f"import sys; sys.path.insert(0, {root!r})\n"
+               "import psycopg2, Interface, testHelper\n"
+               f"conn = testHelper.getopenconnection(dbname={TEST_DATABASE!r})\n"
+               "conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)\n")
+
+    def start(code):
+        return subprocess.Popen([sys.executable, '-c', prelude + textwrap.dedent(code)])
+
+    def run(code):
+        assert start(code).wait(timeout=120) == 0
+    run.start = start
+    return run
@@ -0,0 +1,40 @@
+#
+# Kiểm thử nhanh bộ benchmark của benchmark.py (một trường hợp nhỏ trên cơ sở dữ liệu kiểm thử)
+#
+import json
+
+import pytest
+
+import benchmark
+from conftest import TEST_DATABASE
+
+
+def test_suite_report_and_regression_flag(conn, tmp_path):
+    results = benchmark.benchmarksuite(TEST_DATABASE, sizes=('500',), partitioncounts=(2,), workercounts=(1,),
+                                       numinserts=20, datadir=str(tmp_path),
+                                       methods={'rangepartition': ('scan',)})
+    # Báo cáo phải ghi được ra JSON giống khi chạy --suite
+    results = json.loads(json.dumps(results))
+
+    assert [(r['operation'], r.get('method')) for r in results] == [
+        ('loadratings', None), ('rangepartition', 'scan'), ('rangeinsert', None)]
+    for result in results:
+        assert result['seconds'] > 0
+        assert result['rows_per_sec'] > 0
+        assert set(result['peak_rss_mb']) == {'self', 'children'}
+    load, partition, insert = results
+    assert (load['size'], load['rows'], load['workers']) == ('500', 500, 1)
+    assert (partition['partitions'], partition['rows']) == (2, 500)
+    assert insert['rows'] == 20
+    for key in ('latency_ms', 'buffer_latency_ms'):
+        assert set(insert[key]) == {'p50', 'p95', 'p99', 'max', 'mean'}
+    assert insert['many_seconds'] > 0 and insert['buffer_seconds'] > 0
+
+    # So với chính nó: không có trường hợp nào chậm đi
+    assert benchmark.compareresults(results, results) == []
+    # Báo cáo cũ nhanh gấp đôi ở bước phân vùng: chỉ trường hợp đó bị đánh dấu
+    baseline = [dict(r, seconds=r['seconds'] / 2) if r is partition else r for r in results]
+    regressions = benchmark.compareresults(baseline, results)
+    assert len(regressions) == 1
+    assert regressions[0]['case']['operation'] == 'rangepartition'
+    assert regressions[0]['change'] == pytest.approx(1.0)
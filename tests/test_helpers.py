@@ -0,0 +1,223 @@
+#
+# Kiểm thử các hàm phụ trợ thuần Python của Interface.py (không cần PostgreSQL)
+#
+import io
+import math
+import struct
+
+import pytest
+
+import Interface
+
+
+# Ghi nội dung ra file tạm và trả về đường dẫn
+def _write(tmp_path, data):
+    path = tmp_path / 'ratings.dat'
+    path.write_bytes(data)
+    return str(path)
+
+
+# Ghép các khoảng byte của _split_file_chunks, kiểm tra liền nhau và căn theo ranh giới dòng
+def _check_chunks(path, data, numchunks):
+    chunks = Interface._split_file_chunks(path, numchunks)
+    assert b"".join(data[start:end] for start, end in chunks) == data
+    for start, end in chunks:
+        assert start < end
+        assert start == 0 or data[start - 1:start] == b"\n"
+    return chunks
+
+
+def test_split_file_chunks_empty_file(tmp_path):
+    assert _check_chunks(_write(tmp_path, b""), b"", 4) == []
+
+
+def test_split_file_chunks_file_smaller_than_numchunks(tmp_path):
+    data = b"1::2::3.5::0\n"
+    assert _check_chunks(_write(tmp_path, data), data, 64) == [(0, len(data))]
+
+
+def test_split_file_chunks_aligned_to_lines(tmp_path):
+    data = b"".join(b"%d::%d::%.1f::978300760\n" % (i, i * 7, i % 10 / 2) for i in range(1000))
+    for numchunks in (1, 2, 3, 7, 16):
+        assert len(_check_chunks(_write(tmp_path, data), data, numchunks)) <= numchunks
+
+
+def test_split_file_chunks_without_trailing_newline(tmp_path):
+    data = b"1::2::3.5::0\n4::5::1::0"
+    _check_chunks(_write(tmp_path, data), data, 3)
+
+
+def test_ratings_dat_stream_converts_lines():
+    fin = io.BytesIO(b"1::122::5::838985046\n1::185::4.5::838983525\n\nbad line\n2::3::0::1\n")
+    stream = Interface._RatingsDatStream(fin, chunk_lines=2)
+    assert stream.read() == b"1\t122\t5\n1\t185\t4.5\n2\t3\t0\n"
+    assert stream.rows == 3
+    assert stream.read() == b""
+
+
+def test_ratings_dat_stream_small_reads_and_readline():
+    fin = io.BytesIO(b"1::2::3::0\n4::5::6::0\n")
+    stream = Interface._RatingsDatStream(fin)
+    assert stream.readline() == b"1\t2\t3\n"
+    parts = []
+    while True:
+        data = stream.read(2)
+        if not data:
+            break
+        parts.append(data)
+    assert b"".join(parts) == b"4\t5\t6\n"
+
+
+def test_ratings_dat_stream_limit():
+    data = b"1::2::3::0\n4::5::6::0\n7::8::9::0\n"
+    fin = io.BytesIO(data)
+    fin.seek(11)
+    stream = Interface._RatingsDatStream(fin, limit=11)
+    assert stream.read() == b"4\t5\t6\n"
+    assert stream.rows == 1
+
+
+# Giải mã một khối COPY binary (INTEGER, INTEGER, REAL) thành danh sách dòng
+def _decode_copy_binary(data):
+    data = bytes(data)
+    assert data[:11] == b"PGCOPY\n\xff\r\n\x00"
+    pos = 19
+    rows = []
+    while True:
+        (nfields,) = struct.unpack_from("!h", data, pos)
+        pos += 2
+        if nfields == -1:
+            break
+        row = []
+        for fmt in ("!i", "!i", "!f"):
+            (length,) = struct.unpack_from("!i", data, pos)
+            pos += 4
+            if length == -1:
+                row.append(None)
+            else:
+                row.append(struct.unpack_from(fmt, data, pos)[0])
+                pos += length
+        rows.append(tuple(row))
+    assert pos == len(data)
+    return rows
+
+
+def test_copy_binary_writer_encode_round_trip():
+    writer = Interface.CopyBinaryWriter()
+    rows = [(1, 2, 3.5), (-7, 2 ** 31 - 1, 0.0), (4, 5, 0.5)]
+    assert _decode_copy_binary(writer.encode(rows)) == rows
+    # Bộ đệm được dùng lại: lần encode ngắn hơn không để lại dữ liệu thừa
+    assert _decode_copy_binary(writer.encode(rows[:1])) == rows[:1]
+    assert _decode_copy_binary(writer.encode([])) == []
+
+
+def test_copy_binary_writer_encode_nulls():
+    writer = Interface.CopyBinaryWriter()
+    rows = [(1, None, 2.5), (None, 3, None)]
+    assert _decode_copy_binary(writer.encode(rows)) == rows
+
+
+def test_roundrobin_split_matches_row_order():
+    for n in (1, 3, 5, 8):
+        for row_index in (0, 1, 4, 13):
+            batch = list(range(17))
+            groups = Interface._roundrobin_split(batch, row_index, n)
+            expected = {}
+            for k, row in enumerate(batch):
+                expected.setdefault((row_index + k) % n, []).append(row)
+            assert dict(groups) == expected
+
+
+def test_roundrobin_split_batch_smaller_than_partitions():
+    assert Interface._roundrobin_split([10, 11], 3, 5) == [(3, [10]), (4, [11])]
+
+
+def test_hash_index_is_stable_and_in_range():
+    for n in (1, 2, 5, 7):
+        for value in (0, 1, -1, 42, 2 ** 31 - 1, -2 ** 31):
+            idx = Interface._hash_index(value, n)
+            assert 0 <= idx < n
+            assert idx == (value * 2654435761) % 4294967296 % n
+
+
+def test_hash_targets_match_hash_index():
+    rows = [(u, m, 1.0) for u, m in zip(range(-50, 50), range(100, 200))]
+    for column in (0, 1):
+        targets = [int(t) for t in Interface._hash_targets(rows, column, 7)]
+        assert targets == [Interface._hash_index(row[column], 7) for row in rows]
+
+
+def test_hash_array_matches_hash_index():
+    np = pytest.importorskip('numpy')
+    keys = np.arange(-1000, 1000, dtype=np.int64)
+    assert Interface._hash_array(keys, 6).tolist() == [Interface._hash_index(k, 6) for k in range(-1000, 1000)]
+
+
+def test_hash_router_routes_copy_text_lines():
+    route = Interface._hash_router(Interface._hash_column('movieid'), 4)
+    assert route(b"1\t122\t5\n") == Interface._hash_index(122, 4)
+    with pytest.raises(ValueError):
+        Interface._hash_column('rating')
+
+
+def test_range_routing_uses_float4_ratings():
+    bounds = Interface._range_bounds(50)
+    # float4(0.1) = 0.10000000149... > cận 0.1 của mảnh 0, SQL cũng đặt vào mảnh 1
+    assert Interface._range_index(bounds, 0.1) == 1
+    assert Interface._range_router(bounds)(b"1\t2\t0.1\n") == 1
+    assert Interface._range_splitter(bounds)([(1, 2, 0.1)], 0) == [(1, [(1, 2, 0.1)])]
+    assert Interface._range_index(bounds, 0.0) == 0
+    assert Interface._range_index(bounds, 5.0) == 49
+    assert Interface._range_index(bounds, 5.5) is None
+    assert Interface._range_index(bounds, -0.5) is None
+
+
+# Cho tuner chạy windows cửa sổ trên đường thông lượng curve(batch_size, concurrency)
+def _tune(tuner, curve, windows=100):
+    for _ in range(windows * tuner.window):
+        batch_size, concurrency = tuner.batch_size, tuner.concurrency
+        tuner.record(batch_size, batch_size / curve(batch_size, concurrency))
+    return tuner.report()
+
+
+# Thông lượng cực đại tại batch size 40000 (và concurrency 3)
+def _peaked(batch_size, concurrency=3):
+    return 1e5 * math.exp(-math.log2(batch_size / 40000) ** 2) * (1 - abs(concurrency - 3) / 4)
+
+
+def test_autotuner_settles_on_flat_throughput():
+    report = _tune(Interface._AutoTuner(), lambda batch_size, concurrency: 1e5)
+    assert report['converged']
+    assert report['windows'] <= 2 * Interface.AUTOTUNE_REVERSALS
+    assert report['batch_size'] == report['best']['batch_size'] == Interface.BATCH_SIZE
+
+
+@pytest.mark.parametrize('maxconcurrency', [1, 4])
+def test_autotuner_settles_on_throughput_peak(maxconcurrency):
+    tuner = Interface._AutoTuner(concurrency=2, maxconcurrency=maxconcurrency)
+    report = _tune(tuner, _peaked)
+    assert report['converged']
+    assert report['windows'] <= 20
+    assert report['batch_size'] == tuner.batch_size == 40000
+    assert report['concurrency'] == tuner.concurrency == (3 if maxconcurrency > 1 else 1)
+    assert report['best']['batch_size'] == 40000
+    # Đã dừng: thêm batch không đổi thiết lập và không đo thêm cửa sổ
+    assert _tune(tuner, _peaked, windows=5) == report
+
+
+def test_autotuner_settles_at_batch_bound_for_rising_throughput():
+    report = _tune(Interface._AutoTuner(), lambda batch_size, concurrency: batch_size)
+    assert report['converged']
+    assert report['batch_size'] == Interface.AUTOTUNE_MAX_BATCH
+    assert all(Interface.AUTOTUNE_MIN_BATCH <= h['batch_size'] <= Interface.AUTOTUNE_MAX_BATCH
+               for h in report['history'])
+
+
+def test_autotuner_reports_setting_used_by_last_batch():
+    tuner = Interface._AutoTuner(window=1)
+    tuner.record(Interface.BATCH_SIZE, 1.0)
+    # Cửa sổ vừa đo chuyển sang batch size mới, nhưng batch cuối vẫn chạy với batch size cũ
+    assert tuner.batch_size != Interface.BATCH_SIZE
+    assert tuner.report()['batch_size'] == Interface.BATCH_SIZE
+    tuner.record(tuner.batch_size, 1.0)
+    assert tuner.report()['batch_size'] == 2 * Interface.BATCH_SIZE
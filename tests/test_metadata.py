@@ -0,0 +1,161 @@
+#
+# Kiểm thử bộ nhớ đệm metadata khi cách phân vùng bị đổi từ một tiến trình khác
+#
+import os
+import time
+
+import psycopg2.extensions
+from psycopg2 import sql
+
+import Interface
+import testHelper
+
+
+# Số dòng của từng mảnh prefix0 .. prefix(n-1)
+def _counts(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    counts = []
+    for i in range(numberofpartitions):
+        cur.execute(f"SELECT COUNT(*) FROM {prefix}{i}")
+        counts.append(cur.fetchone()[0])
+    cur.close()
+    return counts
+
+
+def test_inserts_follow_partitioning_done_by_another_process(conn, ratingsfile, other_process):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5), (2, 2, 4.5)]), conn)
+    Interface.rangepartition('ratings', 5, conn)
+    Interface.roundrobinpartition('ratings', 5, conn)
+    Interface.hashpartition('ratings', 5, conn)
+    Interface.rangeinsert('ratings', 3, 3, 4.9, conn)
+    Interface.roundrobininsert('ratings', 3, 3, 4.9, conn)
+    Interface.hashinsert('ratings', 3, 3, 4.9, conn)
+
+    other_process("""
+        Interface.rangepartition('ratings', 2, conn)
+        Interface.roundrobinpartition('ratings', 3, conn)
+        Interface.hashpartition('ratings', 2, conn, key='movieid')
+    """)
+    Interface.rangeinsert('ratings', 4, 4, 4.9, conn)
+    Interface.roundrobininsert('ratings', 4, 4, 4.9, conn)
+    Interface.hashinsert('ratings', 4, 4, 4.9, conn)
+    Interface.rangeinsert_many('ratings', [(5, 5, 0.1)], conn)
+
+    assert _counts(conn, 'range_part', 2) == [2, 2]
+    # Slot tiếp theo sau khi chia 2 dòng là 2
+    assert _counts(conn, 'rrobin_part', 3) == [1, 1, 1]
+    assert sum(_counts(conn, 'hash_part', 2)) == 3
+    assert Interface._get_partition_meta(conn, 'hash')['partkey'] == 'movieid'
+
+
+def test_inserts_after_tables_dropped_and_recreated(conn, ratingsfile, other_process):
+    path = ratingsfile([(1, 1, 0.5), (2, 2, 4.5)])
+    Interface.loadratings('ratings', path, conn)
+    Interface.rangepartition('ratings', 5, conn)
+    Interface.rangeinsert('ratings', 3, 3, 4.9, conn)
+
+    testHelper.deleteAllPublicTables(conn)
+    # Không còn mảnh nào: lệnh chèn không làm gì thay vì lỗi "relation does not exist"
+    Interface.rangeinsert('ratings', 3, 3, 4.9, conn)
+    assert Interface.rangeinsert_many('ratings', [(3, 3, 4.9)], conn) == []
+
+    other_process(f"""
+        Interface.loadratings('ratings', {path!r}, conn)
+        Interface.rangepartition('ratings', 2, conn)
+    """)
+    Interface.rangeinsert('ratings', 4, 4, 4.9, conn)
+    assert _counts(conn, 'range_part', 2) == [1, 2]
+
+
+# Số dòng nằm sai mảnh theo biểu thức SQL expected (trả về số thứ tự mảnh đúng của dòng)
+def _misplaced(conn, prefix, numberofpartitions, expected):
+    cur = conn.cursor()
+    misplaced = 0
+    for i in range(numberofpartitions):
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE ({}) IS DISTINCT FROM {}").format(
+            sql.Identifier(f"{prefix}{i}"), expected, sql.Literal(i)))
+        misplaced += cur.fetchone()[0]
+    cur.close()
+    return misplaced
+
+
+def test_inserts_from_another_process_during_repartition(conn, ratingsfile, other_process, tmp_path):
+    rows = 2000
+    Interface.loadratings('ratings', ratingsfile([(k, k, (k % 11) * 0.5) for k in range(rows)]), conn)
+    Interface.rangepartition('ratings', 3, conn)
+    Interface.roundrobinpartition('ratings', 3, conn)
+    Interface.hashpartition('ratings', 3, conn)
+
+    started, stop, done = (str(tmp_path / name) for name in ('started', 'stop', 'done'))
+    inserter = other_process.start(f"""
+        import os
+        inserted = 0
+        while not os.path.exists({stop!r}):
+            key = {rows} + inserted
+            rating = (key % 11) * 0.5
+            Interface.rangeinsert('ratings', key, key, rating, conn)
+            Interface.roundrobininsert('ratings', key, key, rating, conn)
+            Interface.hashinsert('ratings', key, key, rating, conn)
+            inserted += 1
+            if inserted == 1:
+                open({started!r}, 'w').close()
+        with open({done!r}, 'w') as f:
+            f.write(str(inserted))
+    """)
+    try:
+        while not os.path.exists(started):
+            assert inserter.poll() is None
+            time.sleep(0.01)
+        for n in (7, 4):
+            for scheme in ('range', 'rrobin', 'hash'):
+                Interface.repartition(scheme, n, conn, batchsize=50)
+    finally:
+        open(stop, 'w').close()
+        assert inserter.wait(timeout=120) == 0
+    with open(done) as f:
+        total = rows + int(f.read())
+
+    range_counts = _counts(conn, 'range_part', 4)
+    assert sum(range_counts) == total
+    assert _misplaced(conn, 'range_part', 4,
+                      Interface._range_case_sql(Interface._range_bounds(4))) == 0
+    # Các lệnh chèn tiếp tục từ slot = tổng số dòng lúc chuyển định tuyến nên vẫn chia đều
+    assert _counts(conn, 'rrobin_part', 4) == [total // 4 + (i < total % 4) for i in range(4)]
+    assert sum(_counts(conn, 'hash_part', 4)) == total
+    assert _misplaced(conn, 'hash_part', 4, Interface._hash_sql('userid', 4)) == 0
+
+
+# Con trỏ ghi lại mọi câu lệnh gửi tới server
+class _CountingCursor(psycopg2.extensions.cursor):
+    statements = []
+
+    def execute(self, query, vars=None):
+        self.statements.append(query)
+        return super().execute(query, vars)
+
+
+def test_single_row_insert_is_one_statement_with_warm_cache(conn, ratingsfile, other_process):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5), (2, 2, 4.5)]), conn)
+    Interface.rangepartition('ratings', 3, conn)
+    Interface.roundrobinpartition('ratings', 3, conn)
+    Interface.hashpartition('ratings', 3, conn)
+
+    conn.cursor_factory = _CountingCursor
+    statements = _CountingCursor.statements
+    for insert, expected in ((Interface.rangeinsert, 1), (Interface.hashinsert, 1),
+                             (Interface.roundrobininsert, 2)):
+        del statements[:]
+        insert('ratings', 3, 3, 2.0, conn)
+        # Kiểm tra phiên bản metadata nằm trong câu INSERT (và câu cấp slot round-robin)
+        assert len(statements) == expected
+
+    # Bộ nhớ đệm cũ: câu INSERT (vào range_part1, mảnh vẫn còn) không ghi gì, metadata được đọc
+    # lại rồi chèn lại
+    other_process("""
+        Interface.rangepartition('ratings', 2, conn)
+    """)
+    del statements[:]
+    Interface.rangeinsert('ratings', 4, 4, 2.0, conn)
+    assert len(statements) == 3
+    conn.cursor_factory = None
+    assert _counts(conn, 'range_part', 2) == [2, 1]
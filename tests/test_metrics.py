@@ -0,0 +1,104 @@
+#
+# Kiểm thử việc đo đạc của Interface.py: span, LoggingSink, JsonLinesSink
+#
+import json
+import logging
+
+import pytest
+
+import Interface
+
+
+# Sink ghi event vào danh sách, gỡ mọi sink sau mỗi test
+@pytest.fixture
+def events():
+    received = []
+    Interface.addmetricsink(received.append)
+    yield received
+    Interface.clearmetricsinks()
+
+
+def test_span_emits_phases_counters_and_attributes(events):
+    with Interface._span('work', table='ratings') as span:
+        with span.phase('read'):
+            pass
+        with span.phase('read'):
+            pass
+        span.addphase('write', 0.25)
+        span.count('rows', 3)
+        span.count('rows')
+        span.set('partitions', 2)
+
+    [event] = events
+    assert event['operation'] == 'work'
+    assert event['table'] == 'ratings'
+    assert event['partitions'] == 2
+    assert event['counters'] == {'rows': 4}
+    assert set(event['phases']) == {'read', 'write'}
+    assert event['phases']['write'] == 0.25
+    assert event['seconds'] >= event['phases']['read'] >= 0
+    assert 'error' not in event
+
+
+def test_span_reports_error_and_reraises(events):
+    with pytest.raises(ValueError):
+        with Interface._span('work'):
+            raise ValueError("boom")
+    assert events[0]['error'] == repr(ValueError("boom"))
+
+
+def test_span_without_sinks_is_null():
+    Interface.clearmetricsinks()
+    with Interface._span('work') as span:
+        span.count('rows')
+    assert span is Interface._NULL_SPAN
+
+
+def test_failing_sink_does_not_break_operation(events):
+    def broken(event):
+        raise RuntimeError("sink down")
+    Interface.addmetricsink(broken)
+    with Interface._span('work'):
+        pass
+    assert [event['operation'] for event in events] == ['work']
+
+
+def test_logging_sink_writes_event(caplog):
+    sink = Interface.addmetricsink(Interface.LoggingSink())
+    try:
+        with caplog.at_level(logging.INFO, logger=Interface.__name__):
+            with Interface._span('work', table='ratings') as span:
+                span.count('rows', 5)
+    finally:
+        Interface.removemetricsink(sink)
+
+    [record] = [r for r in caplog.records if r.name == Interface.__name__]
+    assert record.levelno == logging.INFO
+    message = record.getMessage()
+    assert message.startswith("[work] Completed in ")
+    event = json.loads(message[message.index("{"):])
+    assert event['table'] == 'ratings' and event['counters'] == {'rows': 5}
+
+
+def test_json_lines_sink_writes_one_line_per_event(tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    with Interface.JsonLinesSink(str(path)) as sink:
+        assert sink in Interface._METRIC_SINKS
+        for i in range(3):
+            with Interface._span('work', step=i):
+                pass
+    assert sink not in Interface._METRIC_SINKS
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(line['operation'], line['step']) for line in lines] == [('work', 0), ('work', 1), ('work', 2)]
+
+
+def test_public_operations_emit_events(conn, ratingsfile, events):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5), (2, 2, 4.5)]), conn)
+    Interface.rangepartition('ratings', 2, conn)
+    Interface.rangeinsert('ratings', 3, 3, 4.9, conn)
+
+    by_operation = {event['operation']: event for event in events}
+    assert {'loadratings', 'rangepartition', 'rangeinsert'} <= set(by_operation)
+    assert by_operation['rangeinsert']['partition'] == 'range_part1'
+    assert by_operation['rangeinsert']['counters'] == {'rows': 1}
+    assert all('error' not in event for event in events)
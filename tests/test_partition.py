@@ -0,0 +1,540 @@
+#
+# Kiểm thử phân vùng trên PostgreSQL (cần server theo cấu hình của testHelper)
+#
+import time
+
+import pytest
+from psycopg2 import sql
+
+import Interface
+import testHelper
+from conftest import TEST_DATABASE
+
+
+# Số dòng của từng mảnh prefix0 .. prefix(n-1)
+def _counts(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    counts = []
+    for i in range(numberofpartitions):
+        cur.execute(f"SELECT COUNT(*) FROM {prefix}{i}")
+        counts.append(cur.fetchone()[0])
+    cur.close()
+    return counts
+
+
+# Số dòng của từng mảnh range tính phía server: so sánh float8(rating) với các cận bằng SQL
+def _sql_range_counts(conn, numberofpartitions):
+    cur = conn.cursor()
+    cur.execute(sql.SQL("SELECT part, COUNT(*) FROM (SELECT {} AS part FROM ratings) t GROUP BY part").format(
+        Interface._range_case_sql(Interface._range_bounds(numberofpartitions))))
+    parts = dict(cur.fetchall())
+    cur.close()
+    return [parts.get(i, 0) for i in range(numberofpartitions)]
+
+
+# Các rating 0.0 .. 5.0 bước 0.05, nhiều giá trị không biểu diễn đúng bằng float4 và nằm
+# ngay trên cận của các mảnh khi n = 50
+EDGE_RATINGS = [round(k * 0.05, 2) for k in range(101)]
+
+
+@pytest.mark.parametrize('method', ['scan', 'columnar', 'workers', 'server', 'async', 'checkpoint'])
+def test_range_engines_agree_at_bucket_edges(conn, ratingsfile, method):
+    if method == 'columnar':
+        pytest.importorskip('numpy')
+    if method == 'async':
+        pytest.importorskip('psycopg')
+    Interface.loadratings('ratings', ratingsfile([(k, k, r) for k, r in enumerate(EDGE_RATINGS)]), conn)
+    Interface.rangepartition('ratings', 50, conn, method=method, executor='thread')
+    assert _counts(conn, 'range_part', 50) == _sql_range_counts(conn, 50)
+
+
+# Số dòng của các mảnh range nằm sai mảnh theo phép so sánh của SQL
+def _misplaced_range_rows(conn, numberofpartitions):
+    case = Interface._range_case_sql(Interface._range_bounds(numberofpartitions))
+    cur = conn.cursor()
+    misplaced = 0
+    for i in range(numberofpartitions):
+        cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE ({}) IS DISTINCT FROM %s").format(
+            sql.Identifier(f"range_part{i}"), case), (i,))
+        misplaced += cur.fetchone()[0]
+    cur.close()
+    return misplaced
+
+
+@pytest.mark.parametrize('many', [False, True])
+def test_rangeinsert_agrees_with_sql_at_bucket_edges(conn, ratingsfile, many):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 2.5)]), conn)
+    Interface.rangepartition('ratings', 50, conn)
+    rows = [(k, k, r) for k, r in enumerate(EDGE_RATINGS)]
+    if many:
+        Interface.rangeinsert_many('ratings', rows, conn)
+    else:
+        for userid, movieid, rating in rows:
+            Interface.rangeinsert('ratings', userid, movieid, rating, conn)
+    assert sum(_counts(conn, 'range_part', 50)) == len(rows) + 1
+    assert _misplaced_range_rows(conn, 50) == 0
+
+
+def test_workers_method_rejects_nodes(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 2.5)]), conn)
+    with pytest.raises(ValueError):
+        Interface.roundrobinpartition('ratings', 2, conn, method='workers',
+                                      nodes=['dbname=other host=localhost'])
+
+
+# Task chạy trong tiến trình worker: dùng kết nối tới node như _insert_row với mảnh ở xa,
+# trả về tiến trình server phục vụ kết nối đó
+def _node_backend_pid(conn_info):
+    with Interface._node_connection(conn_info) as node_conn:
+        with node_conn.cursor() as cur:
+            cur.execute("SELECT pg_backend_pid()")
+            pid = cur.fetchone()[0]
+        node_conn.commit()
+    return pid
+
+
+def test_process_workers_do_not_share_parent_node_connections(conn):
+    conn_info = Interface._get_conn_info(conn)
+    # Node khác cơ sở dữ liệu của pool worker (giả lập bằng conn_info khác khóa)
+    node_info = dict(conn_info, application_name='node')
+    Interface.closeworkerpools()
+    try:
+        # Pool kết nối tới node (một kết nối) được tạo trước khi fork các tiến trình worker
+        parent_pid = _node_backend_pid(node_info)
+        worker_pids = Interface._run_tasks(_node_backend_pid, [node_info] * 4, conn_info, numworkers=2)
+        assert parent_pid not in worker_pids
+        assert _node_backend_pid(node_info) == parent_pid
+    finally:
+        Interface.closeworkerpools()
+
+
+# Mảnh round-robin chứa từng userid
+def _rrobin_fragment_of(conn, numberofpartitions):
+    cur = conn.cursor()
+    where = {}
+    for i in range(numberofpartitions):
+        cur.execute(sql.SQL("SELECT userid FROM {}").format(sql.Identifier(f"rrobin_part{i}")))
+        where.update((userid, i) for userid, in cur.fetchall())
+    cur.close()
+    return where
+
+
+def test_roundrobininsert_many_continues_single_insert_order(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(k, k, 1.0) for k in range(7)]), conn)
+    Interface.roundrobinpartition('ratings', 3, conn)
+    # 7 dòng đã chia: slot tiếp theo là 7
+    Interface.roundrobininsert('ratings', 100, 1, 1.0, conn)
+    Interface.roundrobininsert('ratings', 101, 1, 1.0, conn)
+    assert Interface.roundrobininsert_many('ratings', [(k, 1, 1.0) for k in range(102, 107)], conn) == [2, 2, 1]
+    Interface.roundrobininsert('ratings', 107, 1, 1.0, conn)
+
+    where = _rrobin_fragment_of(conn, 3)
+    assert [where[k] for k in range(100, 108)] == [slot % 3 for slot in range(7, 15)]
+    assert _counts(conn, 'rrobin_part', 3) == [5, 5, 5]
+
+
+# Số kết nối tới cơ sở dữ liệu kiểm thử, chờ tối đa vài giây cho các kết nối đã đóng biến mất
+def _backends(conn, atmost):
+    cur = conn.cursor()
+    for _ in range(50):
+        cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+        count = cur.fetchone()[0]
+        if count <= atmost:
+            break
+        time.sleep(0.1)
+    cur.close()
+    return count
+
+
+def test_process_pool_is_replaced_when_worker_count_changes(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(k, k, (k % 11) * 0.5) for k in range(100)]), conn)
+    Interface.closeworkerpools()
+    try:
+        for numworkers in (2, 3, 4, 5):
+            Interface.rangepartition('ratings', 5, conn, method='workers', numworkers=numworkers)
+            assert sum(_counts(conn, 'range_part', 5)) == 100
+        assert len(Interface._PROCESS_POOLS) == 1
+        # Kết nối của test và một kết nối cho mỗi tiến trình của pool cuối cùng
+        assert _backends(conn, 1 + 5) <= 1 + 5
+    finally:
+        Interface.closeworkerpools()
+
+
+# Số dòng của từng mảnh range theo phép so sánh của SQL với các cận bounds
+def _sql_counts_for_bounds(conn, bounds):
+    cur = conn.cursor()
+    cur.execute(sql.SQL("SELECT part, COUNT(*) FROM (SELECT {} AS part FROM ratings) t GROUP BY part").format(
+        Interface._range_case_sql(bounds)))
+    parts = dict(cur.fetchall())
+    cur.close()
+    return [parts.get(i, 0) for i in range(len(bounds))]
+
+
+@pytest.mark.parametrize('method', ['scan', 'columnar', 'server'])
+def test_rangepartition_with_custom_boundaries(conn, ratingsfile, method):
+    if method == 'columnar':
+        pytest.importorskip('numpy')
+    Interface.loadratings('ratings', ratingsfile([(k, k, r) for k, r in enumerate(EDGE_RATINGS)]), conn)
+    bounds = [0.5, 3.0, 4.5, 5.0]
+    Interface.rangepartition('ratings', 4, conn, method=method, boundaries=bounds)
+    counts = _counts(conn, 'range_part', 4)
+    assert sum(counts) == len(EDGE_RATINGS)
+    assert counts == _sql_counts_for_bounds(conn, bounds)
+    assert Interface._get_partition_meta(conn, 'range')['boundaries'] == bounds
+
+
+@pytest.mark.parametrize('bounds', [[1.0, 2.0, 4.5], [-1.0, 2.0, 5.0], [1.0, 5.0], [3.0, 2.0, 5.0]])
+def test_rangepartition_rejects_boundaries_that_drop_rows(conn, ratingsfile, bounds):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 5.0)]), conn)
+    with pytest.raises(ValueError):
+        Interface.rangepartition('ratings', 3, conn, boundaries=bounds)
+    with pytest.raises(ValueError):
+        Interface.loadandpartition(ratingsfile([(1, 1, 5.0)], 'more.dat'), 'range', 3, conn, boundaries=bounds)
+
+
+def test_rangepartition_with_quantile_boundaries(conn, ratingsfile):
+    # Phân bố lệch: phần lớn rating nằm trong [4.0, 5.0]
+    rows = [(k, k, 4.0 + (k % 11) * 0.1 if k % 5 else (k % 8) * 0.5) for k in range(1000)]
+    Interface.loadratings('ratings', ratingsfile(rows), conn)
+    Interface.rangepartition('ratings', 4, conn, boundaries='quantile')
+    bounds = Interface._get_partition_meta(conn, 'range')['boundaries']
+    assert bounds == sorted(bounds) and bounds[-1] == 5.0
+    counts = _counts(conn, 'range_part', 4)
+    assert sum(counts) == len(rows)
+    assert counts == _sql_counts_for_bounds(conn, bounds)
+    # Chia theo phân vị cân bằng hơn nhiều so với các khoảng bằng nhau (3 mảnh đầu gần như rỗng)
+    assert max(counts) < 2 * len(rows) / 4
+    assert max(_sql_counts_for_bounds(conn, Interface._range_bounds(4))) > 0.75 * len(rows)
+
+
+# Nội dung (đã sắp xếp) của từng mảnh prefix0 .. prefix(n-1) và của bảng ratings
+def _contents(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    contents = []
+    for table in [f"{prefix}{i}" for i in range(numberofpartitions)] + ['ratings']:
+        cur.execute(sql.SQL("SELECT userid, movieid, rating FROM {} ORDER BY 1, 2, 3").format(sql.Identifier(table)))
+        contents.append(cur.fetchall())
+    cur.close()
+    return contents
+
+
+@pytest.mark.parametrize('scheme, partition', [('range', 'rangepartition'), ('rrobin', 'roundrobinpartition'),
+                                               ('hash', 'hashpartition')])
+def test_loadandpartition_matches_load_then_partition(conn, ratingsfile, scheme, partition):
+    path = ratingsfile([(k % 97, k, r) for k, r in enumerate(EDGE_RATINGS * 3)])
+    prefix = Interface._SCHEME_PREFIXES[scheme]
+    Interface.loadandpartition(path, scheme, 7, conn)
+    single_pass = _contents(conn, prefix, 7)
+
+    testHelper.deleteAllPublicTables(conn)
+    Interface._PARTITION_CACHE.clear()
+    Interface.loadratings('ratings', path, conn)
+    getattr(Interface, partition)('ratings', 7, conn)
+    assert _contents(conn, prefix, 7) == single_pass
+    assert sum(map(len, single_pass[:-1])) == len(single_pass[-1]) == len(EDGE_RATINGS) * 3
+
+
+# relpersistence của từng mảnh ('p' = logged, 'u' = unlogged)
+def _persistence(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    cur.execute("SELECT relname, relpersistence FROM pg_class WHERE relname = ANY(%s)",
+                ([f"{prefix}{i}" for i in range(numberofpartitions)],))
+    persistence = dict(cur.fetchall())
+    cur.close()
+    return [persistence.get(f"{prefix}{i}") for i in range(numberofpartitions)]
+
+
+@pytest.mark.parametrize('setlogged, expected', [(True, 'p'), (False, 'u')])
+@pytest.mark.parametrize('scheme, partition, method', [
+    ('range', 'rangepartition', 'scan'), ('range', 'rangepartition', 'workers'),
+    ('rrobin', 'roundrobinpartition', 'stream'), ('hash', 'hashpartition', 'scan')])
+def test_unlogged_bulk_load_switches_fragments_back_to_logged(conn, ratingsfile, scheme, partition, method,
+                                                              setlogged, expected):
+    Interface.loadratings('ratings', ratingsfile([(k, k, r) for k, r in enumerate(EDGE_RATINGS)]), conn)
+    prefix = Interface._SCHEME_PREFIXES[scheme]
+    getattr(Interface, partition)('ratings', 4, conn, method=method, unlogged=True, setlogged=setlogged)
+    assert _persistence(conn, prefix, 4) == [expected] * 4
+    assert sum(_counts(conn, prefix, 4)) == len(EDGE_RATINGS)
+
+
+def test_loadandpartition_unlogged_switches_fragments_back_to_logged(conn, ratingsfile):
+    Interface.loadandpartition(ratingsfile([(k, k, r) for k, r in enumerate(EDGE_RATINGS)]), 'range', 4, conn,
+                               unlogged=True)
+    assert _persistence(conn, 'range_part', 4) == ['p'] * 4
+    assert sum(_counts(conn, 'range_part', 4)) == len(EDGE_RATINGS)
+
+
+# Các index phụ hiện có trên từng mảnh: tên index phụ -> phương thức (btree / brin)
+def _fragment_indexes(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    found = []
+    for i in range(numberofpartitions):
+        table = f"{prefix}{i}"
+        cur.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", (table,))
+        found.append({name[len(table) + 1:-len('_idx')]: definition.split(' USING ')[1].split(' ')[0]
+                      for name, definition in cur.fetchall()})
+    cur.close()
+    return found
+
+
+# Danh sách index phụ ghi trong bảng metadata (không qua bộ nhớ đệm)
+def _meta_indexes(conn, scheme):
+    cur = conn.cursor()
+    cur.execute(sql.SQL("SELECT indexes FROM {} WHERE scheme = %s").format(
+        sql.Identifier(Interface.PARTITION_META_TABLE)), (scheme,))
+    indexes = cur.fetchone()[0]
+    cur.close()
+    return indexes
+
+
+def test_create_and_drop_fragment_indexes_update_metadata(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(k, k, r) for k, r in enumerate(EDGE_RATINGS)]), conn)
+    Interface.rangepartition('ratings', 3, conn)
+    assert _fragment_indexes(conn, 'range_part', 3) == [{}] * 3
+
+    assert Interface.createfragmentindexes('range', conn, indexes=('userid', 'rating_brin'),
+                                           numworkers=2) == ['userid', 'rating_brin']
+    assert _fragment_indexes(conn, 'range_part', 3) == [{'userid': 'btree', 'rating_brin': 'brin'}] * 3
+    assert _meta_indexes(conn, 'range') == ['userid', 'rating_brin']
+
+    # Thêm index: danh sách trong metadata được gộp, không trùng lặp
+    assert Interface.createfragmentindexes('range', conn, indexes=('movieid', 'userid')) == [
+        'userid', 'rating_brin', 'movieid']
+    assert _meta_indexes(conn, 'range') == ['userid', 'rating_brin', 'movieid']
+
+    # Mảnh mới khi repartition được dựng đủ các index trong metadata
+    Interface.repartition('range', 5, conn)
+    assert _fragment_indexes(conn, 'range_part', 5) == [
+        {'userid': 'btree', 'rating_brin': 'brin', 'movieid': 'btree'}] * 5
+
+    assert Interface.dropfragmentindexes('range', conn, indexes=('userid',)) == ['rating_brin', 'movieid']
+    assert _fragment_indexes(conn, 'range_part', 5) == [{'rating_brin': 'brin', 'movieid': 'btree'}] * 5
+    assert _meta_indexes(conn, 'range') == ['rating_brin', 'movieid']
+
+    assert Interface.dropfragmentindexes('range', conn) == []
+    assert _fragment_indexes(conn, 'range_part', 5) == [{}] * 5
+    assert _meta_indexes(conn, 'range') is None
+
+
+def test_createfragmentindexes_defaults_and_validation(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 2.5), (2, 2, 4.5)]), conn)
+    with pytest.raises(ValueError):
+        Interface.createfragmentindexes('hash', conn)
+    Interface.hashpartition('ratings', 2, conn)
+    with pytest.raises(ValueError):
+        Interface.createfragmentindexes('hash', conn, indexes=('nosuchindex',))
+    assert Interface.createfragmentindexes('hash', conn) == list(Interface.DEFAULT_FRAGMENT_INDEXES['hash'])
+    assert _fragment_indexes(conn, 'hash_part', 2) == [{'userid': 'btree', 'movieid': 'btree'}] * 2
+    assert _meta_indexes(conn, 'hash') == ['userid', 'movieid']
+
+
+# Chờ tối đa vài giây cho tới khi cond() đúng
+def _wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return cond()
+
+
+def test_insertbuffer_flushes_when_full(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5)]), conn)
+    Interface.rangepartition('ratings', 2, conn)
+    buf = Interface.InsertBuffer('ratings', conn, flush_rows=3, flush_seconds=None)
+    buf.extend([(10, 1, 1.0), (11, 1, 4.0)])
+    assert len(buf) == 2 and buf.flushes == 0
+    assert _counts(conn, 'range_part', 2) == [1, 0]
+    buf.add(12, 1, 4.5)
+    assert len(buf) == 0 and buf.flushes == 1 and buf.rows == 3
+    assert _counts(conn, 'range_part', 2) == [2, 2]
+    buf.close()
+
+
+def test_insertbuffer_flushes_after_flush_seconds(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5)]), conn)
+    Interface.roundrobinpartition('ratings', 2, conn)
+    buf = Interface.InsertBuffer('ratings', conn, scheme='rrobin', flush_rows=1000, flush_seconds=0.2)
+    buf.extend([(10, 1, 1.0), (11, 1, 4.0), (12, 1, 3.0)])
+    assert _wait_for(lambda: buf.flushes == 1)
+    assert len(buf) == 0 and buf.rows == 3
+    buf.close()
+    assert _counts(conn, 'rrobin_part', 2) == [2, 2]
+
+
+def test_insertbuffer_flushes_on_close(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5)]), conn)
+    Interface.hashpartition('ratings', 3, conn)
+    with Interface.InsertBuffer('ratings', conn, scheme='hash', flush_rows=1000, flush_seconds=60) as buf:
+        buf.extend((k, k, 2.0) for k in range(10, 20))
+        assert buf.flushes == 0
+    assert buf.rows == 10 and len(buf) == 0
+    assert sum(_counts(conn, 'hash_part', 3)) == 11
+    buf.close()
+    with pytest.raises(ValueError):
+        buf.add(1, 1, 1.0)
+
+
+def test_insertbuffer_keeps_rows_and_reraises_background_error(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(1, 1, 0.5)]), conn)
+    # Chưa phân vùng: lần flush nền lỗi, các dòng vẫn nằm trong bộ đệm
+    buf = Interface.InsertBuffer('ratings', conn, flush_rows=1000, flush_seconds=0.1)
+    buf.extend([(10, 1, 1.0), (11, 1, 4.0)])
+    assert _wait_for(lambda: buf._error is not None)
+    with pytest.raises(ValueError, match='No range partitions'):
+        buf.add(12, 1, 4.5)
+    assert len(buf) == 2 and buf.rows == 0 and buf.flushes == 0
+    with pytest.raises(ValueError, match='No range partitions'):
+        buf.flush()
+    assert len(buf) == 2
+
+    # close bỏ qua lỗi nền còn treo và ghi nốt các dòng khi đã có mảnh
+    Interface.rangepartition('ratings', 2, conn)
+    buf.close()
+    assert buf.rows == 2 and len(buf) == 0
+    assert _counts(conn, 'range_part', 2) == [2, 1]
+
+
+# Các mảnh prefixN có trên một cơ sở dữ liệu
+def _fragments(conn, prefix):
+    cur = conn.cursor()
+    cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename LIKE %s",
+                (prefix + '%',))
+    names = sorted(name for name, in cur.fetchall())
+    cur.close()
+    return names
+
+
+def test_partitioning_again_drops_fragments_of_previous_placement(conn, ratingsfile, node):
+    node_dsn, node_conn = node
+    local_dsn = f"dbname={TEST_DATABASE} host=localhost user=postgres password=123456"
+    Interface.loadratings('ratings', ratingsfile([(k, k, (k % 11) * 0.5) for k in range(50)]), conn)
+
+    Interface.rangepartition('ratings', 4, conn, nodes=[local_dsn, node_dsn])
+    assert _fragments(conn, 'range_part') == ['range_part0', 'range_part2']
+    assert _fragments(node_conn, 'range_part') == ['range_part1', 'range_part3']
+
+    # Mọi mảnh sang node: các mảnh cũ ở node điều phối bị xóa
+    Interface.rangepartition('ratings', 3, conn, nodes=[node_dsn])
+    assert _fragments(conn, 'range_part') == []
+    assert _fragments(node_conn, 'range_part') == ['range_part0', 'range_part1', 'range_part2']
+
+    # Không truyền nodes: các mảnh cũ trên node bị xóa
+    Interface.rangepartition('ratings', 2, conn)
+    assert _fragments(conn, 'range_part') == ['range_part0', 'range_part1']
+    assert _fragments(node_conn, 'range_part') == []
+    assert sum(_counts(conn, 'range_part', 2)) == 50
+
+    Interface.roundrobinpartition('ratings', 3, conn, nodes=[node_dsn])
+    Interface.roundrobinpartition('ratings', 2, conn)
+    assert _fragments(node_conn, 'rrobin_part') == []
+    assert _counts(conn, 'rrobin_part', 2) == [25, 25]
+
+
+# Báo cáo autotune trong event của thao tác operation
+def _autotune_report(operation, call):
+    received = []
+    Interface.addmetricsink(received.append)
+    try:
+        call()
+    finally:
+        Interface.removemetricsink(received.append)
+    return [event for event in received if event['operation'] == operation][-1]['autotune']
+
+
+def test_autotune_workers_is_capped_by_connections_the_pools_hold(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(k, k, (k % 11) * 0.5) for k in range(100)]), conn)
+    Interface.closeworkerpools()
+    try:
+        # Pool luồng còn giữ một kết nối rảnh tới cơ sở dữ liệu sau lần chạy executor='thread'
+        Interface.rangepartition('ratings', 4, conn, method='workers', numworkers=3, executor='thread')
+        assert Interface._pooled_connections(Interface._get_conn_info(conn), 'process') == 1
+
+        report = _autotune_report('rangepartition', lambda: Interface.rangepartition(
+            'ratings', 4, conn, method='workers', autotune=True, maxconnections=3))
+        # Số worker là giới hạn theo ngân sách, không phải giá trị đo được
+        assert report['maxworkers'] == report['maxconcurrency'] == 2
+        assert 'concurrency' not in report
+        assert set(report['batch_size']) == {f"range_part{i}" for i in range(4)}
+        assert sum(_counts(conn, 'range_part', 4)) == 100
+        # Kết nối của test cộng không quá maxconnections kết nối của các pool
+        assert _backends(conn, 1 + 3) <= 1 + 3
+
+        with pytest.raises(ValueError):
+            Interface.roundrobinpartition('ratings', 4, conn, method='workers', autotune=True, maxconnections=1)
+    finally:
+        Interface.closeworkerpools()
+
+
+def test_autotune_stream_needs_a_reader_and_a_writer(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile([(k, k, 2.5) for k in range(40)]), conn)
+    Interface.closeworkerpools()
+    with pytest.raises(ValueError):
+        Interface.roundrobinpartition('ratings', 4, conn, method='stream', autotune=True, maxconnections=1)
+    report = _autotune_report('roundrobinpartition', lambda: Interface.roundrobinpartition(
+        'ratings', 4, conn, method='stream', autotune=True, maxconnections=2))
+    assert report['maxconcurrency'] == report['concurrency'] == 1
+    assert _counts(conn, 'rrobin_part', 4) == [10] * 4
+
+
+# Writer COPY binary làm hỏng chunk đang ghi ở lần ghi thứ fail_at + 1 (đếm trên mọi chunk), tắt bằng armed = False
+class _FailingWriter(Interface.CopyBinaryWriter):
+    writes = 0
+    fail_at = None
+    armed = True
+
+    def write(self, cur, tableName, dataTuples):
+        if _FailingWriter.armed and _FailingWriter.writes == _FailingWriter.fail_at:
+            raise RuntimeError("injected chunk failure")
+        _FailingWriter.writes += 1
+        super().write(cur, tableName, dataTuples)
+
+
+# Các dòng (userid, movieid, rating) của mọi mảnh prefix0 .. prefix(n-1)
+def _fragment_rows(conn, prefix, numberofpartitions):
+    cur = conn.cursor()
+    rows = []
+    for i in range(numberofpartitions):
+        cur.execute(sql.SQL("SELECT userid, movieid, rating FROM {}").format(sql.Identifier(f"{prefix}{i}")))
+        rows.extend(cur.fetchall())
+    cur.close()
+    return sorted(rows)
+
+
+@pytest.mark.parametrize('scheme, partition', [('range', Interface.rangepartition),
+                                               ('rrobin', Interface.roundrobinpartition)])
+def test_resumepartition_after_failed_chunk_writes_every_row_once(conn, ratingsfile, monkeypatch,
+                                                                   scheme, partition):
+    # Mỗi chunk một block (khoảng 200 dòng), mỗi chunk có rating của mọi mảnh nên ghi đủ 3 mảnh
+    monkeypatch.setattr(Interface, 'CHECKPOINT_CHUNK_ROWS', Interface._ROWS_PER_BLOCK)
+    monkeypatch.setitem(Interface.WRITERS, 'failing', _FailingWriter)
+    monkeypatch.setattr(_FailingWriter, 'writes', 0)
+    monkeypatch.setattr(_FailingWriter, 'fail_at', 3 * 3 + 1)
+    monkeypatch.setattr(_FailingWriter, 'armed', True)
+    Interface.loadratings('ratings', ratingsfile([(k, k % 97, (k % 11) * 0.5) for k in range(3000)]), conn)
+    prefix = Interface._SCHEME_PREFIXES[scheme]
+
+    # Một worker luồng: chunk 0 .. 2 xong, chunk 3 hỏng sau khi đã ghi một mảnh, các chunk sau bị hủy
+    with pytest.raises(RuntimeError, match='injected'):
+        partition('ratings', 3, conn, method='checkpoint', writer='failing', numworkers=1, executor='thread')
+    status = Interface.partitionjobstatus(scheme, conn)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM ratings WHERE ctid < '(3,0)'::tid")
+    firstrows = cur.fetchone()[0]
+    cur.close()
+    assert status['status'] == 'running'
+    assert status['chunks'] > 4 and status['donechunks'] == 3
+    assert status['rows'] == 3000 and status['donerows'] == firstrows
+    assert len(_fragment_rows(conn, prefix, 3)) == firstrows
+
+    _FailingWriter.armed = False
+    assert Interface.resumepartition(scheme, conn, numworkers=2, executor='thread') == 3000 - firstrows
+    status = Interface.partitionjobstatus(scheme, conn)
+    assert status['status'] == 'done'
+    assert status['donechunks'] == status['chunks'] and status['donerows'] == 3000
+    assert _fragment_rows(conn, prefix, 3) == sorted((k, k % 97, (k % 11) * 0.5) for k in range(3000))
+    if scheme == 'range':
+        assert _counts(conn, 'range_part', 3) == _sql_range_counts(conn, 3)
+    else:
+        # Dòng thứ k theo thứ tự nạp (userid = k) nằm ở mảnh k % 3
+        assert _rrobin_fragment_of(conn, 3) == {k: k % 3 for k in range(3000)}
+    # Đã hoàn tất: chạy lại không ghi gì
+    assert Interface.resumepartition(scheme, conn) == 0
@@ -0,0 +1,176 @@
+#
+# Kiểm thử truy vấn scatter-gather của query.py
+#
+import threading
+
+import pytest
+from psycopg2 import sql
+
+import Interface
+import query
+
+
+# Chạy func trong một luồng, trả về kết quả hoặc báo lỗi nếu không xong trong timeout giây
+def _run_with_timeout(func, timeout=60):
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func()
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "query did not finish (deadlock)"
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def test_nested_queries_do_not_deadlock(conn, ratingsfile, monkeypatch):
+    # Hàng đợi kết quả nhỏ và ít luồng để vòng lặp ngoài chắc chắn làm đầy hàng đợi
+    monkeypatch.setattr(query, 'FETCH_SIZE', 1)
+    monkeypatch.setattr(query, 'QUEUE_SIZE', 1)
+    monkeypatch.setattr(query, 'MAX_THREADS', 2)
+    rows = [(userid, userid * 10 + k, (userid + k) % 5 + 0.5) for userid in range(1, 41) for k in range(3)]
+    Interface.loadratings('ratings', ratingsfile(rows), conn)
+    Interface.roundrobinpartition('ratings', 5, conn)
+
+    def nested():
+        stats = {}
+        for _, userid, _, _ in query.rangequery(0.0, 5.0, conn, schemes=('rrobin',)):
+            stats[userid] = query.ratingstats(conn, userid=userid, scheme='rrobin')['count']
+        return stats
+
+    assert _run_with_timeout(nested) == {userid: 3 for userid in range(1, 41)}
+
+
+def test_nested_queries_overflow_a_full_read_pool(conn, ratingsfile, monkeypatch):
+    # Pool đọc một kết nối: vòng lặp ngoài giữ nó, truy vấn lồng nhau phải mở kết nối mới
+    query.closereadpools()
+    monkeypatch.setattr(query, 'READ_POOL_SIZE', 1)
+    monkeypatch.setattr(query, 'FETCH_SIZE', 1)
+    monkeypatch.setattr(query, 'QUEUE_SIZE', 1)
+    monkeypatch.setattr(query, 'MAX_THREADS', 1)
+    Interface.loadratings('ratings', ratingsfile([(userid, 1, 2.5) for userid in range(1, 21)]), conn)
+    Interface.roundrobinpartition('ratings', 2, conn)
+
+    def nested():
+        return {userid: query.ratingstats(conn, userid=userid, scheme='rrobin')['count']
+                for _, userid, _, _ in query.rangequery(0.0, 5.0, conn, schemes=('rrobin',))}
+
+    try:
+        assert _run_with_timeout(nested) == {userid: 1 for userid in range(1, 21)}
+    finally:
+        query.closereadpools()
+
+
+# Tiến trình server phục vụ từng lần đọc mảnh
+def _fanout_backends(conn):
+    fragments = query._fragments(conn, 'rrobin')
+    return {row[1] for row in query._fanout(conn, fragments, sql.SQL("SELECT pg_backend_pid() FROM {} LIMIT 1"))}
+
+
+def test_fanout_reuses_read_pool_connections(conn, ratingsfile, monkeypatch):
+    query.closereadpools()
+    Interface.closeworkerpools()
+    monkeypatch.setattr(query, 'MAX_THREADS', 1)
+    Interface.loadratings('ratings', ratingsfile([(userid, 1, 2.5) for userid in range(1, 5)]), conn)
+    Interface.roundrobinpartition('ratings', 2, conn)
+    try:
+        first = _fanout_backends(conn)
+        assert len(first) == 1
+        assert _fanout_backends(conn) == first
+        # Pool đọc tách khỏi pool ghi của Interface
+        assert Interface._conn_key(Interface._get_conn_info(conn)) in query._READ_POOLS
+        assert not Interface._THREAD_POOLS
+    finally:
+        query.closereadpools()
+
+
+def test_fanout_results_match_fragments(conn, ratingsfile):
+    rows = [(k, k, k % 10 / 2) for k in range(200)]
+    Interface.loadratings('ratings', ratingsfile(rows), conn)
+    Interface.rangepartition('ratings', 4, conn)
+    got = sorted(row[1:] for row in query.rangequery(1.0, 3.0, conn, schemes=('range',)))
+    assert got == sorted(row for row in rows if 1.0 <= row[2] <= 3.0)
+    assert query.mostratedmovies(1, conn) == [(0, 1)]
+
+
+def test_growing_thread_pool_keeps_borrowed_connections(conn):
+    conn_info = Interface._get_conn_info(conn)
+    Interface.closeworkerpools()
+    try:
+        executor = Interface._get_thread_pool(conn_info, 1)
+        with Interface._worker_connection(conn_info) as borrowed:
+            running = executor.submit(lambda: Interface._get_thread_pool(conn_info, 4))
+            running.result(timeout=30)
+            cur = borrowed.cursor()
+            cur.execute("SELECT 1")
+            assert cur.fetchone() == (1,)
+            cur.close()
+        assert Interface._get_thread_pool(conn_info, 2) is Interface._get_thread_pool(conn_info, 4)
+    finally:
+        Interface.closeworkerpools()
+
+
+# Ratings có nhiều dòng cho mỗi phim và mỗi người dùng, rating bội của 0.5 (tổng float chính xác)
+AGGREGATE_ROWS = [(k % 37 + 1, (k * 7) % 23 + 1, (k * 3) % 11 * 0.5) for k in range(500)]
+
+
+# Phân vùng cùng dữ liệu theo cả ba scheme
+@pytest.fixture
+def partitioned(conn, ratingsfile):
+    Interface.loadratings('ratings', ratingsfile(AGGREGATE_ROWS), conn)
+    Interface.rangepartition('ratings', 4, conn)
+    Interface.roundrobinpartition('ratings', 3, conn)
+    Interface.hashpartition('ratings', 5, conn)
+    return conn
+
+
+# COUNT/SUM/MIN/MAX/AVG theo groupby tính thẳng trên bảng ratings
+def _sql_aggregate(conn, groupby):
+    cur = conn.cursor()
+    cur.execute(f"SELECT {groupby}, COUNT(*), SUM(rating::float8), MIN(rating), MAX(rating) "
+                f"FROM ratings GROUP BY {groupby}")
+    expected = {key: {'count': cnt, 'sum': total, 'min': low, 'max': high, 'avg': total / cnt}
+                for key, cnt, total, low, high in cur.fetchall()}
+    cur.close()
+    return expected
+
+
+@pytest.mark.parametrize('scheme', ['range', 'rrobin', 'hash'])
+@pytest.mark.parametrize('groupby', ['movieid', 'userid'])
+def test_aggregate_matches_sql_group_by(partitioned, scheme, groupby):
+    assert query.aggregate(partitioned, groupby, scheme) == _sql_aggregate(partitioned, groupby)
+
+
+@pytest.mark.parametrize('scheme', ['range', 'rrobin', 'hash'])
+def test_movieaverages_and_usercounts_match_sql(partitioned, scheme):
+    movies = _sql_aggregate(partitioned, 'movieid')
+    users = _sql_aggregate(partitioned, 'userid')
+    assert query.movieaverages(partitioned, scheme) == {key: stats['avg'] for key, stats in movies.items()}
+    assert query.usercounts(partitioned, scheme) == {key: stats['count'] for key, stats in users.items()}
+
+
+@pytest.mark.parametrize('scheme', ['range', 'rrobin', 'hash'])
+@pytest.mark.parametrize('by', ['count', 'avg', 'sum', 'min', 'max'])
+def test_topk_matches_sql_order(partitioned, scheme, by):
+    expected = _sql_aggregate(partitioned, 'userid')
+    # Giảm dần theo chỉ số, cùng giá trị thì khóa nhỏ trước
+    order = sorted(expected.items(), key=lambda item: (-item[1][by], item[0]))
+    assert query.topk(5, partitioned, 'userid', by, scheme) == order[:5]
+
+
+@pytest.mark.parametrize('scheme', ['range', 'rrobin', 'hash'])
+def test_mostratedmovies_matches_sql(partitioned, scheme):
+    cur = partitioned.cursor()
+    cur.execute("SELECT movieid, COUNT(*) FROM ratings GROUP BY movieid ORDER BY COUNT(*) DESC, movieid LIMIT 7")
+    expected = cur.fetchall()
+    cur.close()
+    assert query.mostratedmovies(7, partitioned, scheme) == expected
+    assert query.mostratedmovies(100, partitioned, scheme) == sorted(
+        ((key, stats['count']) for key, stats in _sql_aggregate(partitioned, 'movieid').items()),
+        key=lambda item: (-item[1], item[0]))